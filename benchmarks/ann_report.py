@@ -0,0 +1,159 @@
+"""
+รายงาน recall/latency ของดัชนี ANN (IVF-Flat, HNSW) เทียบกับ exact search
+ใช้เลือกพารามิเตอร์ใน EmbeddingConfig (ivf_nlist, ivf_nprobe, hnsw_m, hnsw_ef_search)
+
+ตัวอย่าง:
+    python -m benchmarks.ann_report --size 100000 --dim 768
+    python -m benchmarks.ann_report --from-db --json ann_report.json
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from config import config
+from services.ann_index import AnnIndex, faiss
+from services.vector_index import VectorIndex
+
+def synthetic_clusters(size: int, dim: int, clusters: int = 256, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """สร้าง vectors แบบกลุ่มก้อน (ใกล้เคียง embeddings จริงมากกว่าสุ่มล้วน) ส่งคืน (vectors, กลุ่มของแต่ละ vector)"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=size)
+    vectors = centers[labels] + 0.6 * rng.normal(size=(size, dim)).astype(np.float32)
+    return VectorIndex.normalize(vectors), labels
+
+def synthetic_corpus(size: int, dim: int, clusters: int = 256, seed: int = 0) -> np.ndarray:
+    """vectors สังเคราะห์แบบกลุ่มก้อน"""
+    return synthetic_clusters(size, dim, clusters, seed)[0]
+
+def load_database_corpus() -> Tuple[np.ndarray, np.ndarray]:
+    """ดึง embeddings จริงจากฐานข้อมูล"""
+    index = VectorIndex()
+    index.build_from_database()
+    ids, matrix = index.snapshot()
+    return ids.copy(), np.array(matrix)
+
+def exact_top_k(matrix: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """คำตอบที่ถูกต้อง (ground truth) ด้วย brute force"""
+    scores = queries @ matrix.T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+def latency_stats(samples: List[float]) -> Dict[str, float]:
+    """สรุป latency เป็นมิลลิวินาที"""
+    values = np.asarray(samples) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "mean_ms": round(float(values.mean()), 3)
+    }
+
+def measure(search, queries: np.ndarray, truth_ids: np.ndarray, k: int) -> Dict[str, float]:
+    """วัด recall@k และ latency ต่อ query"""
+    timings = []
+    hits = 0
+    for query, truth in zip(queries, truth_ids):
+        started = time.perf_counter()
+        found, _ = search(query, k)
+        timings.append(time.perf_counter() - started)
+        hits += len(np.intersect1d(found, truth))
+
+    result = latency_stats(timings)
+    result["recall_at_k"] = round(hits / truth_ids.size, 4)
+    return result
+
+def run_report(ids: np.ndarray, matrix: np.ndarray, queries: np.ndarray, k: int,
+               nprobes: List[int], ef_searches: List[int]) -> Dict:
+    """สร้างรายงานสำหรับ exact, IVF-Flat และ HNSW"""
+    truth = ids[exact_top_k(matrix, queries, k)]
+
+    exact = VectorIndex()
+    exact.add(ids, matrix)
+    exact.is_built = True
+
+    report = {
+        "corpus_size": int(len(ids)),
+        "dim": int(matrix.shape[1]),
+        "queries": int(len(queries)),
+        "k": k,
+        "exact": measure(lambda q, n: exact.search(q, n), queries, truth, k),
+        "ann": []
+    }
+
+    with tempfile.TemporaryDirectory() as folder:
+        for index_type, sweep, param in (("ivf_flat", nprobes, "nprobe"), ("hnsw", ef_searches, "ef_search")):
+            ann = AnnIndex(index_type, folder)
+            started = time.perf_counter()
+            ann.build(ids, matrix)
+            build_seconds = time.perf_counter() - started
+            ann.save(force=True)
+            index_bytes = os.path.getsize(ann.index_path)
+
+            for value in sweep:
+                ann.set_search_params(**{param: value})
+                row = {"index_type": index_type, param: value,
+                       "build_seconds": round(build_seconds, 2), "index_mb": round(index_bytes / 2**20, 1)}
+                row.update(measure(ann.search, queries, truth, k))
+                report["ann"].append(row)
+
+    return report
+
+def print_report(report: Dict):
+    """แสดงรายงานเป็นตาราง"""
+    print(f"คลัง {report['corpus_size']} vectors x {report['dim']} มิติ, {report['queries']} queries, k={report['k']}")
+    exact = report["exact"]
+    print(f"{'exact':<10} {'':<14} recall=1.0000  p50={exact['p50_ms']:.3f}ms  p95={exact['p95_ms']:.3f}ms")
+    for row in report["ann"]:
+        param = f"nprobe={row['nprobe']}" if "nprobe" in row else f"efSearch={row['ef_search']}"
+        print(f"{row['index_type']:<10} {param:<14} recall={row['recall_at_k']:.4f}  "
+              f"p50={row['p50_ms']:.3f}ms  p95={row['p95_ms']:.3f}ms  "
+              f"build={row['build_seconds']}s  size={row['index_mb']}MB")
+
+def main():
+    parser = argparse.ArgumentParser(description="วัด recall/latency ของดัชนี ANN เทียบกับ exact search")
+    parser.add_argument("--from-db", action="store_true", help="ใช้ embeddings จริงจากฐานข้อมูล")
+    parser.add_argument("--size", type=int, default=50000, help="จำนวน vectors สังเคราะห์")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32, 64])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 32, 64, 128, 256])
+    parser.add_argument("--json", help="บันทึกผลเป็นไฟล์ JSON")
+    args = parser.parse_args()
+
+    if faiss is None:
+        raise SystemExit("ต้องติดตั้ง faiss-cpu ก่อน")
+
+    if args.from_db:
+        ids, matrix = load_database_corpus()
+    else:
+        matrix = synthetic_corpus(args.size, args.dim)
+        ids = np.arange(1, len(matrix) + 1, dtype=np.int64)
+
+    # query = vector ในคลังที่ถูกรบกวนเล็กน้อย (จำลองคำถามที่ใกล้กับเนื้อหา)
+    rng = np.random.default_rng(1)
+    picks = rng.choice(len(matrix), min(args.queries, len(matrix)), replace=False)
+    queries = VectorIndex.normalize(matrix[picks] + 0.3 * rng.normal(size=(len(picks), matrix.shape[1])) / np.sqrt(matrix.shape[1]))
+
+    report = run_report(ids, matrix, queries, args.k, args.nprobe, args.ef_search)
+    report["config"] = {
+        "ivf_nlist": config.embedding.ivf_nlist,
+        "hnsw_m": config.embedding.hnsw_m,
+        "hnsw_ef_construction": config.embedding.hnsw_ef_construction
+    }
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
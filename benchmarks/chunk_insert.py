@@ -0,0 +1,127 @@
+"""
+วัดความเร็วการบันทึก document_chunks (แถว/วินาที) บนฐานข้อมูล local
+เทียบวิธีเดิม (session.add ทีละแถว + commit ครั้งเดียว) กับ EmbeddingService.insert_chunks (Core INSERT ทีละ batch)
+
+ตัวอย่าง:
+    python -m benchmarks.chunk_insert --rows 20000 --dim 768
+    python -m benchmarks.chunk_insert --url sqlite:///bench.db --batch-size 1000 --json chunk_insert.json
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List
+
+import numpy as np
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+
+from database.models import Base, Document, DocumentChunk, User
+from services.embedding_service import EmbeddingService
+from utils.vector_codec import encode_embedding
+
+MODEL = "nomic-embed-text:latest"
+
+def make_rows(document_id: int, count: int, dim: int, seed: int = 0) -> List[Dict]:
+    """สร้างแถว chunk สังเคราะห์ (ข้อความ ~500 ตัวอักษร + embedding แบบ binary)"""
+    rng = np.random.default_rng(seed)
+    now = datetime.utcnow()
+    return [
+        {
+            "document_id": document_id,
+            "chunk_index": i,
+            "content": f"ส่วนที่ {i} " + "เนื้อหาเอกสารทดสอบ " * 25,
+            "content_type": "text",
+            "embedding_vector": encode_embedding(rng.normal(size=dim).astype(np.float32), MODEL),
+            "embedding_model": MODEL,
+            "created_at": now
+        }
+        for i in range(count)
+    ]
+
+def create_document(Session) -> int:
+    """สร้างผู้ใช้และเอกสารสำหรับผูก chunks"""
+    with Session() as session:
+        user = session.query(User).first()
+        if user is None:
+            user = User(username="bench", email="bench@example.com", full_name="bench")
+            session.add(user)
+            session.flush()
+        document = Document(filename="bench.txt", original_filename="bench.txt", file_path="bench.txt",
+                            file_size=0, file_type="txt", mime_type="text/plain", uploaded_by=user.id)
+        session.add(document)
+        session.commit()
+        return document.id
+
+def insert_orm(Session, rows: List[Dict], batch_size: int):
+    """วิธีเดิม: สร้าง DocumentChunk ทีละแถวแล้ว commit ครั้งเดียวตอนท้าย"""
+    with Session() as session:
+        for row in rows:
+            session.add(DocumentChunk(**row))
+        session.commit()
+
+def insert_bulk(Session, rows: List[Dict], batch_size: int):
+    """วิธีใหม่: Core INSERT แบบ executemany และ commit ทีละ batch"""
+    with Session() as session:
+        EmbeddingService.insert_chunks(session, rows, batch_size)
+
+def measure(Session, method, rows_count: int, dim: int, batch_size: int, repeats: int) -> Dict:
+    """วัดแถว/วินาทีของวิธีหนึ่ง (ใช้ค่า median จากหลายรอบ)"""
+    timings = []
+    for repeat in range(repeats):
+        document_id = create_document(Session)
+        rows = make_rows(document_id, rows_count, dim, seed=repeat)
+        started = time.perf_counter()
+        method(Session, rows, batch_size)
+        timings.append(time.perf_counter() - started)
+
+        with Session() as session:
+            stored = session.query(func.count(DocumentChunk.id)).filter(
+                DocumentChunk.document_id == document_id
+            ).scalar()
+        assert stored == rows_count, f"บันทึกได้ {stored}/{rows_count} แถว"
+
+    seconds = float(np.median(timings))
+    return {"seconds": round(seconds, 3), "rows_per_sec": round(rows_count / seconds, 1)}
+
+def main():
+    parser = argparse.ArgumentParser(description="วัดความเร็วการบันทึก document_chunks")
+    parser.add_argument("--url", help="SQLAlchemy URL (ค่าเริ่มต้น: sqlite ไฟล์ชั่วคราว)")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--json", help="บันทึกผลเป็นไฟล์ JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        url = args.url or f"sqlite:///{os.path.join(folder, 'chunk_insert.db')}"
+        engine = create_engine(url)
+        Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine)
+
+        report = {
+            "url": engine.url.render_as_string(hide_password=True),
+            "rows": args.rows,
+            "dim": args.dim,
+            "batch_size": args.batch_size,
+            "orm_add": measure(Session, insert_orm, args.rows, args.dim, args.batch_size, args.repeats),
+            "bulk_insert": measure(Session, insert_bulk, args.rows, args.dim, args.batch_size, args.repeats)
+        }
+        report["speedup"] = round(report["bulk_insert"]["rows_per_sec"] / report["orm_add"]["rows_per_sec"], 2)
+        engine.dispose()
+
+    print(f"{report['rows']} แถว x {report['dim']} มิติ บน {report['url']}")
+    for name in ("orm_add", "bulk_insert"):
+        print(f"{name:<12} {report[name]['rows_per_sec']:>10.1f} แถว/วินาที  ({report[name]['seconds']} วินาที)")
+    print(f"เร็วขึ้น {report['speedup']} เท่า")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
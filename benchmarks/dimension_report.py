@@ -0,0 +1,176 @@
+"""
+รายงานการลดมิติของ codes รอบแรก (pca, matryoshka) เทียบกับ exact search และ sq8
+วัด recall@k เมื่อจัดอันดับใหม่ด้วย vectors เต็ม (rerank_candidates) และเมื่อใช้รอบแรกอย่างเดียว
+พร้อม latency ต่อ query และหน่วยความจำต่อ chunk ใช้เลือก quantization และ reduced_dim ใน EmbeddingConfig
+
+ตัวอย่าง:
+    python -m benchmarks.dimension_report --size 100000 --dim 768
+    python -m benchmarks.dimension_report --from-db --chat-queries --json dimension_report.json
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from benchmarks.ann_report import exact_top_k, load_database_corpus, measure, synthetic_corpus
+from config import config
+from services.embedding_store import ShardedEmbeddingStore
+from services.vector_index import VectorIndex
+
+def load_chat_queries(count: int) -> Optional[np.ndarray]:
+    """embeddings ของคำถามล่าสุดที่ผู้ใช้ถามจริง (chat_messages) ด้วยโมเดลที่ใช้งานอยู่"""
+    from database.database import get_db_session
+    from database.models import ChatMessage
+    from services.embedding_service import embedding_service
+
+    with get_db_session() as session:
+        questions = [
+            row.content for row in session.query(ChatMessage.content).filter(
+                ChatMessage.role == "user"
+            ).order_by(ChatMessage.id.desc()).limit(count).all()
+        ]
+    vectors = [embedding_service.embed_query(question) for question in questions]
+    vectors = [vector for vector in vectors if vector]
+    if not vectors:
+        return None
+    return VectorIndex.normalize(np.asarray(vectors, dtype=np.float32))
+
+def build_index(folder: str, ids: np.ndarray, matrix: np.ndarray, kind: str,
+                reduced_dim: int = None) -> Tuple[VectorIndex, float]:
+    """ดัชนีบน shard ใน folder พร้อม codes ของ quantization ที่ระบุ ส่งคืน (ดัชนี, เวลาสร้างเป็นวินาที)"""
+    overrides = {"quantization": kind, "quantization_min_rows": 0}
+    if reduced_dim:
+        overrides["reduced_dim"] = reduced_dim
+    saved = {key: getattr(config.embedding, key) for key in overrides}
+    for key, value in overrides.items():
+        setattr(config.embedding, key, value)
+
+    try:
+        index = VectorIndex(store=ShardedEmbeddingStore(config.embedding.model, folder=folder))
+        started = time.perf_counter()
+        index.build(zip(ids, matrix))
+        return index, time.perf_counter() - started
+    finally:
+        for key, value in saved.items():
+            setattr(config.embedding, key, value)
+
+def measure_index(index: VectorIndex, queries: np.ndarray, truth: np.ndarray, k: int, rerank: int) -> Dict:
+    """recall/latency เมื่อจัดอันดับใหม่ rerank อันดับ และเมื่อใช้รอบแรกอย่างเดียว (rerank = k)"""
+    saved = config.embedding.rerank_candidates
+    try:
+        # อ่าน shard ที่ memory-mapped และ codes ให้อยู่ใน page cache ก่อนจับเวลา
+        for query in queries[:10]:
+            index.search(query, k)
+        config.embedding.rerank_candidates = rerank
+        result = {"reranked": measure(index.search, queries, truth, k)}
+        if index.quantizer is not None:
+            config.embedding.rerank_candidates = k
+            result["first_pass"] = measure(index.search, queries, truth, k)
+        return result
+    finally:
+        config.embedding.rerank_candidates = saved
+
+def run_report(ids: np.ndarray, matrix: np.ndarray, queries: np.ndarray, k: int,
+               kinds: List[str], dims: List[int], rerank: int) -> Dict:
+    """สร้างรายงานสำหรับ exact, sq8 และทุกคู่ (ชนิด, จำนวนมิติ)"""
+    dim = int(matrix.shape[1])
+    truth = ids[exact_top_k(matrix, queries, k)]
+    settings = [("none", None), ("sq8", None)] + [
+        (kind, reduced_dim) for kind in kinds for reduced_dim in dims if reduced_dim < dim
+    ]
+
+    report = {
+        "corpus_size": int(len(ids)),
+        "dim": dim,
+        "queries": int(len(queries)),
+        "k": k,
+        "rerank_candidates": rerank,
+        "rows": []
+    }
+
+    with tempfile.TemporaryDirectory() as folder:
+        for kind, reduced_dim in settings:
+            index, build_seconds = build_index(
+                os.path.join(folder, f"{kind}-{reduced_dim or dim}"), ids, matrix, kind, reduced_dim
+            )
+            memory = index.memory_stats()
+            row = {
+                "quantization": memory["quantization"],
+                "reduced_dim": reduced_dim,
+                "build_seconds": round(build_seconds, 2),
+                "full_bytes_per_chunk": memory["full_bytes_per_chunk"],
+                "code_bytes_per_chunk": memory["code_bytes_per_chunk"],
+                "resident_mb": round(memory["resident_bytes"] / 2**20, 1),
+                "mapped_mb": round(memory["mapped_bytes"] / 2**20, 1)
+            }
+            if hasattr(index.quantizer, "explained"):
+                row["explained_variance"] = round(index.quantizer.explained, 4)
+            row.update(measure_index(index, queries, truth, k, rerank))
+            report["rows"].append(row)
+
+    return report
+
+def print_report(report: Dict):
+    """แสดงรายงานเป็นตาราง (latency และหน่วยความจำเทียบกับ exact)"""
+    print(f"คลัง {report['corpus_size']} vectors x {report['dim']} มิติ, {report['queries']} queries, "
+          f"k={report['k']}, rerank={report['rerank_candidates']}")
+    exact = report["rows"][0]["reranked"]
+    for row in report["rows"]:
+        label = row["quantization"] + (f"-{row['reduced_dim']}" if row["reduced_dim"] else "")
+        reranked = row["reranked"]
+        code_bytes = row["code_bytes_per_chunk"]
+        memory = f"{code_bytes}B/chunk ({code_bytes / row['full_bytes_per_chunk']:.0%})" if code_bytes else \
+            f"{row['full_bytes_per_chunk']}B/chunk"
+        line = (f"{label:<16} recall={reranked['recall_at_k']:.4f}  p50={reranked['p50_ms']:.3f}ms  "
+                f"p95={reranked['p95_ms']:.3f}ms ({reranked['p50_ms'] / exact['p50_ms']:.2f}x)  {memory}")
+        if "first_pass" in row:
+            line += f"  รอบแรกอย่างเดียว recall={row['first_pass']['recall_at_k']:.4f}"
+        if "explained_variance" in row:
+            line += f"  variance={row['explained_variance']:.1%}"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="วัด recall/latency/หน่วยความจำของการลดมิติ (pca, matryoshka)")
+    parser.add_argument("--from-db", action="store_true", help="ใช้ embeddings จริงจากฐานข้อมูล")
+    parser.add_argument("--chat-queries", action="store_true",
+                        help="ใช้คำถามจริงจาก chat_messages (เรียก embedding API) แทน vectors ในคลังที่ถูกรบกวน")
+    parser.add_argument("--size", type=int, default=50000, help="จำนวน vectors สังเคราะห์")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--kinds", nargs="+", choices=["pca", "matryoshka"], default=["pca", "matryoshka"])
+    parser.add_argument("--dims", type=int, nargs="+", default=[64, 128, 256, 384])
+    parser.add_argument("--rerank", type=int, default=config.embedding.rerank_candidates)
+    parser.add_argument("--json", help="บันทึกผลเป็นไฟล์ JSON")
+    args = parser.parse_args()
+
+    if args.from_db:
+        ids, matrix = load_database_corpus()
+    else:
+        matrix = synthetic_corpus(args.size, args.dim)
+        ids = np.arange(1, len(matrix) + 1, dtype=np.int64)
+
+    queries = load_chat_queries(args.queries) if args.chat_queries else None
+    query_source = "chat_messages" if queries is not None else "perturbed_corpus"
+    if queries is None:
+        # query = vector ในคลังที่ถูกรบกวนเล็กน้อย (จำลองคำถามที่ใกล้กับเนื้อหา)
+        rng = np.random.default_rng(1)
+        picks = rng.choice(len(matrix), min(args.queries, len(matrix)), replace=False)
+        queries = VectorIndex.normalize(matrix[picks] + 0.3 * rng.normal(size=(len(picks), matrix.shape[1])) / np.sqrt(matrix.shape[1]))
+
+    report = run_report(ids, matrix, queries, args.k, args.kinds, args.dims, args.rerank)
+    report["source"] = "database" if args.from_db else "synthetic"
+    report["query_source"] = query_source
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
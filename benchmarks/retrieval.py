@@ -0,0 +1,324 @@
+"""
+วัด EmbeddingService.search_similar_chunks แบบครบวงจรบนคลังสังเคราะห์ในฐานข้อมูล local
+query embedding มาจาก stub ของ Ollama (benchmarks.stub_ollama) จึงไม่ต้องมี embedding server
+รายงาน latency p50/p95/p99, หน่วยความจำ และ recall@k (เทียบกับ exact search บน vectors เต็ม) ของทุกวิธีค้นหาที่ใช้ได้
+
+ตัวอย่าง:
+    python -m benchmarks.retrieval --chunks 50000 --dim 768
+    python -m benchmarks.retrieval --backends exact sq8 hnsw hybrid --json retrieval.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import create_engine
+
+from benchmarks.ann_report import exact_top_k, latency_stats, synthetic_clusters
+from benchmarks.stub_ollama import StubEmbeddingServer
+from config import config
+from database.database import db_manager
+from database.models import Base, Document, DocumentChunk, User
+from services.ann_index import AnnIndex, faiss
+from services.document_summaries import document_summaries
+from services.embedding_cache import QueryEmbeddingCache
+from services.embedding_service import EmbeddingService
+from services.keyword_index import KeywordIndex
+from services.vector_index import VectorIndex, create_vector_index
+from utils.vector_codec import encode_embedding
+
+# วิธีค้นหา: (ค่าที่เปลี่ยนใน config.embedding, mode ของ search_similar_chunks)
+BACKENDS = {
+    "exact": ({"index_type": "exact", "quantization": "none"}, "vector"),
+    "sq8": ({"index_type": "exact", "quantization": "sq8", "quantization_min_rows": 0}, "vector"),
+    "pq": ({"index_type": "exact", "quantization": "pq", "quantization_min_rows": 0}, "vector"),
+    "pca": ({"index_type": "exact", "quantization": "pca", "quantization_min_rows": 0}, "vector"),
+    "matryoshka": ({"index_type": "exact", "quantization": "matryoshka", "quantization_min_rows": 0}, "vector"),
+    "ivf_flat": ({"index_type": "ivf_flat", "quantization": "none", "ann_min_corpus_size": 0}, "vector"),
+    "hnsw": ({"index_type": "hnsw", "quantization": "none", "ann_min_corpus_size": 0}, "vector"),
+    "hierarchical": ({"index_type": "exact", "quantization": "none", "hierarchical_search": True,
+                      "hierarchical_min_documents": 0}, "vector"),
+    "keyword": ({"index_type": "exact", "quantization": "none"}, "keyword"),
+    "hybrid": ({"index_type": "exact", "quantization": "none"}, "hybrid")
+}
+
+CATEGORIES = ["นโยบาย", "คู่มือ", "แบบฟอร์ม", "รายงาน"]
+WORDS_PER_CLUSTER = 40
+WORDS_PER_CHUNK = 60
+WORDS_PER_QUERY = 8
+
+def cluster_vocabulary(clusters: int, seed: int = 0) -> List[List[str]]:
+    """คำสังเคราะห์ของแต่ละกลุ่ม (chunks ในกลุ่มเดียวกันใช้คำชุดเดียวกัน ให้ BM25 มีความหมายใกล้เคียง vectors)"""
+    rng = np.random.default_rng(seed)
+    syllables = ["กา", "นิ", "ดู", "เล", "โม", "รี", "สา", "ตะ", "พง", "ฮัน", "ka", "ro", "mi", "ten", "su", "va"]
+    vocabulary = []
+    for cluster in range(clusters):
+        words = ["".join(rng.choice(syllables, size=3)) + str(cluster) for _ in range(WORDS_PER_CLUSTER)]
+        vocabulary.append(words)
+    return vocabulary
+
+def chunk_text(rng: np.random.Generator, words: List[str], chunk_id: int) -> str:
+    return " ".join(rng.choice(words, size=WORDS_PER_CHUNK)) + f" CH-{chunk_id:07d}"
+
+def create_corpus(chunks: int, dim: int, chunks_per_document: int, clusters: int,
+                  batch_size: int, seed: int = 0) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """เขียนเอกสาร/chunks สังเคราะห์ลงฐานข้อมูล ส่งคืน (chunk ids, vectors, ข้อความ) เรียงตาม id"""
+    matrix, labels = synthetic_clusters(chunks, dim, clusters, seed)
+    # เอกสารจริงมักมีไม่กี่หัวข้อ: เรียง chunks ตามกลุ่มก่อนแบ่งเป็นเอกสาร (vector ระดับเอกสารจึงมีความหมาย)
+    order = np.argsort(labels, kind="stable")
+    matrix, labels = matrix[order], labels[order]
+    vocabulary = cluster_vocabulary(clusters, seed)
+    rng = np.random.default_rng(seed + 1)
+    model = config.embedding.model
+    now = datetime.utcnow()
+
+    with db_manager.get_session() as session:
+        user = session.query(User).first()
+        if user is None:
+            user = User(username="bench", email="bench@example.com", full_name="bench")
+            session.add(user)
+            session.commit()
+        user_id = user.id
+
+        documents = (chunks + chunks_per_document - 1) // chunks_per_document
+        first_document = (session.query(Document.id).order_by(Document.id.desc()).limit(1).scalar() or 0) + 1
+        session.execute(Document.__table__.insert(), [
+            {
+                "id": first_document + i, "filename": f"bench-{i}.txt", "original_filename": f"bench-{i}.txt",
+                "file_path": f"bench-{i}.txt", "file_size": 0, "file_type": "txt", "mime_type": "text/plain",
+                "category": CATEGORIES[i % len(CATEGORIES)], "is_public": i % 2 == 0, "uploaded_by": user_id,
+                "is_processed": True, "processing_status": "completed", "has_embeddings": True,
+                "embedding_model": model, "created_at": now, "updated_at": now
+            }
+            for i in range(documents)
+        ])
+        session.commit()
+
+        first_chunk = (session.query(DocumentChunk.id).order_by(DocumentChunk.id.desc()).limit(1).scalar() or 0) + 1
+        ids = np.arange(first_chunk, first_chunk + chunks, dtype=np.int64)
+        texts = [chunk_text(rng, vocabulary[label], int(chunk_id)) for chunk_id, label in zip(ids, labels)]
+        rows = [
+            {
+                "id": int(ids[i]), "document_id": first_document + i // chunks_per_document,
+                "chunk_index": i % chunks_per_document, "content": texts[i], "content_type": "text",
+                "embedding_vector": encode_embedding(matrix[i], model), "embedding_model": model, "created_at": now
+            }
+            for i in range(chunks)
+        ]
+        EmbeddingService.insert_chunks(session, rows, batch_size)
+
+    document_summaries.update(range(first_document, first_document + documents), model)
+    return ids, matrix, texts
+
+def make_queries(matrix: np.ndarray, texts: List[str], count: int, seed: int = 1) -> Tuple[List[str], np.ndarray]:
+    """query = vector ในคลังที่ถูกรบกวนเล็กน้อย และข้อความจากคำของ chunk นั้น (ไม่ซ้ำกัน จึงไม่ได้จากแคช)"""
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(matrix), min(count, len(matrix)), replace=False)
+    vectors = VectorIndex.normalize(matrix[picks] + 0.3 * rng.normal(size=(len(picks), matrix.shape[1])) / np.sqrt(matrix.shape[1]))
+    queries = [
+        " ".join(rng.choice(texts[pick].split()[:-1], size=WORDS_PER_QUERY, replace=False)) + f" q{n}"
+        for n, pick in enumerate(picks)
+    ]
+    return queries, vectors
+
+def unavailable(name: str, dim: int) -> Optional[str]:
+    """เหตุผลที่ใช้วิธีค้นหานี้ไม่ได้ในเครื่องนี้ (None = ใช้ได้)"""
+    overrides, mode = BACKENDS[name]
+    if overrides["index_type"] != "exact" and faiss is None:
+        return "ต้องติดตั้ง faiss-cpu"
+    if overrides["quantization"] == "pq" and dim % config.embedding.pq_subvectors:
+        return f"มิติ {dim} หารด้วย pq_subvectors={config.embedding.pq_subvectors} ไม่ลงตัว"
+    if overrides["quantization"] in ("pca", "matryoshka") and config.embedding.reduced_dim >= dim:
+        return f"reduced_dim={config.embedding.reduced_dim} ต้องน้อยกว่ามิติ {dim}"
+    if mode != "vector" and not config.embedding.keyword_index_enabled:
+        return "keyword_index_enabled ปิดอยู่"
+    return None
+
+def create_service(folder: str) -> EmbeddingService:
+    """EmbeddingService ที่มีดัชนีชุดใหม่ใน folder (ไม่ใช้ดัชนีของแอปที่ data/embeddings)"""
+    config.app.embeddings_folder = folder
+    service = EmbeddingService()
+    service.index = create_vector_index(service.model)
+    service.ann = AnnIndex(folder=folder)
+    service.keywords = KeywordIndex(folder=folder)
+    service.query_cache = QueryEmbeddingCache()
+    return service
+
+def run_queries(service: EmbeddingService, queries: List[str], truth: np.ndarray,
+                k: int, mode: str) -> Dict[str, float]:
+    """latency ต่อคำถามของ search_similar_chunks และ recall@k"""
+    timings = []
+    hits = 0
+    for query, expected in zip(queries, truth):
+        started = time.perf_counter()
+        results = service.search_similar_chunks(query, limit=k, mode=mode)
+        timings.append(time.perf_counter() - started)
+        hits += len(np.intersect1d([result['chunk_id'] for result in results], expected))
+
+    result = latency_stats(timings)
+    result["recall_at_k"] = round(hits / truth.size, 4)
+    return result
+
+def measure_backend(name: str, folder: str, queries: List[str], truth: np.ndarray,
+                    k: int, warmup: List[str]) -> Dict:
+    """สร้างดัชนีของวิธีค้นหาหนึ่ง (วัดเวลาและหน่วยความจำ) แล้ววัดการค้นหา"""
+    overrides, mode = BACKENDS[name]
+    saved = {key: getattr(config.embedding, key) for key in overrides}
+    for key, value in overrides.items():
+        setattr(config.embedding, key, value)
+
+    try:
+        service = create_service(os.path.join(folder, name))
+
+        rss_before = current_rss_mb()
+        started = time.perf_counter()
+        service.ensure_index(wait=True)
+        if mode != "vector":
+            service.keywords.ensure_built()
+        build_seconds = time.perf_counter() - started
+        rss_after = current_rss_mb()
+
+        for query in warmup:
+            service.search_similar_chunks(query, limit=k, mode=mode)
+
+        index_memory = service.index.memory_stats()
+        memory = {
+            "build_rss_delta_mb": round(rss_after - rss_before, 1) if rss_before is not None else None,
+            "index_resident_mb": round(index_memory["resident_bytes"] / 2**20, 1),
+            "index_mapped_mb": round(index_memory["mapped_bytes"] / 2**20, 1),
+            "resident_bytes_per_chunk": index_memory["resident_bytes_per_chunk"]
+        }
+        if service.ann.is_ready:
+            service.ann.save(force=True)
+            memory["ann_index_mb"] = round(os.path.getsize(service.ann.index_path) / 2**20, 1)
+        if mode != "vector":
+            memory["keyword_index_mb"] = round(service.keywords.stats()["memory_bytes"] / 2**20, 1)
+
+        report = {
+            "backend": name,
+            "mode": mode,
+            "used_ann": service.ann.is_ready,
+            "quantization": index_memory["quantization"],
+            "build_seconds": round(build_seconds, 2),
+            "memory": memory,
+            # รอบแรก: embedding ของคำถามผ่าน HTTP ไปยัง stub / รอบสอง: จากแคชคำถามในหน่วยความจำ (วัดเฉพาะการค้นหา)
+            "search": run_queries(service, queries, truth, k, mode),
+            "search_cached_query": run_queries(service, queries, truth, k, mode)
+        }
+        return report
+    finally:
+        for key, value in saved.items():
+            setattr(config.embedding, key, value)
+
+def current_rss_mb() -> Optional[float]:
+    """หน่วยความจำที่ process ใช้อยู่ขณะนี้ (Linux เท่านั้น)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def max_rss_mb() -> Optional[float]:
+    """หน่วยความจำสูงสุดของ process (Linux/macOS)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (2**20 if platform.system() == "Darwin" else 2**10), 1)
+
+def print_report(report: Dict):
+    """แสดงรายงานเป็นตาราง"""
+    print(f"คลัง {report['chunks']} chunks x {report['dim']} มิติ, {report['queries']} queries, k={report['k']}")
+    for row in report["backends"]:
+        if "skipped" in row:
+            print(f"{row['backend']:<12} ข้าม: {row['skipped']}")
+            continue
+        search, cached = row["search"], row["search_cached_query"]
+        print(f"{row['backend']:<12} recall={search['recall_at_k']:.4f}  "
+              f"p50={search['p50_ms']:.2f}ms  p95={search['p95_ms']:.2f}ms  p99={search['p99_ms']:.2f}ms  "
+              f"(แคชคำถาม p50={cached['p50_ms']:.2f}ms)  build={row['build_seconds']}s  "
+              f"resident={row['memory']['index_resident_mb']}MB")
+
+def main():
+    parser = argparse.ArgumentParser(description="วัด latency/หน่วยความจำ/recall ของ search_similar_chunks")
+    parser.add_argument("--url", help="SQLAlchemy URL ของฐานข้อมูลเปล่าสำหรับทดสอบ (ค่าเริ่มต้น: sqlite ไฟล์ชั่วคราว)")
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--chunks-per-document", type=int, default=50)
+    parser.add_argument("--clusters", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--backends", nargs="+", choices=list(BACKENDS), default=list(BACKENDS))
+    parser.add_argument("--stub-latency-ms", type=float, default=0.0, help="หน่วงเวลาต่อ request ของ stub")
+    parser.add_argument("--batch-size", type=int, default=1000, help="แถว document_chunks ต่อ INSERT")
+    parser.add_argument("--json", help="บันทึกผลเป็นไฟล์ JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        engine = create_engine(args.url or f"sqlite:///{os.path.join(folder, 'retrieval.db')}")
+        Base.metadata.create_all(engine)
+        db_manager.bind(engine)
+
+        started = time.perf_counter()
+        ids, matrix, texts = create_corpus(args.chunks, args.dim, args.chunks_per_document,
+                                           args.clusters, args.batch_size)
+        corpus_seconds = time.perf_counter() - started
+
+        queries, query_vectors = make_queries(matrix, texts, args.queries + args.warmup)
+        truth = ids[exact_top_k(matrix, query_vectors[:args.queries], args.k)]
+        warmup = queries[args.queries:]
+        queries = queries[:args.queries]
+
+        # ไม่ใช้แคช embeddings ในฐานข้อมูล: ทุกคำถามในรอบแรกเรียก stub ผ่าน HTTP
+        config.embedding.cache_enabled = False
+        with StubEmbeddingServer(args.dim, latency_ms=args.stub_latency_ms) as stub:
+            stub.register(queries + warmup, query_vectors)
+            config.embedding.api_url = f"{stub.base_url}/api/embeddings"
+            config.embedding.batch_api_url = f"{stub.base_url}/api/embed"
+
+            report = {
+                "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+                "url": engine.url.render_as_string(hide_password=True),
+                "chunks": args.chunks,
+                "dim": args.dim,
+                "documents": (args.chunks + args.chunks_per_document - 1) // args.chunks_per_document,
+                "queries": len(queries),
+                "k": args.k,
+                "ground_truth": "exact top-k บน vectors เต็ม",
+                "corpus_seconds": round(corpus_seconds, 2),
+                "stub_latency_ms": args.stub_latency_ms,
+                "backends": []
+            }
+            for name in args.backends:
+                reason = unavailable(name, args.dim)
+                if reason:
+                    report["backends"].append({"backend": name, "skipped": reason})
+                    continue
+                report["backends"].append(measure_backend(name, folder, queries, truth, args.k, warmup))
+            report["stub_requests"] = stub.requests
+
+        report["max_rss_mb"] = max_rss_mb()
+        report["config"] = {
+            key: getattr(config.embedding, key) for key in (
+                "ivf_nlist", "ivf_nprobe", "hnsw_m", "hnsw_ef_search", "pq_subvectors", "reduced_dim",
+                "rerank_candidates", "hybrid_candidates", "hierarchical_top_documents", "keyword_tokenizer"
+            )
+        }
+        engine.dispose()
+
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
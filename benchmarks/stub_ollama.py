@@ -0,0 +1,123 @@
+"""
+stub ของ Ollama สำหรับ benchmarks: /api/embeddings (prompt เดียว) และ /api/embed (input เป็น list)
+ข้อความที่ลงทะเบียนไว้ได้ vector ที่กำหนด ข้อความอื่นได้ vector สุ่มที่คงที่ตาม hash ของข้อความ
+
+ตัวอย่าง:
+    python -m benchmarks.stub_ollama --port 11434 --dim 768 --latency-ms 5
+"""
+
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+class StubEmbeddingServer:
+    """HTTP server ใน thread พื้นหลัง ตอบ embeddings แบบเดียวกับ Ollama"""
+
+    def __init__(self, dim: int, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0.0):
+        self.dim = dim
+        self.latency = latency_ms / 1000
+        self._vectors: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def register(self, texts: Sequence[str], vectors: np.ndarray):
+        """กำหนด vector ของข้อความ (เช่น คำถามที่ต้องใกล้กับ chunks ที่ทราบคำตอบ)"""
+        with self._lock:
+            for content, vector in zip(texts, vectors):
+                self._vectors[content] = np.asarray(vector, dtype=np.float32).tolist()
+
+    def embed(self, content: str) -> List[float]:
+        with self._lock:
+            vector = self._vectors.get(content)
+        if vector is not None:
+            return vector
+        seed = int.from_bytes(hashlib.blake2b(content.encode("utf-8"), digest_size=8).digest(), "little")
+        vector = np.random.default_rng(seed).normal(size=self.dim).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive เหมือน Ollama (requests.Session ใช้ connection เดิมซ้ำ)
+            disable_nagle_algorithm = True  # headers และ body เขียนแยกกัน ถ้าไม่ปิดจะรอ delayed ACK ~40ms ต่อ request
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if stub.latency:
+                    time.sleep(stub.latency)
+                with stub._lock:
+                    stub.requests += 1
+
+                if self.path == "/api/embeddings":
+                    result = {"embedding": stub.embed(body.get("prompt", ""))}
+                elif self.path == "/api/embed":
+                    inputs = body.get("input", [])
+                    if isinstance(inputs, str):
+                        inputs = [inputs]
+                    result = {"model": body.get("model"), "embeddings": [stub.embed(content) for content in inputs]}
+                else:
+                    self.send_error(404)
+                    return
+
+                payload = json.dumps(result).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "StubEmbeddingServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="stub ของ Ollama /api/embeddings และ /api/embed")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="หน่วงเวลาต่อ request (จำลองเวลาของโมเดล)")
+    args = parser.parse_args()
+
+    stub = StubEmbeddingServer(args.dim, args.host, args.port, args.latency_ms)
+    print(f"stub embeddings ที่ {stub.base_url} ({args.dim} มิติ)")
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        stub.stop()
+
+if __name__ == "__main__":
+    main()
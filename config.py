@@ -18,10 +18,109 @@ class DatabaseConfig:
 class EmbeddingConfig:
     """การตั้งค่า Embedding API"""
     api_url: str = "http://209.15.123.47:11434/api/embeddings"
+    batch_api_url: str = "http://209.15.123.47:11434/api/embed"  # รับ input เป็น list
     model: str = "nomic-embed-text:latest"
     timeout: int = 60
-    chunk_size: int = 512
+    batch_max_chars: int = 16000  # จำนวนตัวอักษรรวมสูงสุดต่อ request
+    batch_max_items: int = 64
+    max_in_flight: int = 4  # จำนวน request ที่ส่งไปยัง embedding server พร้อมกันสูงสุด
+    max_retries: int = 2  # ลองใหม่ต่อรายการเมื่อสร้าง embedding ไม่สำเร็จ
+    retry_backoff: float = 0.5  # วินาที (เพิ่มเท่าตัวในแต่ละครั้ง)
+    
+    # backend: ollama (HTTP ไปยัง api_url) หรือ local (sentence-transformers ใน process บน CPU, model = ชื่อบน Hugging Face หรือโฟลเดอร์)
+    # โมเดลใน local_models ใช้ local เสมอ จึงเปลี่ยนจากโมเดลของ Ollama ไปเป็นโมเดล local ในพื้นหลังได้ (services.embedding_models)
+    backend: str = "ollama"
+    local_models: tuple = ()
+    local_runtime: str = "torch"  # torch, onnx หรือ onnx-int8 (ONNX ต้องติดตั้ง optimum[onnxruntime])
+    local_int8_config: str = "avx2"  # ชุดคำสั่งของ dynamic quantization: arm64, avx2, avx512, avx512_vnni
+    local_threads: int = 0  # จำนวน thread ของ torch/onnxruntime (0 = ตามค่าเริ่มต้นของไลบรารี)
+    local_batch_size: int = 32
+    local_max_seq_length: int = 0  # 0 = ตามโมเดล (chunk_tokens ควรไม่เกินค่านี้)
+    local_trust_remote_code: bool = False  # บางโมเดล เช่น nomic-embed-text-v1.5 ต้องเปิด
+    
+    # แคช embeddings ในตาราง embedding_cache (key = sha256 ของโมเดล + ข้อความที่ normalize แล้ว)
+    cache_enabled: bool = True
+    cache_max_entries: int = 500000  # เกินนี้จะลบแถวที่ไม่ได้ใช้นานที่สุด
+    cache_evict_interval: int = 600  # วินาที ระหว่างการตรวจขนาดแคช
+    cache_touch_interval: int = 60  # วินาที ระหว่างการบันทึก last_used_at/hit_count ที่สะสมไว้ (cache hit ไม่เขียนฐานข้อมูลทุกครั้ง)
+    
+    # แคช embeddings ของคำถามในหน่วยความจำ (ใช้ร่วมกันทุก session ใน process)
+    query_cache_size: int = 2048
+    query_cache_ttl: int = 3600  # วินาที
+    
+    # การแบ่ง chunks: tokens (ตามงบ tokens ของโมเดล นับด้วย tokenizer ที่โหลดจากเครื่อง) หรือ chars (ตามจำนวนตัวอักษร)
+    # ถ้าโหลด tokenizer ไม่ได้จะใช้ chars อัตโนมัติ
+    chunk_mode: str = "tokens"
+    tokenizer_path: str = "nomic-ai/nomic-embed-text-v1.5"  # โฟลเดอร์ที่มี tokenizer.json หรือชื่อใน cache ของ Hugging Face (ไม่ดาวน์โหลด)
+    chunk_tokens: int = 512  # รวม special tokens
+    chunk_token_overlap: int = 64
+    chunk_size: int = 512  # ตัวอักษร (chunk_mode = "chars")
     chunk_overlap: int = 50
+    chunk_insert_batch_size: int = 500  # จำนวนแถว document_chunks ต่อ INSERT/commit
+    
+    # คิวงาน embeddings (ตาราง embedding_jobs) สำหรับ python -m services.embedding_worker
+    job_lease_seconds: int = 300  # worker ต่ออายุ lease ระหว่างประมวลผล ถ้าหยุดทำงานงานจะกลับเข้าคิวเมื่อหมดอายุ
+    job_max_attempts: int = 3
+    job_retry_delay: int = 60  # วินาที (เพิ่มเท่าตัวในแต่ละครั้ง)
+    job_poll_interval: float = 5.0  # วินาที ระหว่างการตรวจคิวเมื่อไม่มีงาน
+    
+    # ดัชนีค้นหา: exact, ivf_flat, hnsw (ANN ใช้ faiss-cpu)
+    index_type: str = "exact"
+    ann_min_corpus_size: int = 20000  # ต่ำกว่านี้ใช้ exact search
+    ann_save_interval: int = 300  # วินาที ระหว่างการบันทึกดัชนี ANN ลงดิสก์
+    ivf_nlist: int = 1024
+    ivf_nprobe: int = 16
+    hnsw_m: int = 32
+    hnsw_ef_construction: int = 200
+    hnsw_ef_search: int = 64
+    
+    # shard .npy แบบ memory-mapped ใน embeddings_folder (ใช้ร่วมกันระหว่าง process)
+    shard_storage: bool = True
+    shard_flush_rows: int = 2048  # จำนวน chunks ใหม่ในหน่วยความจำก่อนเขียนเป็น shard
+    shard_target_rows: int = 65536  # shard ที่เล็กกว่านี้จะถูกรวมกัน
+    
+    # การ sync ดัชนีกับฐานข้อมูลแบบ incremental (high-water mark ของ document_chunks.id + chunk_deletions)
+    index_refresh_interval: float = 5.0  # วินาที: ความสดของดัชนีสูงสุดหลัง commit จาก process อื่น
+    index_refresh_lookback: int = 1000  # ตรวจ id ย้อนหลังจาก high-water mark เผื่อ transaction ที่ commit ช้ากว่า
+
+    # การค้นหารอบแรกด้วย codes ที่บีบอัด (none, sq8, pq, pca, matryoshka) แล้วจัดอันดับใหม่ด้วย vectors เต็มจาก shard
+    quantization: str = "sq8"
+    quantization_min_rows: int = 20000  # ต่ำกว่านี้ใช้ exact search บน vectors เต็ม
+    quantization_train_size: int = 50000  # จำนวนตัวอย่างที่ใช้ train พารามิเตอร์
+    pq_subvectors: int = 96  # จำนวนไบต์ต่อ chunk ของ PQ (ต้องหารมิติลงตัว)
+    reduced_dim: int = 256  # จำนวนมิติของ pca/matryoshka (4 ไบต์/มิติ) เทียบผลด้วย python -m benchmarks.dimension_report
+    rerank_candidates: int = 300
+
+    # ดัชนีคำ BM25 (รหัส เลขที่แบบฟอร์ม ชื่อเฉพาะ) และการค้นหา: vector, keyword หรือ hybrid (รวมอันดับด้วย RRF)
+    search_mode: str = "vector"  # ค่าเริ่มต้นของผู้เรียกที่ไม่ระบุ mode (hybrid ให้ผู้เรียกเลือกเอง)
+    keyword_index_enabled: bool = True
+    keyword_tokenizer: str = "auto"  # auto (pythainlp ถ้าติดตั้ง ไม่เช่นนั้น bigram), pythainlp, bigram
+    bm25_k1: float = 1.2
+    bm25_b: float = 0.75
+    hybrid_candidates: int = 50  # จำนวนผลจากแต่ละวิธีก่อนรวมอันดับ
+    rrf_k: int = 60
+    keyword_merge_postings: int = 1000000  # postings ใหม่ในหน่วยความจำก่อนรวมเข้า postings หลัก
+    keyword_save_interval: int = 300  # วินาที ระหว่างการบันทึกดัชนีคำลงดิสก์
+
+    # ค้นหาเอกสาร (full-text ระดับเอกสาร ในแท็บค้นหาของ Document Manager)
+    document_search_page_size: int = 10
+    document_search_snippet_chars: int = 240
+    document_search_max_chars: int = 500000  # ทำดัชนีข้อความที่สกัดได้ไม่เกินจำนวนตัวอักษรนี้ต่อเอกสาร
+
+    # การเปลี่ยนโมเดล: model ข้างบนเป็นค่าเริ่มต้น โมเดลที่ active จริงอยู่ใน system_configs (python -m services.embedding_models)
+    # worker สร้าง embeddings ของโมเดลใหม่ในพื้นหลังเมื่อคิวว่าง ระหว่างนี้ค้นหาด้วยโมเดลเดิม
+    reembed_batch_size: int = 256
+    reembed_max_chunks_per_sec: float = 50.0  # จำกัดความเร็วไม่ให้แย่ง embedding server กับเอกสารใหม่ (0 = ไม่จำกัด)
+    reembed_auto_switch: bool = True  # เปลี่ยนโมเดลที่ active อัตโนมัติเมื่อสร้างครบทุก chunk
+
+    # chunks ที่ข้อความ (normalize แล้ว) ตรงกันในขอบเขตเดียวกัน: ไม่เรียก embedding API และไม่อยู่ในดัชนี vector อ้างอิง chunk หลักแทน
+    dedup_enabled: bool = False
+    dedup_threshold: float = 0.95  # ความเหมือนของลายเซ็นสำหรับคัด candidate (0.95 = ต่างกันไม่เกิน 3 จาก 64 บิต) ก่อนเทียบข้อความจริง
+
+    # การค้นหาสองระดับ: เลือกเอกสารจาก vector ระดับเอกสาร (documents.summary_vector) ก่อน แล้วคำนวณคะแนนเฉพาะ chunks ในเอกสารเหล่านั้น
+    hierarchical_search: bool = False
+    hierarchical_top_documents: int = 50  # จำนวนเอกสารจากรอบแรก
+    hierarchical_min_documents: int = 2000  # จำนวนเอกสารที่มี vector ระดับเอกสารขั้นต่ำ (น้อยกว่านี้ค้นหาทุก chunk)
 
 @dataclass
 class ChatConfig:
@@ -55,6 +154,7 @@ class AppConfig:
     upload_folder: str = "data/uploads"
     embeddings_folder: str = "data/embeddings"
     max_file_size: int = 200  # MB
+    dedup_uploads: bool = True  # ไฟล์ที่เนื้อหาตรงกับเอกสารเดิมใช้ไฟล์/ข้อความ/chunks ของเอกสารเดิม
     
     # สีธีม
     primary_color: str = "#FFD700"
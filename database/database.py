@@ -2,7 +2,7 @@
 การจัดการการเชื่อมต่อฐานข้อมูล TiDB
 """
 
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, text, inspect
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.pool import StaticPool
 import streamlit as st
@@ -44,6 +44,11 @@ class DatabaseManager:
             )
         return self._engine
     
+    def bind(self, engine):
+        """ใช้ engine ที่สร้างไว้แล้วแทน config.db.url (เช่น sqlite ชั่วคราวใน benchmarks)"""
+        self._engine = engine
+        self._session_factory = None
+    
     @property
     def session_factory(self):
         """สร้างและส่งคืน session factory"""
@@ -169,6 +174,7 @@ def setup_database_connection():
             if test_connection():
                 # สร้างตารางถ้ายังไม่มี
                 if init_database():
+                    run_migrations()
                     st.session_state.db_initialized = True
                     st.session_state.db_status = "✅ พร้อมใช้งาน"
                 else:
@@ -180,6 +186,72 @@ def setup_database_connection():
             logger.error(f"Database setup error: {e}")
 
 # Migration functions (สำหรับการปรับปรุงฐานข้อมูลในอนาคต)
+# คอลัมน์ที่เพิ่มภายหลัง: (version, ตาราง, คอลัมน์, ชนิดข้อมูล, คำอธิบาย)
+# create_all() ไม่เพิ่มคอลัมน์ใหม่ให้ตารางที่มีอยู่แล้ว จึงต้อง ALTER TABLE เอง
+COLUMN_MIGRATIONS = [
+    ("002_chunk_embedding_vector", "document_chunks", "embedding_vector", "BLOB",
+     "เก็บ embedding แบบ binary float32 แทน JSON"),
+    ("003_document_chunks_total", "documents", "chunks_total", "INT",
+     "จำนวน chunks ทั้งหมดของเอกสาร (ความคืบหน้าการสร้าง embeddings)"),
+    ("003_document_chunks_failed", "documents", "chunks_failed", "INT",
+     "จำนวน chunks ที่สร้าง embedding ไม่สำเร็จ"),
+    ("003_document_chunking_signature", "documents", "chunking_signature", "VARCHAR(40)",
+     "พารามิเตอร์การแบ่ง chunks ที่ใช้ (ตรวจว่าทำต่อจาก chunks เดิมได้หรือไม่)"),
+    ("005_chunk_simhash", "document_chunks", "simhash", "BIGINT",
+     "ลายเซ็น SimHash ของ chunk สำหรับตรวจจับ chunks ที่เกือบซ้ำกัน"),
+    ("005_chunk_canonical_chunk_id", "document_chunks", "canonical_chunk_id", "INT",
+     "chunk หลักที่ใช้แทน chunk ที่เกือบซ้ำกันในดัชนี"),
+    ("006_document_content_hash", "documents", "content_hash", "VARCHAR(64)",
+     "hash ของเนื้อไฟล์สำหรับตรวจไฟล์ที่อัพโหลดซ้ำ"),
+    ("006_document_source_document_id", "documents", "source_document_id", "INT",
+     "เอกสารต้นฉบับของไฟล์ที่อัพโหลดซ้ำ"),
+    ("007_document_summary_vector", "documents", "summary_vector", "BLOB",
+     "vector ระดับเอกสารสำหรับการค้นหาสองระดับ"),
+    ("007_document_summary_model", "documents", "summary_model", "VARCHAR(100)",
+     "โมเดลของ vector ระดับเอกสาร"),
+]
+
+# unique index ที่เพิ่มภายหลัง: (version, ตาราง, ชื่อ index, คอลัมน์, คำอธิบาย)
+UNIQUE_INDEX_MIGRATIONS = [
+    ("004_document_chunk_index_unique", "document_chunks", "uq_document_chunk_index", "document_id, chunk_index",
+     "หนึ่งแถวต่อ (document_id, chunk_index) ให้การประมวลผลเอกสารซ้ำไม่สร้าง chunks ซ้ำ"),
+]
+
+# index ที่เพิ่มภายหลัง: (version, ตาราง, ชื่อ index, คอลัมน์, คำอธิบาย)
+INDEX_MIGRATIONS = [
+    ("005_chunk_canonical_chunk_id_index", "document_chunks", "ix_document_chunks_canonical_chunk_id", "canonical_chunk_id",
+     "ค้นหา chunks ที่อ้างถึง chunk หลัก (อ้างอิงกลับในผลการค้นหาและเมื่อลบ chunk หลัก)"),
+    ("006_document_content_hash_index", "documents", "ix_documents_content_hash", "content_hash",
+     "ค้นหาเอกสารจาก hash ของไฟล์ตอนอัพโหลด"),
+    ("006_document_source_document_id_index", "documents", "ix_documents_source_document_id", "source_document_id",
+     "ค้นหาเอกสารที่อ้างถึงเอกสารต้นฉบับ"),
+]
+
+def column_exists(table: str, column: str) -> bool:
+    """ตรวจสอบว่าตารางมีคอลัมน์นี้แล้วหรือไม่"""
+    return any(col["name"] == column for col in inspect(db_manager.engine).get_columns(table))
+
+def index_exists(table: str, name: str) -> bool:
+    """ตรวจสอบว่าตารางมี index/unique constraint ชื่อนี้แล้วหรือไม่"""
+    inspector = inspect(db_manager.engine)
+    names = {index["name"] for index in inspector.get_indexes(table)}
+    names.update(constraint["name"] for constraint in inspector.get_unique_constraints(table))
+    return name in names
+
+def remove_duplicate_chunks(session) -> int:
+    """ลบ chunks ที่ซ้ำ (document_id, chunk_index) โดยเก็บแถวที่ id น้อยที่สุด และบันทึกการลบให้ดัชนี vector"""
+    duplicates = """
+        FROM document_chunks c1 JOIN document_chunks c2
+          ON c1.document_id = c2.document_id AND c1.chunk_index = c2.chunk_index AND c1.id > c2.id
+    """
+    session.execute(text(f"""
+        INSERT INTO chunk_deletions (chunk_id, document_id, deleted_at)
+        SELECT DISTINCT c1.id, c1.document_id, NOW() {duplicates}
+    """))
+    removed = session.execute(text(f"DELETE c1 {duplicates}")).rowcount
+    session.commit()
+    return removed
+
 def run_migrations():
     """รันการปรับปรุงฐานข้อมูล"""
     try:
@@ -204,11 +276,111 @@ def run_migrations():
                 session.commit()
                 logger.info("สร้างตาราง migrations เรียบร้อย")
             
+            executed = {
+                row.version for row in session.execute(text("SELECT version FROM migrations"))
+            }
+            
+            for version, table, column, column_type, description in COLUMN_MIGRATIONS:
+                if version in executed:
+                    continue
+                
+                if not column_exists(table, column):
+                    session.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type} NULL"))
+                    logger.info(f"เพิ่มคอลัมน์ {table}.{column} เรียบร้อย")
+                
+                session.execute(
+                    text("INSERT INTO migrations (version, description) VALUES (:version, :description)"),
+                    {"version": version, "description": description}
+                )
+                session.commit()
+            
+            for version, table, name, columns, description in UNIQUE_INDEX_MIGRATIONS:
+                if version in executed:
+                    continue
+                
+                if not index_exists(table, name):
+                    if table == "document_chunks":
+                        removed = remove_duplicate_chunks(session)
+                        if removed:
+                            logger.info(f"ลบ chunks ที่ซ้ำ {removed} แถวก่อนสร้าง unique index")
+                    session.execute(text(f"CREATE UNIQUE INDEX {name} ON {table} ({columns})"))
+                    logger.info(f"สร้าง unique index {table}.{name} เรียบร้อย")
+                
+                session.execute(
+                    text("INSERT INTO migrations (version, description) VALUES (:version, :description)"),
+                    {"version": version, "description": description}
+                )
+                session.commit()
+            
+            for version, table, name, columns, description in INDEX_MIGRATIONS:
+                if version in executed:
+                    continue
+                
+                if not index_exists(table, name):
+                    session.execute(text(f"CREATE INDEX {name} ON {table} ({columns})"))
+                    logger.info(f"สร้าง index {table}.{name} เรียบร้อย")
+                
+                session.execute(
+                    text("INSERT INTO migrations (version, description) VALUES (:version, :description)"),
+                    {"version": version, "description": description}
+                )
+                session.commit()
+            
             return True
     except Exception as e:
         logger.error(f"ไม่สามารถรัน migrations ได้: {e}")
         return False
 
+def migrate_embeddings_to_binary(batch_size: int = 500, max_batches: Optional[int] = None) -> int:
+    """แปลง embedding รูปแบบ JSON เดิมเป็น binary ทีละ batch (commit ทุก batch, รันซ้ำได้)"""
+    from utils.vector_codec import encode_embedding
+    import json
+    
+    converted = 0
+    batches = 0
+    last_id = 0
+    
+    while max_batches is None or batches < max_batches:
+        with db_manager.get_session() as session:
+            rows = session.execute(text("""
+                SELECT id, embedding, embedding_model
+                FROM document_chunks
+                WHERE embedding IS NOT NULL
+                AND embedding_vector IS NULL
+                AND id > :last_id
+                ORDER BY id
+                LIMIT :limit
+            """), {"last_id": last_id, "limit": batch_size}).fetchall()
+            
+            if not rows:
+                break
+            
+            updates = []
+            for row in rows:
+                try:
+                    vector = json.loads(row.embedding) if isinstance(row.embedding, str) else row.embedding
+                    updates.append({
+                        "id": row.id,
+                        "vector": encode_embedding(vector, row.embedding_model or "")
+                    })
+                except Exception as e:
+                    logger.warning(f"ไม่สามารถแปลง embedding ของ chunk {row.id}: {e}")
+            
+            if updates:
+                session.execute(text("""
+                    UPDATE document_chunks
+                    SET embedding_vector = :vector, embedding = NULL
+                    WHERE id = :id
+                """), updates)
+            session.commit()
+            
+            converted += len(updates)
+            batches += 1
+            last_id = rows[-1].id
+            logger.info(f"แปลง embedding เป็น binary แล้ว {converted} แถว (ถึง chunk id {last_id})")
+    
+    return converted
+
 # Health check function
 def health_check():
     """ตรวจสอบสุขภาพของฐานข้อมูล"""
@@ -253,3 +425,17 @@ def cleanup_database():
 # เมื่อปิดแอปพลิเคชัน
 import atexit
 atexit.register(cleanup_database)
+
+if __name__ == "__main__":
+    # python -m database.database [batch_size]
+    import sys
+    
+    if run_migrations():
+        size = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+        total = migrate_embeddings_to_binary(batch_size=size)
+        print(f"แปลง embedding เป็น binary ทั้งหมด {total} แถว")
+        
+        # hash ของไฟล์เอกสารที่อัพโหลดก่อนมี content_hash (ตรวจไฟล์ที่อัพโหลดซ้ำ)
+        from utils.file_handler import FileHandler
+        hashed = FileHandler().backfill_content_hashes()
+        print(f"คำนวณ hash ของไฟล์เอกสารเดิม {hashed} เอกสาร")
@@ -2,8 +2,9 @@
 โมเดลฐานข้อมูลสำหรับระบบ JobN Power
 """
 
-from sqlalchemy import Column, Integer, String, Text, DateTime, Float, Boolean, ForeignKey, JSON
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, Float, Boolean, ForeignKey, JSON, LargeBinary, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import event
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import uuid
@@ -42,6 +43,8 @@ class Document(Base):
     file_size = Column(Integer, nullable=False)  # ขนาดไฟล์ในไบต์
     file_type = Column(String(50), nullable=False)  # pdf, docx, xlsx, etc.
     mime_type = Column(String(100), nullable=False)
+    content_hash = Column(String(64), nullable=True, index=True)  # blake2b ของเนื้อไฟล์ (ตรวจไฟล์ที่อัพโหลดซ้ำ)
+    source_document_id = Column(Integer, nullable=True, index=True)  # เอกสารต้นฉบับที่ใช้ไฟล์และ chunks ร่วมกัน (อัพโหลดซ้ำ)
     
     # เมตาดาต้า
     title = Column(String(500), nullable=True)
@@ -57,7 +60,12 @@ class Document(Base):
     # Embedding
     has_embeddings = Column(Boolean, default=False)
     embedding_model = Column(String(100), nullable=True)
-    chunks_count = Column(Integer, default=0)
+    chunks_count = Column(Integer, default=0)  # chunks ที่มี embedding แล้ว
+    chunks_total = Column(Integer, nullable=True)  # จำนวน chunks ทั้งหมดจากการแบ่งข้อความ (ความคืบหน้า = chunks_count / chunks_total)
+    chunks_failed = Column(Integer, default=0)  # chunks ที่สร้าง embedding ไม่สำเร็จในรอบล่าสุด
+    chunking_signature = Column(String(40), nullable=True)  # โมเดล + พารามิเตอร์การแบ่ง chunks ที่ใช้สร้าง chunks ปัจจุบัน
+    summary_vector = Column(LargeBinary, nullable=True)  # ค่าเฉลี่ยของ vectors ของ chunks ในดัชนี (utils/vector_codec.py)
+    summary_model = Column(String(100), nullable=True)  # โมเดลของ summary_vector (มีค่าแต่ไม่มี vector = คำนวณแล้วแต่ไม่มี chunks ในดัชนี)
     
     # ข้อมูลผู้ใช้
     uploaded_by = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -77,6 +85,9 @@ class Document(Base):
 class DocumentChunk(Base):
     """โมเดลชิ้นส่วนเอกสาร (สำหรับ RAG)"""
     __tablename__ = "document_chunks"
+    __table_args__ = (
+        UniqueConstraint("document_id", "chunk_index", name="uq_document_chunk_index"),  # ประมวลผลซ้ำไม่สร้าง chunk ซ้ำ
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     document_id = Column(Integer, ForeignKey("documents.id"), nullable=False)
@@ -87,9 +98,14 @@ class DocumentChunk(Base):
     content_type = Column(String(50), default="text")  # text, table, image
     
     # Embedding
-    embedding = Column(JSON, nullable=True)  # เก็บ vector embedding
+    embedding = Column(JSON, nullable=True)  # รูปแบบเดิม (JSON) สำหรับแถวที่ยังไม่ได้ migrate
+    embedding_vector = Column(LargeBinary, nullable=True)  # float32 little-endian พร้อม header (utils/vector_codec.py)
     embedding_model = Column(String(100), nullable=True)
     
+    # chunks ที่เกือบซ้ำกัน (services/near_duplicates.py)
+    simhash = Column(BigInteger, nullable=True)  # ลายเซ็น SimHash 64 บิต
+    canonical_chunk_id = Column(Integer, nullable=True, index=True)  # chunk หลักที่ใช้แทนในดัชนี (NULL = เป็น chunk หลักเอง)
+    
     # ตำแหน่งในเอกสาร
     page_number = Column(Integer, nullable=True)
     start_char = Column(Integer, nullable=True)
@@ -103,6 +119,75 @@ class DocumentChunk(Base):
     # ความสัมพันธ์
     document = relationship("Document", back_populates="chunks")
 
+class ChunkDeletion(Base):
+    """บันทึกการลบ chunks (ให้ดัชนี vector ของทุก process ลบตามได้แบบ incremental)"""
+    __tablename__ = "chunk_deletions"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    chunk_id = Column(Integer, nullable=False, index=True)
+    document_id = Column(Integer, nullable=True)
+    deleted_at = Column(DateTime, default=datetime.utcnow)
+
+class ChunkEmbedding(Base):
+    """embeddings ของ chunk จากโมเดลอื่นนอกจาก document_chunks.embedding_model (ชุดที่สร้างเมื่อเปลี่ยนโมเดล)"""
+    __tablename__ = "chunk_embeddings"
+    __table_args__ = (
+        UniqueConstraint("chunk_id", "model", name="uq_chunk_embedding_model"),
+    )
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    chunk_id = Column(Integer, nullable=False, index=True)  # ลบพร้อม chunk (ไม่ใช้ foreign key เหมือน chunk_deletions)
+    model = Column(String(100), nullable=False, index=True)
+    embedding_vector = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+@event.listens_for(DocumentChunk, "after_delete")
+def log_chunk_deletion(mapper, connection, target):
+    """บันทึกการลบ chunk ที่ลบผ่าน ORM (เช่น cascade จากการลบเอกสาร) และลบ embeddings ของโมเดลอื่น"""
+    connection.execute(
+        ChunkDeletion.__table__.insert().values(
+            chunk_id=target.id,
+            document_id=target.document_id,
+            deleted_at=datetime.utcnow()
+        )
+    )
+    connection.execute(
+        ChunkEmbedding.__table__.delete().where(ChunkEmbedding.chunk_id == target.id)
+    )
+
+class EmbeddingCache(Base):
+    """แคช embeddings ตาม hash ของ (โมเดล, ข้อความที่ normalize แล้ว) ใช้ซ้ำเมื่ออัพโหลดเอกสารฉบับแก้ไข"""
+    __tablename__ = "embedding_cache"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    content_hash = Column(String(64), unique=True, nullable=False, index=True)  # sha256 hex
+    model = Column(String(100), nullable=False)
+    embedding_vector = Column(LargeBinary, nullable=False)  # utils/vector_codec.py
+    hit_count = Column(Integer, default=0)
+    
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow, index=True)  # ใช้เลือกแถวที่จะลบ (LRU)
+
+class EmbeddingJob(Base):
+    """คิวงานสร้าง embeddings ของเอกสาร (worker หลายตัว claim งานด้วย lease ที่หมดอายุได้)"""
+    __tablename__ = "embedding_jobs"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    document_id = Column(Integer, ForeignKey("documents.id"), unique=True, nullable=False)  # หนึ่งงานต่อเอกสาร
+    status = Column(String(20), default="queued", index=True)  # queued, running, completed, failed
+    attempts = Column(Integer, default=0)
+    
+    # การ claim งาน
+    worker_id = Column(String(100), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True, index=True)  # งาน running ที่เลยเวลานี้ถือว่า worker หยุดทำงาน
+    available_at = Column(DateTime, default=datetime.utcnow)  # ลองใหม่ได้หลังเวลานี้
+    error = Column(Text, nullable=True)
+    
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
 class ChatSession(Base):
     """โมเดลเซสชันการสนทนา"""
     __tablename__ = "chat_sessions"
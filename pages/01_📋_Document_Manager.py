@@ -13,7 +13,11 @@ import mimetypes
 from config import config, get_custom_css
 from database.database import get_db_session
 from database.models import Document, User
-from services.embedding_service import process_document_embeddings, get_embedding_statistics
+from services.embedding_service import (
+    get_embedding_statistics, get_embedding_queue_status, rebuild_document_embeddings,
+    process_all_pending_embeddings, delete_document_embeddings, search_documents as search_document_chunks
+)
+from services.document_search import document_search_service
 from utils.file_handler import FileHandler
 import plotly.express as px
 import plotly.graph_objects as go
@@ -143,10 +147,12 @@ def upload_multiple_files(uploaded_files, category: str, tags_input: str, is_pub
             if file_info:
                 status_container.success(f"✅ {uploaded_file.name}: อัพโหลดสำเร็จ")
                 successful_uploads += 1
-                
-                # ประมวลผล embedding ในพื้นหลัง
-                if file_info.get('document_id'):
-                    st.session_state[f"processing_{file_info['document_id']}"] = True
+
+                # embeddings สร้างโดย worker (python -m services.embedding_worker) จึงไม่ต้องรอในหน้านี้
+                if file_info.get('duplicate_of'):
+                    status_container.info(f"ℹ️ {uploaded_file.name}: ไฟล์ซ้ำกับเอกสาร ID {file_info['duplicate_of']} ใช้ไฟล์และข้อความร่วมกัน")
+                elif not file_info.get('queued'):
+                    status_container.warning(f"⚠️ {uploaded_file.name}: ไม่พบข้อความในไฟล์ (รอ OCR ก่อนสร้าง embeddings)")
             else:
                 status_container.error(f"❌ {uploaded_file.name}: การอัพโหลดล้มเหลว")
         
@@ -158,9 +164,213 @@ def upload_multiple_files(uploaded_files, category: str, tags_input: str, is_pub
     # สรุปผลการอัพโหลด
     if successful_uploads > 0:
         st.success(f"🎉 อัพโหลดสำเร็จ {successful_uploads}/{total_files} ไฟล์")
-        
-        # แสดงการประมวลผล embedding
-        if st.button("🔄 เริ่มประมวลผล AI Embeddings"):
-            process_all_pending_embeddings()
+        st.info("🔄 เอกสารถูกส่งเข้าคิวสร้าง AI Embeddings แล้ว ติดตามสถานะได้ที่แท็บคลังเอกสาร")
     else:
-        st.error("
+        st.error("❌ ไม่สามารถอัพโหลดไฟล์ได้")
+
+def show_upload_info():
+    """ข้อมูลประกอบการอัพโหลดและสถานะคิว embeddings"""
+    st.markdown("### ℹ️ ข้อมูลการอัพโหลด")
+    st.markdown(f"""
+    - **ไฟล์ที่รองรับ:** PDF, DOCX, XLSX, PPTX, TXT, JPG, PNG
+    - **ขนาดสูงสุด:** {config.app.max_file_size}MB ต่อไฟล์
+    - **Embedding Model:** {config.embedding.model}
+    """)
+    
+    st.markdown("### 🔄 คิว AI Embeddings")
+    queue = get_embedding_queue_status()
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("รอประมวลผล", queue.get("queued", 0))
+        st.metric("สำเร็จ", queue.get("completed", 0))
+    with col2:
+        st.metric("กำลังประมวลผล", queue.get("running", 0))
+        st.metric("ล้มเหลว", queue.get("failed", 0))
+    
+    if st.button("🔄 ส่งเอกสารที่ค้างเข้าคิว"):
+        queued = process_all_pending_embeddings()
+        st.success(f"เพิ่มเข้าคิว {queued} เอกสาร")
+
+def document_library():
+    """หน้าคลังเอกสาร"""
+    st.markdown("### 📚 คลังเอกสาร")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        status_filter = st.selectbox(
+            "สถานะ", ["ทั้งหมด", "pending", "processing", "completed", "failed"], key="library_status"
+        )
+    with col2:
+        category_filter = st.text_input("หมวดหมู่", key="library_category")
+    
+    with get_db_session() as session:
+        query = session.query(Document)
+        if status_filter != "ทั้งหมด":
+            query = query.filter(Document.processing_status == status_filter)
+        if category_filter:
+            query = query.filter(Document.category == category_filter)
+        
+        documents = [
+            {
+                "ID": doc.id,
+                "ชื่อไฟล์": doc.original_filename,
+                "หมวดหมู่": doc.category,
+                "ประเภท": doc.file_type,
+                "ขนาด (KB)": round(doc.file_size / 1024, 1),
+                "สถานะ": doc.processing_status,
+                "Chunks": f"{doc.chunks_count or 0}/{doc.chunks_total}" if doc.chunks_total else doc.chunks_count,
+                "อัพโหลดเมื่อ": doc.created_at
+            }
+            for doc in query.order_by(Document.created_at.desc()).limit(500).all()
+        ]
+    
+    if not documents:
+        st.info("ยังไม่มีเอกสาร")
+        return
+    
+    st.dataframe(pd.DataFrame(documents), use_container_width=True, hide_index=True)
+    
+    # จัดการเอกสารที่เลือก
+    selected_id = st.selectbox(
+        "เลือกเอกสาร", [doc["ID"] for doc in documents],
+        format_func=lambda doc_id: next(f"{doc['ID']} - {doc['ชื่อไฟล์']}" for doc in documents if doc["ID"] == doc_id)
+    )
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        if st.button("🔄 สร้าง Embeddings ใหม่"):
+            rebuild_document_embeddings([selected_id])
+            st.success("เพิ่มเข้าคิวแล้ว")
+    with col2:
+        if st.button("🗑️ ลบ Embeddings"):
+            if delete_document_embeddings(selected_id):
+                st.success("ลบ embeddings แล้ว")
+            else:
+                st.error("ไม่สามารถลบ embeddings ได้")
+    with col3:
+        if st.button("❌ ลบเอกสาร"):
+            if FileHandler().delete_document(selected_id):
+                st.success("ลบเอกสารแล้ว")
+                st.rerun()
+            else:
+                st.error("ไม่สามารถลบเอกสารได้")
+
+def highlight_markdown(content: str, highlights) -> str:
+    """ทำตัวหนาตามตำแหน่ง highlight (start, end)"""
+    parts, position = [], 0
+    for start, end in highlights:
+        parts.append(content[position:start])
+        parts.append(f"**{content[start:end]}**")
+        position = end
+    parts.append(content[position:])
+    return "".join(parts).replace("\n", " ")
+
+def search_documents():
+    """หน้าค้นหาเอกสาร"""
+    st.markdown("### 🔍 ค้นหาเอกสาร")
+    
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        query = st.text_input("คำค้นหา", placeholder="เช่น ขั้นตอนการขอใช้บริการ หรือ เลขที่แบบฟอร์ม")
+    with col2:
+        search_type = st.selectbox("ค้นหาจาก", ["ชื่อและเนื้อหาเอกสาร", "เนื้อหาที่เกี่ยวข้อง (AI)"])
+    
+    if not query:
+        return
+    
+    if search_type == "เนื้อหาที่เกี่ยวข้อง (AI)":
+        limit = st.slider("จำนวนผลลัพธ์", 1, 20, 5)
+        with st.spinner("กำลังค้นหา..."):
+            results = search_document_chunks(query, limit)
+        
+        if not results:
+            st.info("ไม่พบเอกสารที่เกี่ยวข้อง")
+            return
+        
+        for result in results:
+            with st.expander(f"📄 {result.get('title', '')} (ความคล้าย {result.get('similarity', 0):.2f})"):
+                st.write(result.get('content', ''))
+        return
+    
+    # เริ่มหน้าแรกใหม่เมื่อคำค้นเปลี่ยน
+    if st.session_state.get("document_search_query") != query:
+        st.session_state.document_search_query = query
+        st.session_state.document_search_page = 1
+    page = st.session_state.get("document_search_page", 1)
+    
+    with st.spinner("กำลังค้นหา..."):
+        result = document_search_service.search(query, page=page)
+    
+    total = result["total"]
+    if total == 0:
+        st.info("ไม่พบเอกสารที่ตรงกับคำค้นหา")
+        return
+    
+    pages = (total + result["page_size"] - 1) // result["page_size"]
+    st.caption(f"พบ {total:,} เอกสาร ({result['took_ms']:.0f} ms) หน้า {page}/{pages}")
+    
+    for hit in result["hits"]:
+        title = highlight_markdown(hit["title"], hit["title_highlights"])
+        st.markdown(f"**📄 {title}**  \n"
+                    f"<small>{hit['filename']} · {hit.get('category') or '-'} · "
+                    f"{', '.join(hit['tags']) if hit['tags'] else ''}</small>", unsafe_allow_html=True)
+        if hit["snippet"]:
+            prefix = "…" if hit["snippet_start"] > 0 else ""
+            st.markdown(prefix + highlight_markdown(hit["snippet"], hit["highlights"]) + "…")
+        st.divider()
+    
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        if page > 1 and st.button("⬅️ ก่อนหน้า"):
+            st.session_state.document_search_page = page - 1
+            st.rerun()
+    with col3:
+        if page < pages and st.button("ถัดไป ➡️"):
+            st.session_state.document_search_page = page + 1
+            st.rerun()
+
+def show_statistics():
+    """หน้าสถิติและรายงาน"""
+    st.markdown("### 📊 สถิติและรายงาน")
+    
+    stats = get_embedding_statistics()
+    if not stats:
+        st.warning("ไม่สามารถดึงสถิติได้")
+        return
+    
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("เอกสารทั้งหมด", stats.get('total_documents', 0))
+    with col2:
+        st.metric("มี Embeddings", stats.get('processed_documents', 0))
+    with col3:
+        st.metric("Chunks", stats.get('total_chunks', 0))
+    with col4:
+        st.metric("สำเร็จ", f"{stats.get('success_rate', 0):.1f}%")
+    
+    status_counts = {
+        "completed": stats.get('processed_documents', 0),
+        "pending": stats.get('pending_documents', 0),
+        "failed": stats.get('failed_documents', 0)
+    }
+    fig = px.pie(
+        names=list(status_counts.keys()),
+        values=list(status_counts.values()),
+        title="สถานะการประมวลผลเอกสาร",
+        color_discrete_sequence=[config.app.primary_color, config.app.accent_color, "#CD5C5C"]
+    )
+    st.plotly_chart(fig, use_container_width=True)
+    
+    cache = stats.get('embedding_cache', {})
+    if cache:
+        st.markdown("#### 💾 แคช Embeddings")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("รายการในแคช", cache.get('entries', 0))
+        with col2:
+            st.metric("Hit rate", f"{cache.get('hit_rate', 0)}%")
+        with col3:
+            st.metric("ลบออกแล้ว", cache.get('evicted', 0))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""
+ดัชนีค้นหาแบบประมาณ (Approximate Nearest Neighbour) ด้วย FAISS
+รองรับ IVF-Flat และ HNSW บันทึก/โหลดจาก config.app.embeddings_folder
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+from config import config
+from services.embedding_store import model_slug
+
+try:
+    import faiss
+except ImportError:  # faiss-cpu เป็น dependency เสริม
+    faiss = None
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("ivf_flat", "hnsw")
+
+class AnnIndex:
+    """ดัชนี ANN (inner product บน vector ที่ normalize แล้ว = cosine similarity)"""
+
+    def __init__(self, index_type: str = None, folder: str = None):
+        self.index_type = index_type or config.embedding.index_type
+        self.folder = folder or config.app.embeddings_folder
+        self._lock = threading.RLock()
+        self._index = None
+        self._ids = np.empty(0, dtype=np.int64)  # chunk ids ที่อยู่ในดัชนี
+        # HNSW ลบ vector ไม่ได้: ใช้ label ภายในที่ไม่ซ้ำกัน (chunk id ของ label i = _labels[i])
+        # และกรอง label ที่ถูกลบออกจากผลลัพธ์แทน
+        self._labels = np.empty(0, dtype=np.int64)
+        self._tombstones = set()
+        self._dim: Optional[int] = None
+        self._model: Optional[str] = None
+        self._last_saved = 0.0
+        self._dirty = False
+
+    @property
+    def enabled(self) -> bool:
+        """เปิดใช้ ANN หรือไม่ (ตามการตั้งค่าและการติดตั้ง faiss)"""
+        return self.index_type in INDEX_TYPES and faiss is not None
+
+    @property
+    def is_ready(self) -> bool:
+        """ดัชนีพร้อมค้นหาหรือไม่"""
+        return self._index is not None
+
+    @property
+    def size(self) -> int:
+        """จำนวน vectors ที่ค้นหาได้ (ไม่รวมที่ถูกลบ)"""
+        return len(self._ids)
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.folder, f"ann_{self.index_type}.faiss")
+
+    @property
+    def meta_path(self) -> str:
+        return os.path.join(self.folder, f"ann_{self.index_type}.json")
+
+    @property
+    def ids_path(self) -> str:
+        return os.path.join(self.folder, f"ann_{self.index_type}_ids.npy")
+
+    @property
+    def labels_path(self) -> str:
+        return os.path.join(self.folder, f"ann_{self.index_type}_labels.npy")
+
+    def _create_index(self, dim: int, n_train: int):
+        """สร้างดัชนี FAISS เปล่าตามประเภทที่ตั้งค่าไว้"""
+        if self.index_type == "hnsw":
+            hnsw = faiss.IndexHNSWFlat(dim, config.embedding.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            hnsw.hnsw.efConstruction = config.embedding.hnsw_ef_construction
+            hnsw.hnsw.efSearch = config.embedding.hnsw_ef_search
+            return faiss.IndexIDMap2(hnsw)
+
+        # FAISS แนะนำให้มีข้อมูล train อย่างน้อย ~39 vectors ต่อ centroid
+        nlist = max(1, min(config.embedding.ivf_nlist, n_train // 39))
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        index.nprobe = min(config.embedding.ivf_nprobe, nlist)
+        return index
+
+    def build(self, ids: np.ndarray, vectors: np.ndarray, model: str = None) -> int:
+        """สร้างดัชนีใหม่ทั้งหมดจาก vectors ที่ normalize แล้ว"""
+        if not self.enabled:
+            return 0
+
+        ids = np.ascontiguousarray(ids, dtype=np.int64)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        started = time.time()
+
+        index = self._create_index(vectors.shape[1], len(vectors))
+        if not index.is_trained:
+            # train ด้วยตัวอย่างสุ่ม เพื่อให้เวลา train ไม่โตตามขนาดคลัง
+            sample_size = min(len(vectors), index.nlist * 256)
+            sample = np.random.default_rng(0).choice(len(vectors), sample_size, replace=False)
+            index.train(vectors[np.sort(sample)])
+        if self.index_type == "hnsw":
+            index.add_with_ids(vectors, np.arange(len(ids), dtype=np.int64))
+        else:
+            index.add_with_ids(vectors, ids)
+
+        with self._lock:
+            self._index = index
+            self._ids = ids.copy()
+            self._labels = ids.copy() if self.index_type == "hnsw" else np.empty(0, dtype=np.int64)
+            self._tombstones = set()
+            self._dim = vectors.shape[1]
+            self._model = model
+            self._dirty = True
+
+        logger.info(f"สร้างดัชนี ANN ({self.index_type}) {len(ids)} vectors ใน {time.time() - started:.1f} วินาที")
+        return len(ids)
+
+    def add(self, ids: Sequence[int], vectors: np.ndarray) -> int:
+        """เพิ่ม vectors ที่ normalize แล้วเข้าดัชนี"""
+        if self._index is None or len(ids) == 0:
+            return 0
+
+        ids = np.ascontiguousarray(ids, dtype=np.int64)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock:
+            # id ที่มีอยู่แล้ว: ลบ vector เดิมก่อน ไม่ให้ chunk เดียวกันกลับมาสองครั้ง
+            self.remove(ids)
+            if self.index_type == "hnsw":
+                # vector ใหม่ได้ label ใหม่เสมอ label เดิมยังถูกกรองทิ้ง
+                labels = np.arange(len(self._labels), len(self._labels) + len(ids), dtype=np.int64)
+                self._index.add_with_ids(vectors, labels)
+                self._labels = np.concatenate([self._labels, ids])
+            else:
+                self._index.add_with_ids(vectors, ids)
+            self._ids = np.concatenate([self._ids, ids])
+            self._dirty = True
+        return len(ids)
+
+    def remove(self, ids: Sequence[int]) -> int:
+        """ลบ vectors ตาม chunk id"""
+        if self._index is None or len(ids) == 0:
+            return 0
+
+        ids = np.asarray(ids, dtype=np.int64)
+        with self._lock:
+            present = ids[np.isin(ids, self._ids)]
+            if present.size == 0:
+                return 0
+
+            if self.index_type == "hnsw":
+                # สร้าง set ใหม่แทนการแก้ไขตรงๆ เพราะ search อ่าน set เดิมนอก lock
+                labels = np.flatnonzero(np.isin(self._labels, present))
+                self._tombstones = self._tombstones | set(labels.tolist())
+            else:
+                self._index.remove_ids(present)
+
+            self._ids = self._ids[~np.isin(self._ids, present)]
+            self._dirty = True
+            return int(present.size)
+
+    @property
+    def needs_rebuild(self) -> bool:
+        """HNSW ที่มี vector ถูกลบสะสมมากเกินไปควรสร้างใหม่"""
+        return len(self._tombstones) > max(1000, 0.1 * max(len(self._ids), 1))
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """ค้นหา k vectors ที่ใกล้ที่สุด ส่งคืน (chunk_ids, similarities)"""
+        with self._lock:
+            index = self._index
+            tombstones = self._tombstones
+            labels = self._labels
+            fetch = k + len(tombstones)
+
+        query = np.ascontiguousarray(query, dtype=np.float32).reshape(1, -1)
+        scores, ids = index.search(query, fetch)
+        scores, ids = scores[0], ids[0]
+
+        keep = ids >= 0
+        if tombstones:
+            keep &= ~np.isin(ids, np.fromiter(tombstones, dtype=np.int64))
+        ids, scores = ids[keep][:k], scores[keep][:k]
+        if self.index_type == "hnsw":
+            ids = labels[ids]
+        return ids, scores
+
+    def set_search_params(self, nprobe: int = None, ef_search: int = None):
+        """ปรับพารามิเตอร์การค้นหา (ใช้ในการวัด recall/latency)"""
+        with self._lock:
+            if self._index is None:
+                return
+            if nprobe is not None and self.index_type == "ivf_flat":
+                self._index.nprobe = nprobe
+            if ef_search is not None and self.index_type == "hnsw":
+                faiss.downcast_index(self._index.index).hnsw.efSearch = ef_search
+
+    def save(self, force: bool = False) -> bool:
+        """บันทึกดัชนีลงดิสก์ (เขียนไฟล์ชั่วคราวแล้วเปลี่ยนชื่อ)"""
+        with self._lock:
+            if self._index is None or not self._dirty:
+                return False
+            if not force and time.time() - self._last_saved < config.embedding.ann_save_interval:
+                return False
+
+            os.makedirs(self.folder, exist_ok=True)
+            faiss.write_index(self._index, self.index_path + ".tmp")
+            np.save(self.ids_path + ".tmp.npy", self._ids)
+            if self.index_type == "hnsw":
+                np.save(self.labels_path + ".tmp.npy", self._labels)
+            with open(self.meta_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({
+                    "index_type": self.index_type,
+                    "dim": self._dim,
+                    "model": self._model,
+                    "count": int(len(self._ids)),
+                    "tombstones": sorted(self._tombstones),
+                    "labels": self.index_type == "hnsw",
+                    "saved_at": time.time()
+                }, f)
+
+            os.replace(self.index_path + ".tmp", self.index_path)
+            os.replace(self.ids_path + ".tmp.npy", self.ids_path)
+            if self.index_type == "hnsw":
+                os.replace(self.labels_path + ".tmp.npy", self.labels_path)
+            os.replace(self.meta_path + ".tmp", self.meta_path)
+            self._last_saved = time.time()
+            self._dirty = False
+            logger.info(f"บันทึกดัชนี ANN ({self.index_type}) {len(self._ids)} vectors")
+            return True
+
+    def load(self, model: str = None) -> bool:
+        """โหลดดัชนีจากดิสก์ (ไม่โหลดถ้าสร้างจากโมเดลอื่น)"""
+        if not self.enabled or not os.path.exists(self.index_path):
+            return False
+
+        try:
+            with open(self.meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            if model and meta.get("model") and meta["model"] != model:
+                logger.warning(f"ดัชนี ANN ถูกสร้างจากโมเดล {meta['model']} จะสร้างใหม่")
+                return False
+            if self.index_type == "hnsw" and not meta.get("labels"):
+                logger.warning("ดัชนี ANN (hnsw) เป็นรูปแบบเดิมที่ใช้ chunk id เป็น label จะสร้างใหม่")
+                return False
+
+            index = faiss.read_index(self.index_path)
+            ids = np.load(self.ids_path)
+            labels = np.load(self.labels_path) if self.index_type == "hnsw" else np.empty(0, dtype=np.int64)
+        except Exception as e:
+            logger.error(f"ไม่สามารถโหลดดัชนี ANN ได้: {e}")
+            return False
+
+        with self._lock:
+            self._index = index
+            self._ids = ids
+            self._labels = labels
+            self._tombstones = set(meta.get("tombstones", []))
+            self._dim = meta.get("dim")
+            self._model = meta.get("model")
+            self._last_saved = time.time()
+            self._dirty = False
+
+        self.set_search_params(nprobe=config.embedding.ivf_nprobe, ef_search=config.embedding.hnsw_ef_search)
+        logger.info(f"โหลดดัชนี ANN ({self.index_type}) {len(ids)} vectors")
+        return True
+
+    def sync(self, ids: np.ndarray, vectors: np.ndarray) -> Tuple[int, int]:
+        """ปรับดัชนีที่โหลดจากดิสก์ให้ตรงกับชุด chunk ปัจจุบัน ส่งคืน (จำนวนที่เพิ่ม, จำนวนที่ลบ)"""
+        if self._index is None:
+            return 0, 0
+
+        missing = ~np.isin(ids, self._ids)
+        added = self.add(ids[missing], vectors[missing])
+        removed = self.remove(self._ids[~np.isin(self._ids, ids)])
+        return added, removed
+
+# สร้าง instance หลัก
+ann_index = AnnIndex()
+
+# บันทึกดัชนีที่ยังไม่ได้เขียนลงดิสก์เมื่อปิดแอปพลิเคชัน
+atexit.register(ann_index.save, True)
+
+def create_ann_index(model: str) -> AnnIndex:
+    """ดัชนี ANN ของโมเดลที่ระบุ (โมเดลตั้งต้นใช้ไฟล์เดิม โมเดลอื่นแยกโฟลเดอร์ ไม่เขียนทับกันระหว่างสลับโมเดล)"""
+    folder = None
+    if model != config.embedding.model:
+        folder = os.path.join(config.app.embeddings_folder, "ann", model_slug(model))
+    index = AnnIndex(folder=folder)
+    atexit.register(index.save, True)
+    return index
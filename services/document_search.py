@@ -0,0 +1,339 @@
+"""
+ค้นหาเอกสารแบบ full-text จากชื่อเรื่อง ชื่อไฟล์ tags คำอธิบาย และข้อความที่สกัดได้
+ใช้ดัชนีคำ BM25 ระดับเอกสาร (ไม่สแกนตาราง documents) ผลลัพธ์แบ่งหน้าพร้อม snippet และตำแหน่ง highlight
+"""
+
+import atexit
+import hashlib
+import logging
+import re
+import time
+import unicodedata
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from sqlalchemy import func
+
+from config import config
+from database.database import get_db_session
+from database.models import Document
+from services.keyword_index import THAI, InvertedIndex
+from services.vector_index import DocumentAttributes
+
+logger = logging.getLogger(__name__)
+
+# น้ำหนักของแต่ละช่อง (จำนวนครั้งของคำในช่องคูณน้ำหนักก่อนคำนวณ BM25)
+FIELD_WEIGHTS = {"title": 4, "filename": 3, "tags": 3, "description": 2, "text": 1}
+THAI_WORD = re.compile(f"[{THAI}]+")
+
+class DocumentSearchIndex(InvertedIndex):
+    """ดัชนีคำของเอกสาร (key = document id) sync ตาม documents.updated_at
+    ตัดคำใหม่เฉพาะเอกสารที่ช่องที่ทำดัชนีเปลี่ยน (ตรวจด้วย fingerprint ของช่อง)"""
+
+    name = "documents"
+    version = "-" + "".join(f"{field[0]}{weight}" for field, weight in FIELD_WEIGHTS.items())
+
+    def __init__(self, *args, **kwargs):
+        self.documents = DocumentAttributes()
+        super().__init__(*args, **kwargs)
+
+    def _clear_sync_state(self):
+        self._synced_at: Optional[datetime] = None  # updated_at ล่าสุดที่ sync แล้ว
+        self._boundary: set = set()  # เอกสารที่มี updated_at เท่ากับ _synced_at (ไม่ต้องทำซ้ำ)
+        # fingerprint ของช่องที่ทำดัชนีแล้ว: updated_at เปลี่ยนบ่อยระหว่างสร้าง embeddings (chunks_count)
+        # โดยที่ข้อความไม่เปลี่ยน จึงไม่ต้องตัดคำใหม่
+        self._fingerprints: Dict[int, str] = {}
+        self.documents.clear()
+
+    def _sync_state(self) -> Dict:
+        return {
+            "synced_at": self._synced_at.isoformat() if self._synced_at else None,
+            "boundary": sorted(self._boundary),
+            "fingerprints": {str(document_id): value for document_id, value in self._fingerprints.items()}
+        }
+
+    def _restore_sync_state(self, meta: Dict):
+        self._synced_at = datetime.fromisoformat(meta["synced_at"]) if meta.get("synced_at") else None
+        self._boundary = set(meta.get("boundary", []))
+        self._fingerprints = {int(document_id): value for document_id, value in meta.get("fingerprints", {}).items()}
+
+    def _count_terms(self, fields: Dict[str, str]) -> Counter:
+        counts = Counter()
+        for field, weight in FIELD_WEIGHTS.items():
+            field_counts = Counter(self.tokenizer(fields.get(field) or ""))
+            if weight != 1:
+                for term in field_counts:
+                    field_counts[term] *= weight
+            counts.update(field_counts)
+        return counts
+
+    @staticmethod
+    def fields(row) -> Dict[str, str]:
+        """ข้อความแต่ละช่องของเอกสาร (ข้อความที่สกัดได้ถูกตัดที่ document_search_max_chars)"""
+        tags = row.tags or []
+        if isinstance(tags, str):
+            tags = [tags]
+        filenames = {row.original_filename or "", row.filename or ""}
+        return {
+            "title": row.title or "",
+            "filename": " ".join(name for name in filenames if name),
+            "tags": " ".join(str(tag) for tag in tags),
+            "description": row.description or "",
+            "text": (row.extracted_text or "")[:config.embedding.document_search_max_chars]
+        }
+
+    @staticmethod
+    def fingerprint(fields: Dict[str, str]) -> str:
+        """hash ของทุกช่องที่ทำดัชนี (เปลี่ยนเมื่อข้อความที่ตัดคำเปลี่ยนเท่านั้น)"""
+        content = "\x1f".join(fields[field] for field in FIELD_WEIGHTS)
+        return hashlib.blake2b(content.encode("utf-8"), digest_size=8).hexdigest()
+
+    @staticmethod
+    def _query_rows(session):
+        return session.query(
+            Document.id, Document.title, Document.original_filename, Document.filename,
+            Document.tags, Document.description, Document.extracted_text, Document.updated_at
+        )
+
+    def _add_rows(self, rows, only_changed: bool = False) -> int:
+        """ทำดัชนีเอกสาร only_changed: แทนที่เฉพาะเอกสารที่ fingerprint ของช่องเปลี่ยน ส่งคืนจำนวนที่ทำดัชนี"""
+        fields = {row.id: self.fields(row) for row in rows}
+        fingerprints = {document_id: self.fingerprint(value) for document_id, value in fields.items()}
+        changed = [
+            document_id for document_id in fields
+            if not only_changed or self._fingerprints.get(document_id) != fingerprints[document_id]
+        ]
+        if only_changed:
+            self.remove(changed)
+        added = self.add((document_id, document_id, fields[document_id]) for document_id in changed)
+        self._fingerprints.update((document_id, fingerprints[document_id]) for document_id in changed)
+        updated = [row.updated_at for row in rows if row.updated_at is not None]
+        if updated:
+            latest = max(updated)
+            if self._synced_at is None or latest > self._synced_at:
+                self._synced_at = latest
+                self._boundary = set()
+            self._boundary.update(row.id for row in rows if row.updated_at == self._synced_at)
+        return added
+
+    def build_from_database(self, batch_size: int = 500) -> int:
+        """โหลดดัชนีจากดิสก์แล้ว sync ส่วนที่เปลี่ยน หรือสร้างใหม่จากตาราง documents"""
+        with self._write_lock:
+            if self.load():
+                self.refresh(force=True)
+                return self._alive_count
+
+            self.clear()
+            last_id = 0
+            while True:
+                with get_db_session() as session:
+                    rows = self._query_rows(session).filter(
+                        Document.id > last_id
+                    ).order_by(Document.id).limit(batch_size).all()
+                if not rows:
+                    break
+                self._add_rows(rows)
+                last_id = rows[-1].id
+
+            self.documents.sync()
+            self._last_refresh = time.monotonic()
+            self.is_built = True
+            self._dirty = True
+            self.save(force=True)
+            logger.info(f"สร้างดัชนีค้นหาเอกสารเรียบร้อย: {self._alive_count} เอกสาร {len(self._terms)} คำ")
+            return self._alive_count
+
+    def refresh(self, force: bool = False) -> Tuple[int, int]:
+        """ทำดัชนีใหม่เฉพาะเอกสารที่เพิ่ม/แก้ไขตั้งแต่ครั้งก่อน และนำเอกสารที่ถูกลบออก ส่งคืน (ทำดัชนี, ลบ)
+        อ่านฐานข้อมูลและตัดคำโดยไม่ถือ lock ของการค้นหา (ผู้เรียกที่ไม่ force ข้ามถ้ามี refresh อื่นกำลังทำงาน)"""
+        if not self.is_built or not self._write_lock.acquire(blocking=force):
+            return 0, 0
+        try:
+            now = time.monotonic()
+            if not force and now - self._last_refresh < config.embedding.index_refresh_interval:
+                return 0, 0
+            self._last_refresh = now
+
+            with get_db_session() as session:
+                query = self._query_rows(session)
+                if self._synced_at is not None:
+                    # ใช้ >= เผื่อเอกสารที่แก้ไขในวินาทีเดียวกับ sync ครั้งก่อน
+                    query = query.filter(Document.updated_at >= self._synced_at)
+                rows = [
+                    row for row in query.all()
+                    if not (row.updated_at == self._synced_at and row.id in self._boundary)
+                ]
+                total = session.query(func.count(Document.id)).scalar() or 0
+
+            indexed = self._add_rows(rows, only_changed=True) if rows else 0
+
+            # เอกสารที่ถูกลบ: ตรวจรายการ id เฉพาะเมื่อจำนวนไม่ตรงกับดัชนี
+            removed = 0
+            if total != self._alive_count:
+                with get_db_session() as session:
+                    existing = np.fromiter((row.id for row in session.query(Document.id).all()), dtype=np.int64)
+                    with self._lock:
+                        held = self._keys[:self._rows][self._alive[:self._rows]]
+                    gone = held[~np.isin(held, existing)]
+                    removed = self.remove(gone)
+                    for document_id in gone.tolist():
+                        self._fingerprints.pop(document_id, None)
+                    missing = np.setdiff1d(existing, held)
+                    if missing.size:
+                        indexed += self._add_rows(
+                            self._query_rows(session).filter(Document.id.in_(missing.tolist())).all()
+                        )
+
+            self.documents.sync()
+            if indexed or removed:
+                self._dirty = True
+                logger.info(f"refresh ดัชนีค้นหาเอกสาร: ทำดัชนี {indexed} ลบ {removed} เอกสาร")
+                self.save()
+            return indexed, removed
+        finally:
+            self._write_lock.release()
+
+def highlight_terms(query: str, content: str) -> List[str]:
+    """คำที่ใช้ highlight: คำในคำค้นที่พบในข้อความ คำภาษาไทยที่ไม่พบทั้งคำจะแบ่งเป็นส่วนที่ยาวที่สุดที่พบในข้อความ"""
+    lowered = content.lower()
+    terms = []
+    for word in unicodedata.normalize("NFKC", query).lower().split():
+        if word in lowered:
+            terms.append(word)
+            continue
+        for run in THAI_WORD.findall(word):
+            start = 0
+            while start < len(run) - 1:
+                end = len(run)
+                while end - start >= 2 and run[start:end] not in lowered:
+                    end -= 1
+                if end - start >= 2:
+                    terms.append(run[start:end])
+                    start = end
+                else:
+                    start += 1
+    return sorted(set(terms), key=len, reverse=True)
+
+def find_spans(content: str, terms: Sequence[str]) -> List[Tuple[int, int]]:
+    """ตำแหน่ง (start, end) ของคำใน content ไม่ซ้อนกัน เรียงตามตำแหน่ง"""
+    if not terms or not content:
+        return []
+    pattern = re.compile("|".join(re.escape(term) for term in terms), re.IGNORECASE)
+    return [match.span() for match in pattern.finditer(content)]
+
+def make_snippet(content: str, spans: List[Tuple[int, int]], size: int) -> Tuple[str, int, List[Tuple[int, int]]]:
+    """เลือกช่วงข้อความยาว size ที่มีคำค้นมากที่สุด ส่งคืน (snippet, ตำแหน่งเริ่มใน content, highlights ใน snippet)"""
+    if not spans:
+        snippet = content[:size]
+        return snippet, 0, []
+
+    # two pointers: หน้าต่างที่เริ่มที่ span i และครอบคลุม span มากที่สุด
+    best, best_count, j = 0, 0, 0
+    for i, (start, _) in enumerate(spans):
+        j = max(j, i)
+        while j + 1 < len(spans) and spans[j + 1][1] - start <= size:
+            j += 1
+        if j - i + 1 > best_count:
+            best, best_count = i, j - i + 1
+
+    first, last = spans[best][0], spans[best + best_count - 1][1]
+    start = max(0, first - (size - (last - first)) // 2)
+    end = min(len(content), start + size)
+    start = max(0, end - size)
+    # ขยับขอบไปที่ช่องว่างใกล้ที่สุดเพื่อไม่ตัดกลางคำ (ไม่เกิน 20 ตัวอักษร)
+    if start > 0:
+        space = content.find(" ", start, min(first, start + 20))
+        if space != -1:
+            start = space + 1
+    if end < len(content):
+        space = content.rfind(" ", max(last, end - 20), end)
+        if space != -1:
+            end = space
+
+    highlights = [(s - start, e - start) for s, e in spans if s >= start and e <= end]
+    return content[start:end], start, highlights
+
+class DocumentSearchService:
+    """ค้นหาเอกสารแบบแบ่งหน้า (ตัวกรองใช้ตารางคุณสมบัติเอกสารก่อนคำนวณคะแนน)"""
+
+    def __init__(self, index: DocumentSearchIndex = None):
+        self.index = index or document_search_index
+
+    def search(self, query: str, page: int = 1, page_size: int = None,
+               category: Union[str, List[str]] = None,
+               is_public: Optional[bool] = None,
+               uploaded_by: Union[int, List[int]] = None,
+               visible_to: Optional[int] = None) -> Dict[str, Any]:
+        """ส่งคืน {"total", "page", "page_size", "took_ms", "hits"} แต่ละ hit มี snippet และ highlights
+        (ตำแหน่ง (start, end) ใน snippet) และ title_highlights (ตำแหน่งในชื่อเรื่อง)"""
+        started = time.perf_counter()
+        page = max(1, int(page))
+        page_size = page_size or config.embedding.document_search_page_size
+        result = {"total": 0, "page": page, "page_size": page_size, "took_ms": 0.0, "hits": []}
+        if not query or not query.strip():
+            return result
+
+        try:
+            self.index.ensure_built()
+
+            allowed = None
+            filters = {'category': category, 'is_public': is_public, 'uploaded_by': uploaded_by, 'visible_to': visible_to}
+            if any(value is not None for value in filters.values()):
+                allowed = self.index.documents.matching(**filters)
+
+            keys, scores = self.index.score(query, allowed)
+            result["total"] = int(keys.size)
+            document_ids, page_scores = self.index.top(keys, scores, page_size, (page - 1) * page_size)
+            if document_ids.size:
+                result["hits"] = self._build_hits(query, document_ids.tolist(), page_scores.tolist())
+        except Exception as e:
+            logger.error(f"เกิดข้อผิดพลาดในการค้นหาเอกสาร: {e}")
+
+        result["took_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return result
+
+    def _build_hits(self, query: str, document_ids: List[int], scores: List[float]) -> List[Dict[str, Any]]:
+        """ดึงข้อมูลเอกสารในหน้าปัจจุบันและสร้าง snippet"""
+        with get_db_session() as session:
+            rows = {
+                row.id: row for row in session.query(
+                    Document.id, Document.title, Document.original_filename, Document.filename,
+                    Document.category, Document.tags, Document.description, Document.file_type,
+                    Document.created_at, Document.extracted_text
+                ).filter(Document.id.in_(document_ids)).all()
+            }
+
+        size = config.embedding.document_search_snippet_chars
+        hits = []
+        for document_id, score in zip(document_ids, scores):
+            row = rows.get(document_id)
+            if row is None:
+                continue
+            title = row.title or row.original_filename
+            content = (row.extracted_text or row.description or "")[:config.embedding.document_search_max_chars]
+            terms = highlight_terms(query, f"{title}\n{content}")
+            snippet, snippet_start, highlights = make_snippet(content, find_spans(content, terms), size)
+            hits.append({
+                'document_id': row.id,
+                'title': title,
+                'filename': row.original_filename,
+                'category': row.category,
+                'tags': row.tags or [],
+                'file_type': row.file_type,
+                'created_at': row.created_at,
+                'score': float(score),
+                'title_highlights': find_spans(title, terms),
+                'snippet': snippet,
+                'snippet_start': snippet_start,
+                'highlights': highlights
+            })
+        return hits
+
+# สร้าง instance หลัก
+document_search_index = DocumentSearchIndex()
+document_search_service = DocumentSearchService()
+
+# บันทึกส่วนที่ยังไม่ได้เขียนลงดิสก์เมื่อปิดแอปพลิเคชัน
+atexit.register(document_search_index.save, True)
@@ -0,0 +1,167 @@
+"""
+vector ระดับเอกสาร (ค่าเฉลี่ยของ vectors ของ chunks ที่อยู่ในดัชนี) สำหรับการค้นหาสองระดับ
+รอบแรกเลือกเอกสารที่ใกล้กับคำถามที่สุด แล้วคำนวณคะแนน chunks เฉพาะในเอกสารเหล่านั้น (config.embedding.hierarchical_search)
+
+ตัวอย่าง:
+    python -m services.document_summaries status
+    python -m services.document_summaries backfill    # คำนวณ vector ระดับเอกสารที่ยังไม่มีหรือเป็นของโมเดลเดิม
+"""
+
+import argparse
+import json
+import logging
+from typing import Any, Dict, Iterable
+
+import numpy as np
+from sqlalchemy import bindparam, func, or_, text
+
+from config import config
+from database.database import get_db_session
+from database.models import Document
+from services.embedding_models import HAS_MODEL_VECTOR, MODEL_VECTOR_JOIN, NATIVE_VECTOR, embedding_models, model_params
+from utils.vector_codec import encode_embedding, load_embedding
+
+logger = logging.getLogger(__name__)
+
+# จำนวนเอกสารต่อ query ตอนดึง vectors ของ chunks
+DOCUMENT_BATCH_SIZE = 200
+
+class DocumentSummaryService:
+    """คำนวณและบันทึก documents.summary_vector (โมเดลเดียวกับดัชนี vector)"""
+
+    def __init__(self):
+        self.models = embedding_models
+
+    @staticmethod
+    def compute(document_ids: Iterable[int], model: str) -> Dict[int, np.ndarray]:
+        """ค่าเฉลี่ยของ vectors (normalize แล้ว) ของ chunks ที่อยู่ในดัชนี (ไม่รวม chunks ที่ซ้ำกับ chunk หลัก)"""
+        document_ids = sorted({int(document_id) for document_id in document_ids})
+        sums: Dict[int, np.ndarray] = {}
+        for start in range(0, len(document_ids), DOCUMENT_BATCH_SIZE):
+            batch = document_ids[start:start + DOCUMENT_BATCH_SIZE]
+            placeholders = ",".join(f":doc_{i}" for i in range(len(batch)))
+            params = {f"doc_{i}": document_id for i, document_id in enumerate(batch)}
+            with get_db_session() as session:
+                rows = session.execute(text(f"""
+                    SELECT dc.document_id,
+                           CASE WHEN {NATIVE_VECTOR} THEN dc.embedding_vector ELSE ce.embedding_vector END AS embedding_vector,
+                           CASE WHEN {NATIVE_VECTOR} THEN dc.embedding ELSE NULL END AS embedding
+                    FROM document_chunks dc
+                    {MODEL_VECTOR_JOIN}
+                    WHERE {HAS_MODEL_VECTOR}
+                    AND dc.canonical_chunk_id IS NULL AND dc.document_id IN ({placeholders})
+                """), {**params, **model_params(model)}).fetchall()
+
+            for row in rows:
+                vector = load_embedding(row.embedding_vector, row.embedding)
+                if vector is None:
+                    continue
+                norm = np.linalg.norm(vector)
+                if norm == 0:
+                    continue
+                total = sums.get(row.document_id)
+                if total is not None and total.shape != vector.shape:
+                    continue
+                sums[row.document_id] = vector / norm if total is None else total + vector / norm
+
+        return {
+            document_id: (total / np.linalg.norm(total)).astype(np.float32)
+            for document_id, total in sums.items() if np.linalg.norm(total) > 0
+        }
+
+    def update(self, document_ids: Iterable[int], model: str = None) -> int:
+        """คำนวณและบันทึก vector ระดับเอกสาร ส่งคืนจำนวนเอกสารที่มี vector
+        (เอกสารที่ไม่มี chunks ในดัชนีบันทึกเฉพาะโมเดล เพื่อไม่ถูกเลือกมาคำนวณซ้ำ)"""
+        model = model or self.models.active_model()
+        document_ids = sorted({int(document_id) for document_id in document_ids})
+        if not document_ids:
+            return 0
+
+        summaries = self.compute(document_ids, model)
+        table = Document.__table__
+        with get_db_session() as session:
+            session.execute(
+                table.update().where(table.c.id == bindparam("document_id")).values(
+                    summary_vector=bindparam("summary_vector"), summary_model=bindparam("summary_model")
+                ),
+                [
+                    {
+                        "document_id": document_id,
+                        "summary_vector": encode_embedding(summaries[document_id], model) if document_id in summaries else None,
+                        "summary_model": model
+                    }
+                    for document_id in document_ids
+                ]
+            )
+            session.commit()
+        return len(summaries)
+
+    @staticmethod
+    def _outdated(model: str):
+        """เอกสารที่มี embeddings แต่ยังไม่มี vector ระดับเอกสารของโมเดลนี้"""
+        return (Document.has_embeddings == True) & or_(
+            Document.summary_model.is_(None), Document.summary_model != model
+        )
+
+    def run_batch(self, batch_size: int = None) -> int:
+        """คำนวณ vector ระดับเอกสารที่ขาดหนึ่ง batch (worker เรียกเมื่อคิวว่าง) ส่งคืนจำนวนเอกสารที่คำนวณ"""
+        model = self.models.active_model()
+        with get_db_session() as session:
+            document_ids = [
+                row.id for row in session.query(Document.id).filter(
+                    self._outdated(model)
+                ).order_by(Document.id).limit(batch_size or DOCUMENT_BATCH_SIZE).all()
+            ]
+        if not document_ids:
+            return 0
+
+        summarized = self.update(document_ids, model)
+        logger.info(f"คำนวณ vector ระดับเอกสารของโมเดล {model}: {summarized}/{len(document_ids)} เอกสาร")
+        return len(document_ids)
+
+    def status(self) -> Dict[str, Any]:
+        """จำนวนเอกสารที่มี vector ระดับเอกสารของโมเดลที่ active"""
+        model = self.models.active_model()
+        with get_db_session() as session:
+            embedded = session.query(func.count(Document.id)).filter(Document.has_embeddings == True).scalar() or 0
+            summarized = session.query(func.count(Document.id)).filter(
+                Document.summary_model == model, Document.summary_vector.isnot(None)
+            ).scalar() or 0
+            outdated = session.query(func.count(Document.id)).filter(self._outdated(model)).scalar() or 0
+        return {
+            "model": model,
+            "enabled": config.embedding.hierarchical_search,
+            "documents_with_embeddings": embedded,
+            "summarized": summarized,
+            "outdated": outdated,
+            "top_documents": config.embedding.hierarchical_top_documents,
+            "min_documents": config.embedding.hierarchical_min_documents
+        }
+
+# สร้าง instance หลัก
+document_summaries = DocumentSummaryService()
+
+def main():
+    parser = argparse.ArgumentParser(description="vector ระดับเอกสารสำหรับการค้นหาสองระดับ")
+    parser.add_argument("command", choices=["status", "backfill"])
+    parser.add_argument("--batch-size", type=int, default=DOCUMENT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    from database.database import init_database, run_migrations
+    init_database()
+    run_migrations()
+
+    if args.command == "backfill":
+        total = 0
+        while True:
+            processed = document_summaries.run_batch(args.batch_size)
+            if not processed:
+                break
+            total += processed
+        logger.info(f"คำนวณ vector ระดับเอกสารแล้ว {total} เอกสาร")
+    print(json.dumps(document_summaries.status(), ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
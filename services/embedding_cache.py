@@ -0,0 +1,292 @@
+"""
+แคช embeddings แบบ content-addressed (ตาราง embedding_cache)
+chunks ที่เหมือนเดิมในเอกสารฉบับแก้ไขจะใช้ embedding เดิมโดยไม่ต้องเรียก API
+และแคช embeddings ของคำถามในหน่วยความจำ (LRU + TTL) สำหรับคำถามที่ถูกถามซ้ำ
+"""
+
+import hashlib
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from config import config
+from database.database import get_db_session
+from database.models import EmbeddingCache
+from utils.vector_codec import decode_embedding, encode_embedding
+
+logger = logging.getLogger(__name__)
+
+# จำนวน key สูงสุดต่อ IN (...) หนึ่งครั้ง
+KEY_BATCH_SIZE = 500
+
+def normalize_text(content: str) -> str:
+    """normalize ข้อความก่อนคำนวณ hash (Unicode NFC และรวมช่องว่างที่ติดกัน)"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", content)).strip()
+
+def cache_key(model: str, content: str) -> str:
+    """sha256 ของ (โมเดล, ข้อความที่ normalize แล้ว)"""
+    return hashlib.sha256(f"{model}\0{normalize_text(content)}".encode("utf-8")).hexdigest()
+
+class EmbeddingCacheService:
+    """อ่าน/เขียนแคช embeddings พร้อมสถิติ hit rate และการลบแถวที่ไม่ได้ใช้นานที่สุด"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._last_evict = 0.0
+        # cache hits ที่ยังไม่ได้บันทึก: content_hash -> จำนวนครั้ง
+        self._touched: Dict[str, int] = {}
+        self._last_touch_flush = time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return config.embedding.cache_enabled
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """ค้นหา embeddings ในแคช ส่งคืน list ตามลำดับ texts (ไม่พบ = None)"""
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        if not self.enabled or not texts:
+            return results
+
+        keys = [cache_key(model, content) for content in texts]
+        unique_keys = list(dict.fromkeys(keys))
+        found: Dict[str, bytes] = {}
+        try:
+            with get_db_session() as session:
+                for start in range(0, len(unique_keys), KEY_BATCH_SIZE):
+                    batch = unique_keys[start:start + KEY_BATCH_SIZE]
+                    rows = session.query(EmbeddingCache.content_hash, EmbeddingCache.embedding_vector).filter(
+                        EmbeddingCache.content_hash.in_(batch)
+                    ).all()
+                    if not rows:
+                        continue
+                    found.update((row.content_hash, row.embedding_vector) for row in rows)
+        except Exception as e:
+            logger.warning(f"ไม่สามารถอ่านแคช embeddings: {e}")
+            found = {}
+
+        for i, key in enumerate(keys):
+            blob = found.get(key)
+            if blob is None:
+                continue
+            try:
+                results[i] = decode_embedding(blob, expected_model=model).tolist()
+            except ValueError as e:
+                logger.warning(f"แคช embedding {key[:12]} เสียหาย: {e}")
+
+        hits = sum(result is not None for result in results)
+        with self._lock:
+            self.hits += hits
+            self.misses += len(texts) - hits
+            for key in found:
+                self._touched[key] = self._touched.get(key, 0) + 1
+        self.flush_touches()
+        return results
+
+    def get(self, model: str, content: str) -> Optional[List[float]]:
+        """ค้นหา embedding ของข้อความเดียว"""
+        return self.get_many(model, [content])[0]
+
+    def put_many(self, model: str, texts: Sequence[str], embeddings: Sequence[Optional[List[float]]]) -> int:
+        """บันทึก embeddings ใหม่ลงแคช (ข้ามที่มีอยู่แล้ว) ส่งคืนจำนวนที่บันทึก"""
+        if not self.enabled:
+            return 0
+
+        entries: Dict[str, bytes] = {}
+        for content, embedding in zip(texts, embeddings):
+            if embedding:
+                entries.setdefault(cache_key(model, content), encode_embedding(embedding, model))
+        if not entries:
+            return 0
+
+        now = datetime.utcnow()
+        try:
+            with get_db_session() as session:
+                keys = list(entries)
+                existing = set()
+                for start in range(0, len(keys), KEY_BATCH_SIZE):
+                    existing.update(
+                        row.content_hash for row in session.query(EmbeddingCache.content_hash).filter(
+                            EmbeddingCache.content_hash.in_(keys[start:start + KEY_BATCH_SIZE])
+                        ).all()
+                    )
+                rows = [
+                    {"content_hash": key, "model": model, "embedding_vector": blob,
+                     "hit_count": 0, "created_at": now, "last_used_at": now}
+                    for key, blob in entries.items() if key not in existing
+                ]
+                if rows:
+                    try:
+                        session.execute(EmbeddingCache.__table__.insert(), rows)
+                        session.commit()
+                    except IntegrityError:
+                        # process อื่นบันทึกข้อความเดียวกันไปก่อน ไม่ถือเป็นข้อผิดพลาด
+                        session.rollback()
+                        rows = []
+        except Exception as e:
+            logger.warning(f"ไม่สามารถบันทึกแคช embeddings: {e}")
+            return 0
+
+        self.evict_if_needed()
+        return len(rows)
+
+    def flush_touches(self, force: bool = False) -> int:
+        """บันทึก last_used_at/hit_count ของ cache hits ที่สะสมไว้ (ไม่เกินทุก cache_touch_interval วินาที)
+        ส่งคืนจำนวนแถวที่บันทึก
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not self._touched or (not force and now - self._last_touch_flush < config.embedding.cache_touch_interval):
+                return 0
+            touched, self._touched = self._touched, {}
+            self._last_touch_flush = now
+
+        # รวม key ที่มีจำนวนครั้งเท่ากันเป็น UPDATE เดียว
+        by_count: Dict[int, List[str]] = {}
+        for key, count in touched.items():
+            by_count.setdefault(count, []).append(key)
+
+        used_at = datetime.utcnow()
+        try:
+            with get_db_session() as session:
+                for count, keys in by_count.items():
+                    for start in range(0, len(keys), KEY_BATCH_SIZE):
+                        session.query(EmbeddingCache).filter(
+                            EmbeddingCache.content_hash.in_(keys[start:start + KEY_BATCH_SIZE])
+                        ).update({
+                            EmbeddingCache.last_used_at: used_at,
+                            EmbeddingCache.hit_count: EmbeddingCache.hit_count + count
+                        }, synchronize_session=False)
+                session.commit()
+        except Exception as e:
+            logger.warning(f"ไม่สามารถบันทึกการใช้งานแคช embeddings: {e}")
+            return 0
+        return len(touched)
+
+    def evict_if_needed(self, force: bool = False) -> int:
+        """ลบแถวที่ไม่ได้ใช้นานที่สุดให้เหลือไม่เกิน cache_max_entries (ตรวจไม่เกินทุก cache_evict_interval วินาที)"""
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_evict < config.embedding.cache_evict_interval:
+                return 0
+            self._last_evict = now
+
+        # ให้ last_used_at เป็นปัจจุบันก่อนเลือกแถวที่จะลบ
+        self.flush_touches(force=True)
+        max_entries = config.embedding.cache_max_entries
+        try:
+            with get_db_session() as session:
+                count = session.query(func.count(EmbeddingCache.id)).scalar() or 0
+                if count <= max_entries:
+                    return 0
+
+                # เวลาใช้งานล่าสุดของแถวที่ max_entries (แถวที่เก่ากว่านี้จะถูกลบ)
+                cutoff = session.query(EmbeddingCache.last_used_at).order_by(
+                    EmbeddingCache.last_used_at.desc()
+                ).offset(max_entries).limit(1).scalar()
+                if cutoff is None:
+                    return 0
+
+                removed = session.query(EmbeddingCache).filter(
+                    EmbeddingCache.last_used_at <= cutoff
+                ).delete(synchronize_session=False)
+                session.commit()
+        except Exception as e:
+            logger.warning(f"ไม่สามารถลดขนาดแคช embeddings: {e}")
+            return 0
+
+        with self._lock:
+            self.evicted += removed
+        logger.info(f"ลบแคช embeddings ที่ไม่ได้ใช้ {removed} รายการ (เหลือ ~{count - removed})")
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        """สถิติของแคช (hits/misses นับตั้งแต่เริ่ม process)"""
+        with self._lock:
+            hits, misses, evicted = self.hits, self.misses, self.evicted
+
+        stats = {
+            "enabled": self.enabled,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses) * 100, 1) if hits + misses else 0.0,
+            "evicted": evicted,
+            "max_entries": config.embedding.cache_max_entries
+        }
+        self.flush_touches(force=True)
+        try:
+            with get_db_session() as session:
+                stats["entries"] = session.query(func.count(EmbeddingCache.id)).scalar() or 0
+                stats["total_hits"] = session.query(func.coalesce(func.sum(EmbeddingCache.hit_count), 0)).scalar()
+        except Exception as e:
+            logger.warning(f"ไม่สามารถดึงสถิติแคช embeddings: {e}")
+        return stats
+
+class QueryEmbeddingCache:
+    """แคช embeddings ของคำถามในหน่วยความจำ: LRU จำกัดจำนวนรายการ และหมดอายุตาม TTL"""
+
+    def __init__(self, max_entries: int = None, ttl: float = None):
+        self.max_entries = max_entries or config.embedding.query_cache_size
+        self.ttl = ttl or config.embedding.query_cache_ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, List[float]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(model: str, query: str) -> Tuple[str, str]:
+        # คำถามต่างกันแค่ตัวพิมพ์เล็ก/ใหญ่หรือช่องว่างถือเป็นคำถามเดียวกัน
+        return model, normalize_text(query).casefold()
+
+    def get(self, model: str, query: str) -> Optional[List[float]]:
+        """ส่งคืน embedding ของคำถามถ้ามีและยังไม่หมดอายุ"""
+        key = self._key(model, query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, model: str, query: str, embedding: List[float]):
+        """เก็บ embedding ของคำถาม (ลบรายการที่ไม่ได้ใช้นานที่สุดเมื่อเต็ม)"""
+        key = self._key(model, query)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits, misses, size = self.hits, self.misses, len(self._entries)
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses) * 100, 1) if hits + misses else 0.0,
+            "entries": size,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl
+        }
+
+# สร้าง instance หลัก
+embedding_cache = EmbeddingCacheService()
+query_embedding_cache = QueryEmbeddingCache()
@@ -0,0 +1,239 @@
+"""
+คิวงานสร้าง embeddings บนฐานข้อมูล (ตาราง embedding_jobs)
+worker claim งานด้วย UPDATE แบบมีเงื่อนไข (TiDB ไม่รองรับ SKIP LOCKED) จึงรันหลายตัวพร้อมกันได้โดยไม่ประมวลผลซ้ำ
+"""
+
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import and_, func, or_
+from sqlalchemy.exc import IntegrityError
+
+from config import config
+from database.database import get_db_session
+from database.models import Document, EmbeddingJob
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingJobQueue:
+    """เพิ่ม/claim/ปิดงานในคิว embeddings"""
+
+    @staticmethod
+    def _claimable(now: datetime):
+        """งานที่รอในคิว หรือ running แต่ lease หมดอายุแล้ว (worker เดิมหยุดทำงาน)"""
+        return and_(
+            EmbeddingJob.attempts < config.embedding.job_max_attempts,
+            or_(
+                and_(EmbeddingJob.status == "queued", EmbeddingJob.available_at <= now),
+                and_(EmbeddingJob.status == "running", EmbeddingJob.lease_expires_at < now)
+            )
+        )
+
+    def enqueue(self, document_ids: List[int]) -> int:
+        """เพิ่มงานของเอกสาร (เอกสารที่มีงานเสร็จ/ล้มเหลวแล้วจะเริ่มใหม่) ส่งคืนจำนวนงานที่เข้าคิว"""
+        document_ids = list(dict.fromkeys(document_ids))
+        if not document_ids:
+            return 0
+
+        now = datetime.utcnow()
+        with get_db_session() as session:
+            existing = {
+                row.document_id: row.status for row in session.query(
+                    EmbeddingJob.document_id, EmbeddingJob.status
+                ).filter(EmbeddingJob.document_id.in_(document_ids)).all()
+            }
+
+            # งานที่จบไปแล้วเริ่มนับครั้งใหม่ ส่วนงานที่รอ/กำลังทำอยู่ปล่อยไว้ตามเดิม
+            finished = [doc_id for doc_id, status in existing.items() if status in ("completed", "failed")]
+            queued = 0
+            if finished:
+                queued += session.query(EmbeddingJob).filter(
+                    EmbeddingJob.document_id.in_(finished),
+                    EmbeddingJob.status.in_(["completed", "failed"])
+                ).update({
+                    EmbeddingJob.status: "queued",
+                    EmbeddingJob.attempts: 0,
+                    EmbeddingJob.error: None,
+                    EmbeddingJob.worker_id: None,
+                    EmbeddingJob.lease_expires_at: None,
+                    EmbeddingJob.available_at: now,
+                    EmbeddingJob.updated_at: now
+                }, synchronize_session=False)
+                session.commit()
+
+            rows = [
+                {"document_id": doc_id, "status": "queued", "attempts": 0,
+                 "available_at": now, "created_at": now, "updated_at": now}
+                for doc_id in document_ids if doc_id not in existing
+            ]
+            if rows:
+                try:
+                    session.execute(EmbeddingJob.__table__.insert(), rows)
+                    session.commit()
+                    queued += len(rows)
+                except IntegrityError:
+                    # process อื่นเพิ่มงานของเอกสารเดียวกันไปก่อน เพิ่มทีละแถวแทน
+                    session.rollback()
+                    for row in rows:
+                        try:
+                            session.execute(EmbeddingJob.__table__.insert(), [row])
+                            session.commit()
+                            queued += 1
+                        except IntegrityError:
+                            session.rollback()
+
+        if queued:
+            logger.info(f"เพิ่มงาน embeddings เข้าคิว {queued} เอกสาร")
+        return queued
+
+    def enqueue_pending(self, limit: int = 1000) -> int:
+        """เพิ่มงานของเอกสาร processing_status='pending' ที่มีข้อความแล้วแต่ยังไม่มีงานที่รอ/กำลังทำ"""
+        with get_db_session() as session:
+            active = session.query(EmbeddingJob.document_id).filter(
+                EmbeddingJob.status.in_(["queued", "running"])
+            )
+            document_ids = [
+                row.id for row in session.query(Document.id).filter(
+                    Document.processing_status == "pending",
+                    Document.extracted_text.isnot(None),
+                    Document.extracted_text != "",
+                    ~Document.id.in_(active)
+                ).order_by(Document.id).limit(limit).all()
+            ]
+        return self.enqueue(document_ids)
+
+    def claim(self, worker_id: str, limit: int = 1) -> List[EmbeddingJob]:
+        """claim งานที่พร้อมทำ ส่งคืนงานที่ claim ได้ (แต่ละงานมี worker เดียวจนกว่า lease จะหมดอายุ)"""
+        claimed = []
+        now = datetime.utcnow()
+        with get_db_session() as session:
+            # งานที่ worker หยุดทำงานกลางคันจนครบจำนวนครั้งแล้วจะไม่ถูก claim อีก
+            session.query(EmbeddingJob).filter(
+                EmbeddingJob.status == "running",
+                EmbeddingJob.lease_expires_at < now,
+                EmbeddingJob.attempts >= config.embedding.job_max_attempts
+            ).update({
+                EmbeddingJob.status: "failed",
+                EmbeddingJob.error: "lease หมดอายุครบจำนวนครั้งที่กำหนด",
+                EmbeddingJob.lease_expires_at: None,
+                EmbeddingJob.finished_at: now,
+                EmbeddingJob.updated_at: now
+            }, synchronize_session=False)
+            session.commit()
+
+            candidates = [
+                row.id for row in session.query(EmbeddingJob.id).filter(
+                    self._claimable(now)
+                ).order_by(EmbeddingJob.available_at, EmbeddingJob.id).limit(limit * 4).all()
+            ]
+
+            for job_id in candidates:
+                if len(claimed) >= limit:
+                    break
+                # เงื่อนไขเดิมซ้ำใน UPDATE: worker ที่แย่งงานเดียวกันจะได้ rowcount = 0
+                try:
+                    updated = session.query(EmbeddingJob).filter(
+                        EmbeddingJob.id == job_id, self._claimable(now)
+                    ).update({
+                        EmbeddingJob.status: "running",
+                        EmbeddingJob.worker_id: worker_id,
+                        EmbeddingJob.attempts: EmbeddingJob.attempts + 1,
+                        EmbeddingJob.lease_expires_at: now + timedelta(seconds=config.embedding.job_lease_seconds),
+                        EmbeddingJob.started_at: now,
+                        EmbeddingJob.updated_at: now
+                    }, synchronize_session=False)
+                    session.commit()
+                except Exception as e:
+                    # TiDB แบบ optimistic อาจแจ้ง write conflict ตอน commit
+                    session.rollback()
+                    logger.debug(f"claim งาน {job_id} ไม่สำเร็จ: {e}")
+                    continue
+
+                if updated == 1:
+                    job = session.query(EmbeddingJob).filter(EmbeddingJob.id == job_id).first()
+                    session.expunge(job)
+                    claimed.append(job)
+        return claimed
+
+    def extend_lease(self, job_id: int, worker_id: str) -> bool:
+        """ต่ออายุ lease ระหว่างประมวลผล ส่งคืน False ถ้างานไม่ได้เป็นของ worker นี้แล้ว"""
+        now = datetime.utcnow()
+        with get_db_session() as session:
+            updated = session.query(EmbeddingJob).filter(
+                EmbeddingJob.id == job_id,
+                EmbeddingJob.worker_id == worker_id,
+                EmbeddingJob.status == "running"
+            ).update({
+                EmbeddingJob.lease_expires_at: now + timedelta(seconds=config.embedding.job_lease_seconds),
+                EmbeddingJob.updated_at: now
+            }, synchronize_session=False)
+            session.commit()
+        return updated == 1
+
+    def complete(self, job_id: int, worker_id: str) -> bool:
+        """ปิดงานที่สำเร็จ"""
+        return self._finish(job_id, worker_id, {EmbeddingJob.status: "completed", EmbeddingJob.error: None})
+
+    def fail(self, job_id: int, worker_id: str, error: str) -> bool:
+        """บันทึกงานที่ล้มเหลว: กลับเข้าคิวพร้อมหน่วงเวลา หรือ failed เมื่อครบจำนวนครั้งที่กำหนด"""
+        with get_db_session() as session:
+            attempts = session.query(EmbeddingJob.attempts).filter(EmbeddingJob.id == job_id).scalar() or 0
+
+        if attempts >= config.embedding.job_max_attempts:
+            values = {EmbeddingJob.status: "failed"}
+        else:
+            delay = config.embedding.job_retry_delay * (2 ** max(attempts - 1, 0))
+            values = {
+                EmbeddingJob.status: "queued",
+                EmbeddingJob.available_at: datetime.utcnow() + timedelta(seconds=delay)
+            }
+        values[EmbeddingJob.error] = (error or "")[:2000]
+        return self._finish(job_id, worker_id, values)
+
+    def _finish(self, job_id: int, worker_id: str, values: Dict) -> bool:
+        now = datetime.utcnow()
+        values.update({
+            EmbeddingJob.lease_expires_at: None,
+            EmbeddingJob.finished_at: now,
+            EmbeddingJob.updated_at: now
+        })
+        with get_db_session() as session:
+            updated = session.query(EmbeddingJob).filter(
+                EmbeddingJob.id == job_id,
+                EmbeddingJob.worker_id == worker_id,
+                EmbeddingJob.status == "running"
+            ).update(values, synchronize_session=False)
+            session.commit()
+
+        if updated != 1:
+            logger.warning(f"งาน embeddings {job_id} ไม่ได้เป็นของ worker {worker_id} แล้ว (lease หมดอายุ)")
+        return updated == 1
+
+    def stats(self) -> Dict[str, Any]:
+        """จำนวนงานแยกตามสถานะ"""
+        stats = {"queued": 0, "running": 0, "completed": 0, "failed": 0}
+        try:
+            with get_db_session() as session:
+                for status, count in session.query(
+                    EmbeddingJob.status, func.count(EmbeddingJob.id)
+                ).group_by(EmbeddingJob.status).all():
+                    stats[status] = count
+                stats["stale"] = session.query(func.count(EmbeddingJob.id)).filter(
+                    EmbeddingJob.status == "running",
+                    EmbeddingJob.lease_expires_at < datetime.utcnow()
+                ).scalar() or 0
+        except Exception as e:
+            logger.warning(f"ไม่สามารถดึงสถิติคิว embeddings: {e}")
+        return stats
+
+    def get_job(self, document_id: int) -> Optional[EmbeddingJob]:
+        """งานล่าสุดของเอกสาร"""
+        with get_db_session() as session:
+            job = session.query(EmbeddingJob).filter(EmbeddingJob.document_id == document_id).first()
+            if job is not None:
+                session.expunge(job)
+            return job
+
+# สร้าง instance หลัก
+embedding_job_queue = EmbeddingJobQueue()
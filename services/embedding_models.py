@@ -0,0 +1,282 @@
+"""
+เวอร์ชันของโมเดล embedding
+โมเดลที่ active (ใช้ค้นหาและสร้าง embeddings ของเอกสารใหม่) เก็บเป็นแถวเดียวใน system_configs
+การเปลี่ยนโมเดล: ตั้งโมเดลเป้าหมาย แล้ว worker สร้าง embeddings ของทุก chunk ด้วยโมเดลใหม่ลงตาราง chunk_embeddings
+แบบจำกัดความเร็ว ระหว่างนี้การค้นหายังใช้โมเดลเดิม เมื่อครบทุก chunk จึงเปลี่ยนโมเดลที่ active
+และแต่ละ process สร้างดัชนีของโมเดลใหม่ในพื้นหลังก่อนสลับมาใช้ (ดู EmbeddingService.sync_active_model)
+
+ตัวอย่าง:
+    python -m services.embedding_models status
+    python -m services.embedding_models start bge-m3:latest
+    python -m services.embedding_models switch bge-m3:latest   # เปลี่ยนทันทีโดยไม่รอให้ครบ
+    python -m services.embedding_models cancel
+"""
+
+import argparse
+import json
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from config import config
+from database.database import get_db_session
+from database.models import ChunkEmbedding, SystemConfig
+from utils.vector_codec import encode_embedding
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_MODEL_KEY = "embedding.active_model"
+TARGET_MODEL_KEY = "embedding.reembed_target"
+
+# chunk มี vector ของโมเดล :model อยู่ใน document_chunks เอง (chunks เก่าที่ไม่ได้บันทึกโมเดลถือเป็นโมเดลตั้งต้น)
+NATIVE_VECTOR = "COALESCE(dc.embedding_model, :default_model) = :model"
+# ไม่เช่นนั้นอยู่ใน chunk_embeddings
+MODEL_VECTOR_JOIN = "LEFT JOIN chunk_embeddings ce ON ce.chunk_id = dc.id AND ce.model = :model"
+HAS_MODEL_VECTOR = f"""(
+    ({NATIVE_VECTOR} AND (dc.embedding_vector IS NOT NULL OR dc.embedding IS NOT NULL))
+    OR ce.id IS NOT NULL
+)"""
+
+def model_params(model: str) -> Dict[str, str]:
+    """พารามิเตอร์ของ NATIVE_VECTOR / MODEL_VECTOR_JOIN"""
+    return {"model": model, "default_model": config.embedding.model}
+
+class EmbeddingModelRegistry:
+    """อ่าน/เขียนโมเดลที่ active และโมเดลเป้าหมายของการสร้าง embeddings ใหม่ใน system_configs"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cache: Dict[str, Tuple[Optional[str], float]] = {}
+
+    @staticmethod
+    def _read(key: str) -> Optional[str]:
+        with get_db_session() as session:
+            row = session.query(SystemConfig.value).filter(SystemConfig.key == key).first()
+            return row.value if row and row.value else None
+
+    @staticmethod
+    def _write(key: str, value: Optional[str], description: str, updated_by: str = None):
+        """upsert แถวเดียว (การเปลี่ยนโมเดลจึงเป็น atomic: ทุก process เห็นค่าเดิมหรือค่าใหม่เท่านั้น)"""
+        values = {"value": value, "updated_by": updated_by, "updated_at": datetime.utcnow()}
+        with get_db_session() as session:
+            updated = session.query(SystemConfig).filter(SystemConfig.key == key).update(values)
+            if not updated:
+                session.add(SystemConfig(key=key, value_type="string", description=description, **values))
+            try:
+                session.commit()
+            except IntegrityError:
+                # process อื่นเพิ่มแถวเดียวกันพร้อมกัน
+                session.rollback()
+                session.query(SystemConfig).filter(SystemConfig.key == key).update(values)
+                session.commit()
+
+    def _cached(self, key: str) -> Optional[str]:
+        """อ่านค่าโดยใช้แคชในหน่วยความจำไม่เกิน index_refresh_interval (ฐานข้อมูลไม่พร้อม = ใช้ค่าเดิม)"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached and now - cached[1] < config.embedding.index_refresh_interval:
+                return cached[0]
+        try:
+            value = self._read(key)
+        except Exception as e:
+            logger.warning(f"ไม่สามารถอ่าน {key} จากฐานข้อมูล: {e}")
+            return cached[0] if cached else None
+        with self._lock:
+            self._cache[key] = (value, now)
+        return value
+
+    def _forget(self, key: str):
+        with self._lock:
+            self._cache.pop(key, None)
+
+    def active_model(self) -> str:
+        """โมเดลที่ใช้ค้นหาและสร้าง embeddings ของเอกสารใหม่ (ค่าเริ่มต้น config.embedding.model)"""
+        return self._cached(ACTIVE_MODEL_KEY) or config.embedding.model
+
+    def target_model(self) -> Optional[str]:
+        """โมเดลที่กำลังสร้าง embeddings ในพื้นหลัง (None = ไม่มีงาน)"""
+        return self._read(TARGET_MODEL_KEY)
+
+    def set_active_model(self, model: str, updated_by: str = None):
+        """เปลี่ยนโมเดลที่ active (process อื่นเห็นภายใน index_refresh_interval)"""
+        self._write(ACTIVE_MODEL_KEY, model, "โมเดล embedding ที่ใช้ค้นหา", updated_by)
+        self._forget(ACTIVE_MODEL_KEY)
+        logger.info(f"เปลี่ยนโมเดล embedding ที่ใช้ค้นหาเป็น {model}")
+
+    def start(self, model: str, updated_by: str = None):
+        """เริ่มสร้าง embeddings ของโมเดลใหม่ในพื้นหลัง (worker เป็นผู้ทำ)"""
+        self._write(TARGET_MODEL_KEY, model, "โมเดล embedding ที่กำลังสร้างใหม่ในพื้นหลัง", updated_by)
+        logger.info(f"เริ่มสร้าง embeddings ด้วยโมเดล {model} (ค้นหาด้วย {self.active_model()} ระหว่างนี้)")
+
+    def cancel(self, updated_by: str = None):
+        """หยุดสร้าง embeddings ในพื้นหลัง (embeddings ที่สร้างแล้วยังอยู่ เริ่มใหม่ได้จากจุดเดิม)"""
+        self._write(TARGET_MODEL_KEY, None, "โมเดล embedding ที่กำลังสร้างใหม่ในพื้นหลัง", updated_by)
+
+    @staticmethod
+    def coverage(model: str) -> Dict[str, int]:
+        """จำนวน chunks ทั้งหมด (ไม่นับ chunks ที่ซ้ำกับ chunk หลัก) และจำนวนที่มี vector ของโมเดลนี้แล้ว"""
+        with get_db_session() as session:
+            row = session.execute(text(f"""
+                SELECT COUNT(*) AS total,
+                       COALESCE(SUM(CASE WHEN {HAS_MODEL_VECTOR} THEN 1 ELSE 0 END), 0) AS done
+                FROM document_chunks dc
+                {MODEL_VECTOR_JOIN}
+                WHERE dc.canonical_chunk_id IS NULL
+            """), model_params(model)).first()
+        return {"total": int(row.total), "done": int(row.done), "missing": int(row.total) - int(row.done)}
+
+    def status(self) -> Dict:
+        """สถานะโมเดลที่ active และความคืบหน้าของโมเดลเป้าหมาย"""
+        self._forget(ACTIVE_MODEL_KEY)
+        status = {"active_model": self.active_model(), "target_model": self.target_model()}
+        if status["target_model"]:
+            status["coverage"] = self.coverage(status["target_model"])
+        return status
+
+class ReembeddingJob:
+    """สร้าง embeddings ของโมเดลเป้าหมายทีละ batch ตามลำดับ chunk id แบบจำกัดความเร็ว
+    เมื่อครบทุก chunk จะเปลี่ยนโมเดลที่ active (reembed_auto_switch) แล้วเก็บ chunks ที่เอกสารใหม่สร้างด้วยโมเดลเดิมระหว่างนั้น"""
+
+    def __init__(self, service, registry: EmbeddingModelRegistry = None):
+        self.service = service  # EmbeddingService (ส่งเข้ามาเพื่อไม่ให้ import วนกัน)
+        self.registry = registry or embedding_models
+        self._after_id = 0
+        self._target: Optional[str] = None
+        self._resume_at = 0.0
+
+    def wait_time(self) -> float:
+        """วินาทีที่ต้องรอก่อน batch ถัดไปตามงบ reembed_max_chunks_per_sec"""
+        return max(0.0, self._resume_at - time.monotonic())
+
+    @staticmethod
+    def _fetch_missing(model: str, after_id: int, limit: int) -> List:
+        """chunks ที่ยังไม่มี vector ของโมเดลนี้ เรียงตาม id"""
+        with get_db_session() as session:
+            return session.execute(text(f"""
+                SELECT dc.id, dc.content
+                FROM document_chunks dc
+                {MODEL_VECTOR_JOIN}
+                WHERE NOT {HAS_MODEL_VECTOR}
+                AND dc.canonical_chunk_id IS NULL AND dc.id > :after_id
+                ORDER BY dc.id
+                LIMIT :limit
+            """), {**model_params(model), "after_id": after_id, "limit": limit}).fetchall()
+
+    @staticmethod
+    def _store(model: str, chunk_ids: List[int], embeddings: List[List[float]]) -> int:
+        """บันทึกลง chunk_embeddings (chunk ที่ process อื่นบันทึกแล้วจะถูกข้าม)"""
+        created_at = datetime.utcnow()
+        rows = [
+            {"chunk_id": chunk_id, "model": model,
+             "embedding_vector": encode_embedding(embedding, model), "created_at": created_at}
+            for chunk_id, embedding in zip(chunk_ids, embeddings)
+        ]
+        if not rows:
+            return 0
+
+        table = ChunkEmbedding.__table__
+        with get_db_session() as session:
+            try:
+                session.execute(table.insert(), rows)
+                session.commit()
+            except IntegrityError:
+                session.rollback()
+                existing = {
+                    row.chunk_id for row in session.query(ChunkEmbedding.chunk_id).filter(
+                        ChunkEmbedding.model == model,
+                        ChunkEmbedding.chunk_id.in_(chunk_ids)
+                    ).all()
+                }
+                rows = [row for row in rows if row["chunk_id"] not in existing]
+                if rows:
+                    session.execute(table.insert(), rows)
+                session.commit()
+        return len(rows)
+
+    def run_batch(self) -> int:
+        """ทำหนึ่ง batch ส่งคืนจำนวน chunks ที่บันทึก (0 = ไม่มีงานหรือยังไม่ถึงเวลา)"""
+        if self.wait_time() > 0:
+            return 0
+        target = self.registry.target_model()
+        if not target:
+            return 0
+        if target != self._target:
+            self._target, self._after_id = target, 0
+
+        started = time.monotonic()
+        rows = self._fetch_missing(target, self._after_id, config.embedding.reembed_batch_size)
+        if not rows:
+            if self._after_id:
+                # ตรวจซ้ำตั้งแต่ต้นเพื่อเก็บ chunks ที่ล้มเหลวหรือถูกเพิ่มระหว่างรอบ
+                self._after_id = 0
+                return 0
+            self._finish(target)
+            return 0
+
+        embeddings = self.service.create_batch_embeddings([row.content for row in rows], model=target)
+        done = [(row.id, embedding) for row, embedding in zip(rows, embeddings) if embedding]
+        stored = self._store(target, [chunk_id for chunk_id, _ in done], [embedding for _, embedding in done])
+        self._after_id = rows[-1].id
+        if len(done) < len(rows):
+            logger.warning(f"สร้าง embeddings ด้วยโมเดล {target} ไม่สำเร็จ {len(rows) - len(done)} chunks (จะลองใหม่ในรอบถัดไป)")
+
+        rate = config.embedding.reembed_max_chunks_per_sec
+        if rate > 0:
+            self._resume_at = started + len(rows) / rate
+        logger.info(f"สร้าง embeddings ด้วยโมเดล {target}: {stored} chunks (ถึง chunk {self._after_id})")
+        return max(stored, 1)
+
+    def _finish(self, target: str):
+        """ครบทุก chunk แล้ว: เปลี่ยนโมเดลที่ active หรือรอคำสั่ง switch"""
+        if self.registry.active_model() == target:
+            # เปลี่ยนแล้ว และ chunks ที่สร้างด้วยโมเดลเดิมระหว่างนั้นครบแล้ว
+            self.registry.cancel(updated_by="reembed")
+            logger.info(f"สร้าง embeddings ด้วยโมเดล {target} ครบทุก chunk")
+        elif config.embedding.reembed_auto_switch:
+            # ยังไม่ล้างเป้าหมาย: process ที่ยังไม่เห็นโมเดลใหม่อาจเพิ่ม chunks ด้วยโมเดลเดิม ซึ่งจะถูกเก็บในรอบถัดไป
+            self.registry.set_active_model(target, updated_by="reembed")
+        self._resume_at = time.monotonic() + config.embedding.job_poll_interval
+
+# สร้าง instance หลัก
+embedding_models = EmbeddingModelRegistry()
+
+def main():
+    parser = argparse.ArgumentParser(description="จัดการโมเดล embedding และการสร้าง embeddings ใหม่ในพื้นหลัง")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="โมเดลที่ active และความคืบหน้า")
+    start = commands.add_parser("start", help="เริ่มสร้าง embeddings ด้วยโมเดลใหม่ (worker เป็นผู้ทำ)")
+    start.add_argument("model")
+    switch = commands.add_parser("switch", help="เปลี่ยนโมเดลที่ใช้ค้นหาทันที")
+    switch.add_argument("model")
+    commands.add_parser("cancel", help="หยุดสร้าง embeddings ในพื้นหลัง")
+    commands.add_parser("run", help="สร้าง embeddings ในพื้นหลังจนครบ (แทนการใช้ worker)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    from database.database import init_database, run_migrations
+    init_database()
+    run_migrations()
+
+    if args.command == "start":
+        embedding_models.start(args.model, updated_by="cli")
+    elif args.command == "switch":
+        embedding_models.set_active_model(args.model, updated_by="cli")
+    elif args.command == "cancel":
+        embedding_models.cancel(updated_by="cli")
+    elif args.command == "run":
+        from services.embedding_service import embedding_service
+        job = ReembeddingJob(embedding_service)
+        while embedding_models.target_model():
+            time.sleep(job.wait_time())
+            job.run_batch()
+    print(json.dumps(embedding_models.status(), ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -4,43 +4,107 @@
 """
 
 import requests
-import json
+import hashlib
 import numpy as np
-from typing import List, Optional, Tuple, Dict, Any
+from typing import Iterator, List, Optional, Tuple, Dict, Any, Union
 import logging
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 import streamlit as st
 from config import config
 from database.database import get_db_session
-from database.models import Document, DocumentChunk
-from sqlalchemy import text
+from database.models import Document, DocumentChunk, ChunkDeletion, ChunkEmbedding
+from sqlalchemy.exc import IntegrityError
+from services.vector_index import VectorIndex, create_vector_index, vector_index
+from services.ann_index import AnnIndex, ann_index, create_ann_index
+from services.document_summaries import document_summaries
+from services.embedding_models import embedding_models
+from services.local_embedding import local_embedding_backend
+from services.near_duplicates import near_duplicate_detector, simhash
+from services.keyword_index import keyword_index
+from services.embedding_cache import embedding_cache, query_embedding_cache
+from services.embedding_jobs import embedding_job_queue
+from services.text_chunker import Chunk, TextChunker, TokenChunker, iter_segments, load_tokenizer
+from utils.vector_codec import encode_embedding
 
 logger = logging.getLogger(__name__)
 
+class ProcessingCancelled(Exception):
+    """การประมวลผลเอกสารถูกยกเลิกกลางคัน (process_document ไม่บันทึกสถานะ failed)"""
+
 class EmbeddingService:
     """คลาสจัดการ Embedding"""
     
     def __init__(self):
         self.api_url = config.embedding.api_url
+        self.batch_api_url = config.embedding.batch_api_url
         self.model = config.embedding.model
         self.timeout = config.embedding.timeout
         self.chunk_size = config.embedding.chunk_size
         self.chunk_overlap = config.embedding.chunk_overlap
+        self.index = vector_index
+        self.ann = ann_index
+        self.keywords = keyword_index
+        self.cache = embedding_cache
+        self.query_cache = query_embedding_cache
+        self.models = embedding_models
+        self.local = local_embedding_backend
+        self.duplicates = near_duplicate_detector
+        self.summaries = document_summaries
+        self._ann_lock = threading.Lock()
+        self._switch_lock = threading.Lock()
+        self._pending_model: Optional[str] = None  # โมเดลที่กำลังสร้างดัชนีในพื้นหลังก่อนสลับ
+        self._http = threading.local()
+    
+    def _session(self) -> requests.Session:
+        """HTTP session ต่อ thread (ใช้ connection เดิมซ้ำ และ requests.Session ไม่ควรใช้ข้าม thread)"""
+        session = getattr(self._http, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update({"Content-Type": "application/json"})
+            self._http.session = session
+        return session
+        
+    def create_embedding(self, text: str, model: str = None) -> Optional[List[float]]:
+        """สร้าง embedding จากข้อความ (ใช้แคชก่อนเรียก API, model ค่าเริ่มต้นคือโมเดลที่ใช้ค้นหาอยู่)"""
+        model = model or self.model
+        if self.local.handles(model):
+            # สร้างใน process เร็วกว่าการอ่านแคชจากฐานข้อมูล
+            return self.local.encode([text], model)[0]
+        
+        cached = self.cache.get(model, text)
+        if cached:
+            return cached
         
-    def create_embedding(self, text: str) -> Optional[List[float]]:
-        """สร้าง embedding จากข้อความ"""
+        embedding = self._request_embedding(text, model)
+        if embedding:
+            self.cache.put_many(model, [text], [embedding])
+        return embedding
+    
+    def embed_query(self, query: str) -> Optional[List[float]]:
+        """สร้าง embedding ของคำถาม (คำถามที่ถามซ้ำใช้ค่าจากแคชในหน่วยความจำโดยไม่เรียก API)"""
+        model = self.model
+        embedding = self.query_cache.get(model, query)
+        if embedding is None:
+            embedding = self.create_embedding(query, model)
+            if embedding:
+                self.query_cache.put(model, query, embedding)
+        return embedding
+    
+    def _request_embedding(self, text: str, model: str = None) -> Optional[List[float]]:
+        """เรียก API เพื่อสร้าง embedding ของข้อความเดียว"""
         try:
             payload = {
-                "model": self.model,
+                "model": model or self.model,
                 "prompt": text
             }
             
-            response = requests.post(
+            response = self._session().post(
                 self.api_url,
                 json=payload,
-                timeout=self.timeout,
-                headers={"Content-Type": "application/json"}
+                timeout=self.timeout
             )
             
             if response.status_code == 200:
@@ -62,67 +126,151 @@ class EmbeddingService:
             return None
     
     def create_batch_embeddings(self, texts: List[str], 
-                              progress_callback=None) -> List[Optional[List[float]]]:
-        """สร้าง embedding หลายรายการพร้อมกัน"""
-        embeddings = []
+                              progress_callback=None, model: str = None) -> List[Optional[List[float]]]:
+        """สร้าง embedding หลายรายการผ่าน /api/embed โดยส่งหลาย batch พร้อมกันไม่เกิน max_in_flight
+        (ลำดับผลลัพธ์ตรงกับ texts, progress_callback ถูกเรียกจาก thread ของผู้เรียก)"""
         total = len(texts)
+        model = model or self.model
         
-        for i, text in enumerate(texts):
-            if progress_callback:
-                progress_callback(i, total, f"Processing chunk {i+1}/{total}")
-            
-            embedding = self.create_embedding(text)
-            embeddings.append(embedding)
-            
-            # หน่วงเวลาเล็กน้อยเพื่อไม่ให้ API ทำงานหนักเกินไป
-            time.sleep(0.1)
+        # ข้อความที่เคยสร้าง embedding แล้ว (เช่น chunks เดิมในเอกสารฉบับแก้ไข) ไม่ต้องเรียก API
+        embeddings = self.cache.get_many(model, texts)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        done = total - len(missing)
+        if missing and done:
+            logger.info(f"ใช้ embeddings จากแคช {done}/{total} chunks")
+        if not missing:
+            if progress_callback and total:
+                progress_callback(total, total, f"Processing chunks {total}/{total}")
+            return embeddings
+        
+        pending = [texts[i] for i in missing]
+        batches = self._plan_batches(pending)
+        
+        # backend local เข้ารหัสทีละ batch อยู่แล้ว (ใช้ทุก thread ที่ตั้งไว้)
+        in_flight = 1 if self.local.handles(model) else config.embedding.max_in_flight
+        workers = max(1, min(in_flight, len(batches)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embedding") as executor:
+            futures = {
+                executor.submit(self._embed_batch, pending[start:end], model): (start, end)
+                for start, end in batches
+            }
+            for future in as_completed(futures):
+                start, end = futures[future]
+                try:
+                    results = future.result()
+                    for position, embedding in zip(missing[start:end], results):
+                        embeddings[position] = embedding
+                    self.cache.put_many(model, pending[start:end], results)
+                except Exception as e:
+                    logger.error(f"ข้อผิดพลาดใน chunks {start+1}-{end}: {e}")
+                
+                done += end - start
+                if progress_callback:
+                    progress_callback(done, total, f"Processing chunks {done}/{total}")
         
         return embeddings
     
-    def chunk_text(self, text: str, chunk_size: int = None, 
-                   overlap: int = None) -> List[str]:
-        """แบ่งข้อความเป็นชิ้นเล็กๆ สำหรับ embedding"""
-        if chunk_size is None:
-            chunk_size = self.chunk_size
-        if overlap is None:
-            overlap = self.chunk_overlap
-            
-        if len(text) <= chunk_size:
-            return [text]
+    @staticmethod
+    def _plan_batches(texts: List[str]) -> List[Tuple[int, int]]:
+        """แบ่ง texts เป็นช่วง [start, end) ตามงบจำนวนตัวอักษรและจำนวนรายการต่อ request"""
+        max_chars = config.embedding.batch_max_chars
+        max_items = config.embedding.batch_max_items
+        batches = []
+        start, chars = 0, 0
         
-        chunks = []
-        start = 0
+        for i, text in enumerate(texts):
+            # ข้อความที่ยาวเกินงบจะถูกส่งเป็น batch เดี่ยว
+            if i > start and (chars + len(text) > max_chars or i - start >= max_items):
+                batches.append((start, i))
+                start, chars = i, 0
+            chars += len(text)
         
-        while start < len(text):
-            end = start + chunk_size
-            
-            # หาจุดตัดที่เหมาะสม (หลัง sentence หรือ paragraph)
-            if end < len(text):
-                # หาจุดสิ้นสุดประโยค
-                for i in range(end, start + overlap, -1):
-                    if text[i] in '.!?।':
-                        end = i + 1
-                        break
-                else:
-                    # หาช่องว่าง
-                    for i in range(end, start + overlap, -1):
-                        if text[i].isspace():
-                            end = i
-                            break
-            
-            chunk = text[start:end].strip()
-            if chunk:
-                chunks.append(chunk)
+        if start < len(texts):
+            batches.append((start, len(texts)))
+        return batches
+    
+    def _embed_batch(self, texts: List[str], model: str = None) -> List[Optional[List[float]]]:
+        """ส่ง texts ใน request เดียว ถ้าล้มเหลวจะแบ่งครึ่งแล้วลองใหม่ จนเหลือรายการเดียวจึงใช้ endpoint เดิม"""
+        model = model or self.model
+        if self.local.handles(model):
+            return self.local.encode(texts, model)
+        
+        try:
+            response = self._session().post(
+                self.batch_api_url,
+                json={"model": model, "input": texts},
+                timeout=self.timeout
+            )
             
-            start = end - overlap
-            if start >= len(text):
-                break
+            if response.status_code == 200:
+                result = response.json().get("embeddings")
+                if result and len(result) == len(texts):
+                    return result
+                logger.error(f"จำนวน embeddings ในผลลัพธ์ไม่ตรงกับที่ส่ง ({len(texts)} รายการ)")
+            else:
+                logger.error(f"Batch API error: {response.status_code} - {response.text}")
+                
+        except requests.exceptions.Timeout:
+            logger.error(f"Timeout ในการสร้าง embedding แบบ batch ({len(texts)} รายการ)")
+        except Exception as e:
+            logger.error(f"เกิดข้อผิดพลาดในการสร้าง embedding แบบ batch: {e}")
+        
+        if len(texts) == 1:
+            return [self._embed_single(texts[0], model)]
+        
+        middle = len(texts) // 2
+        return self._embed_batch(texts[:middle], model) + self._embed_batch(texts[middle:], model)
+    
+    def _embed_single(self, text: str, model: str = None) -> Optional[List[float]]:
+        """สร้าง embedding ของข้อความเดียวผ่าน endpoint เดิม พร้อมลองใหม่แบบ backoff"""
+        for attempt in range(config.embedding.max_retries + 1):
+            if attempt:
+                time.sleep(config.embedding.retry_backoff * 2 ** (attempt - 1))
+            embedding = self._request_embedding(text, model)
+            if embedding:
+                return embedding
         
-        return chunks
+        logger.warning(f"สร้าง embedding ไม่สำเร็จหลังลอง {config.embedding.max_retries + 1} ครั้ง")
+        return None
+    
+    def chunk_text(self, text: str, chunk_size: int = None, 
+                   overlap: int = None) -> List[str]:
+        """แบ่งข้อความเป็นชิ้นเล็กๆ สำหรับ embedding (ระบุ chunk_size/overlap = แบ่งตามจำนวนตัวอักษร)"""
+        if chunk_size is not None or overlap is not None:
+            return TextChunker(chunk_size or self.chunk_size, self.chunk_overlap if overlap is None else overlap).chunk_text(text)
+        return self.chunker().chunk_text(text)
     
-    def process_document(self, document_id: int) -> bool:
-        """ประมวลผลเอกสารเพื่อสร้าง embeddings"""
+    def iter_chunks(self, text: str) -> Iterator[Chunk]:
+        """แบ่งข้อความเป็น chunks แบบ generator พร้อมเลขหน้าและตำแหน่งตัวอักษร"""
+        return self.chunker().chunks(iter_segments(text))
+    
+    def chunker(self) -> TextChunker:
+        """ตัวแบ่ง chunks ตาม chunk_mode (ตามงบ tokens ของโมเดล หรือตามจำนวนตัวอักษรเมื่อไม่มี tokenizer)"""
+        if config.embedding.chunk_mode == "tokens":
+            tokenizer = load_tokenizer()
+            if tokenizer is not None:
+                return TokenChunker(tokenizer)
+        return TextChunker(self.chunk_size, self.chunk_overlap)
+    
+    def chunking_signature(self) -> str:
+        """ลายเซ็นของโมเดลและพารามิเตอร์การแบ่ง chunks (chunks เดิมใช้ต่อได้เมื่อลายเซ็นตรงกันเท่านั้น)"""
+        key = f"{self.model}|{self.chunker().signature()}"
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+    
+    def process_document(self, document_id: int, progress_callback=None,
+                         cancel: Optional[threading.Event] = None) -> bool:
+        """ประมวลผลเอกสารเพื่อสร้าง embeddings (progress_callback(current, total, message))
+        ทำต่อจาก chunks ที่บันทึกแล้ว: สร้างเฉพาะ chunk_index ที่ยังไม่มี และบันทึกความคืบหน้าทุก checkpoint
+        cancel ถูก set (เช่น worker เสีย lease ของงาน): หยุดก่อนเขียนขั้นถัดไปด้วย ProcessingCancelled"""
+        def check_cancelled():
+            if cancel is not None and cancel.is_set():
+                raise ProcessingCancelled(f"หยุดประมวลผลเอกสาร {document_id} (งานถูกยกเลิก)")
+        
         try:
+            # เอกสารใหม่สร้าง embeddings ด้วยโมเดลที่ active (ตลอดการประมวลผลเอกสารนี้)
+            self.sync_active_model()
+            model = self.model
+            signature = self.chunking_signature()
             with get_db_session() as session:
                 # ดึงเอกสาร
                 document = session.query(Document).filter(
@@ -134,64 +282,196 @@ class EmbeddingService:
                     return False
                 
                 if not document.extracted_text:
-                    logger.error(f"เอกสาร {document.filename} ยังไม่มีข้อความที่สกัดแล้ว")
+                    # ไม่มีข้อความให้สร้าง embeddings: ไม่ให้ค้างที่ pending และถูกเพิ่มเข้าคิวซ้ำ
+                    logger.error(f"เอกสาร {document.filename} ไม่มีข้อความที่สกัดแล้ว ตั้งสถานะเป็น failed")
+                    document.processing_status = "failed"
+                    session.commit()
                     return False
                 
+                # chunks เดิมที่สร้างด้วยโมเดล/พารามิเตอร์อื่นตำแหน่งไม่ตรงกัน ต้องเริ่มใหม่ทั้งหมด
+                check_cancelled()
+                if document.chunking_signature and document.chunking_signature != signature:
+                    session.rollback()
+                    self.delete_document_embeddings(document_id, release_references=False)
+                    session.refresh(document)
+                
+                existing = {
+                    row.chunk_index for row in session.query(DocumentChunk.chunk_index).filter(
+                        DocumentChunk.document_id == document_id
+                    ).all()
+                }
+                if existing:
+                    logger.info(f"เอกสาร {document.filename}: มี embeddings แล้ว {len(existing)} chunks ทำต่อเฉพาะที่เหลือ")
+                
+                # จำนวน chunks ทั้งหมดทราบเมื่อแบ่งเสร็จ ระหว่างนี้ใช้ค่าประมาณสำหรับ progress
+                text = document.extracted_text
+                estimated = document.chunks_total or max(1, len(text) // max(self.chunk_size - self.chunk_overlap, 1))
+                chunker = self.chunker()
+                
                 # อัพเดทสถานะ
                 document.processing_status = "processing"
+                document.chunking_signature = signature
                 session.commit()
                 
-                # แบ่งข้อความเป็น chunks
-                chunks = self.chunk_text(document.extracted_text)
-                logger.info(f"แบ่งเอกสาร {document.filename} เป็น {len(chunks)} chunks")
-                
-                # สร้าง embeddings สำหรับแต่ละ chunk
-                successful_chunks = 0
-                
-                for i, chunk_text in enumerate(chunks):
-                    try:
-                        # สร้าง embedding
-                        embedding = self.create_embedding(chunk_text)
-                        
-                        if embedding:
-                            # บันทึก chunk ลงฐานข้อมูล
-                            chunk = DocumentChunk(
-                                document_id=document_id,
-                                chunk_index=i,
-                                content=chunk_text,
-                                embedding=embedding,
-                                embedding_model=self.model
-                            )
-                            session.add(chunk)
-                            successful_chunks += 1
-                        else:
-                            logger.warning(f"ไม่สามารถสร้าง embedding สำหรับ chunk {i}")
-                            
-                    except Exception as e:
-                        logger.error(f"ข้อผิดพลาดใน chunk {i}: {e}")
+                # แบ่ง chunks แบบ streaming แล้วสร้าง embeddings และบันทึกทีละ checkpoint
+                # (ถ้าล้มเหลวกลางทาง รอบถัดไปเริ่มจาก checkpoint ล่าสุด)
+                checkpoint = config.embedding.chunk_insert_batch_size
+                state = {"total": 0, "done": 0, "failed": 0, "duplicates": 0}
+                
+                def embed_pending(pending: List[Chunk]):
+                    base = state["done"]
+                    
+                    def segment_progress(current, segment_total, message):
+                        check_cancelled()
+                        if progress_callback:
+                            total = max(estimated, state["total"])
+                            progress_callback(min(base + current, total), total, f"Processing chunks {base + current}/{total}")
+                    
+                    # chunks ที่เกือบซ้ำกับ chunk หลักที่บันทึกแล้ว หรือกับ chunk ก่อนหน้าใน batch นี้ ไม่ต้องสร้าง embedding
+                    if self.duplicates.enabled:
+                        signatures = [simhash(chunk.text) for chunk in pending]
+                        canonical, leaders = self.duplicates.assign(document, [chunk.text for chunk in pending], signatures)
+                    else:
+                        signatures = [None] * len(pending)
+                        canonical, leaders = np.full(len(pending), -1), np.arange(len(pending))
+                    unique = [i for i in range(len(pending)) if canonical[i] < 0 and leaders[i] == i]
+                    embeddings = dict(zip(unique, self.create_batch_embeddings(
+                        [pending[i].text for i in unique], segment_progress, model
+                    )))
+                    
+                    check_cancelled()
+                    created_at = datetime.utcnow()
+                    
+                    def chunk_row(i: int, vector: Optional[bytes], vector_model: Optional[str],
+                                  canonical_chunk_id: Optional[int] = None) -> Dict[str, Any]:
+                        chunk = pending[i]
+                        return {
+                            'document_id': document_id,
+                            'chunk_index': chunk.index,
+                            'content': chunk.text,
+                            'content_type': 'text',
+                            'embedding_vector': vector,
+                            'embedding_model': vector_model,
+                            'simhash': signatures[i],
+                            'canonical_chunk_id': canonical_chunk_id,
+                            'page_number': chunk.page_number,
+                            'start_char': chunk.start_char,
+                            'end_char': chunk.end_char,
+                            'created_at': created_at
+                        }
+                    
+                    rows = []
+                    for i in unique:
+                        if not embeddings[i]:
+                            logger.warning(f"ไม่สามารถสร้าง embedding สำหรับ chunk {pending[i].index}")
+                            state["failed"] += 1
+                            continue
+                        rows.append(chunk_row(i, encode_embedding(embeddings[i], model), model))
+                    self.insert_chunks(session, rows)
+                    
+                    # chunks ที่ซ้ำ: อ้างอิง chunk หลัก และเก็บสำเนา vector ไว้ใช้เมื่อ chunk หลักถูกลบ
+                    duplicates = [i for i in range(len(pending)) if i not in embeddings]
+                    if duplicates:
+                        sources = self.duplicates.fetch_vectors([canonical[i] for i in duplicates if canonical[i] >= 0])
+                        leader_ids = {
+                            row.chunk_index: row.id for row in session.query(DocumentChunk.chunk_index, DocumentChunk.id).filter(
+                                DocumentChunk.document_id == document_id,
+                                DocumentChunk.chunk_index.in_({pending[leaders[i]].index for i in duplicates})
+                            ).all()
+                        }
+                        rows = []
+                        for i in duplicates:
+                            if canonical[i] >= 0:
+                                source = sources.get(int(canonical[i]))
+                                if source is not None:
+                                    rows.append(chunk_row(i, source.embedding_vector, source.embedding_model, source.id))
+                                    continue
+                            elif embeddings.get(leaders[i]) and pending[leaders[i]].index in leader_ids:
+                                rows.append(chunk_row(i, encode_embedding(embeddings[leaders[i]], model), model,
+                                                      leader_ids[pending[leaders[i]].index]))
+                                continue
+                            logger.warning(f"ไม่พบ chunk หลักของ chunk {pending[i].index}")
+                            state["failed"] += 1
+                        self.insert_chunks(session, rows)
+                        state["duplicates"] += len(rows)
+                    state["done"] += len(pending)
+                    
+                    # บันทึกความคืบหน้า
+                    document.chunks_count = session.query(DocumentChunk).filter(
+                        DocumentChunk.document_id == document_id
+                    ).count()
+                    document.chunks_failed = state["failed"]
+                    session.commit()
+                
+                pending: List[Chunk] = []
+                for chunk in chunker.chunks(iter_segments(text)):
+                    state["total"] = chunk.index + 1
+                    if chunk.index in existing:
+                        state["done"] += 1
                         continue
+                    pending.append(chunk)
+                    if len(pending) >= checkpoint:
+                        embed_pending(pending)
+                        pending = []
+                if pending:
+                    embed_pending(pending)
+                check_cancelled()
                 
-                # อัพเดทข้อมูลเอกสาร
+                total = state["total"]
+                document.chunks_total = total
+                logger.info(f"แบ่งเอกสาร {document.filename} เป็น {total} chunks")
+                
+                # อัพเดทข้อมูลเอกสารหลังบันทึก chunks ครบ (chunks ที่ล้มเหลวจะถูกสร้างใหม่ในการประมวลผลครั้งถัดไป)
+                successful_chunks = session.query(DocumentChunk).filter(
+                    DocumentChunk.document_id == document_id
+                ).count()
+                complete = total > 0 and successful_chunks >= total
                 document.has_embeddings = successful_chunks > 0
                 document.chunks_count = successful_chunks
-                document.processing_status = "completed" if successful_chunks > 0 else "failed"
+                document.chunks_failed = total - successful_chunks if total else 0
+                document.processing_status = "completed" if complete else "failed"
                 document.processed_at = datetime.utcnow()
                 
                 session.commit()
                 
-                logger.info(f"ประมวลผลเอกสาร {document.filename} เสร็จสิ้น: {successful_chunks}/{len(chunks)} chunks")
-                return successful_chunks > 0
+                # vector ระดับเอกสารสำหรับการค้นหาสองระดับ (คำนวณจาก vectors ของ chunks ที่บันทึกแล้ว)
+                check_cancelled()
+                if successful_chunks:
+                    self.summaries.update([document_id], model)
                 
+                # โมเดลถูกเปลี่ยนระหว่างประมวลผล: ให้ worker สร้าง vectors ของโมเดลใหม่ให้ chunks เหล่านี้
+                active = self.models.active_model()
+                if active != model and self.models.target_model() != active:
+                    self.models.start(active, updated_by="process_document")
+                
+                # ดึง chunks ใหม่เข้าดัชนีทันที (process อื่นจะเห็นภายใน index_refresh_interval)
+                if self.index.is_built:
+                    self.refresh_index(force=True)
+                if self.keywords.is_built:
+                    self.keywords.refresh(force=True)
+                
+                if state["duplicates"]:
+                    logger.info(f"เอกสาร {document.filename}: {state['duplicates']} chunks เกือบซ้ำกับ chunks ที่มีอยู่ (ไม่สร้าง embedding)")
+                logger.info(f"ประมวลผลเอกสาร {document.filename} เสร็จสิ้น: {successful_chunks}/{total} chunks")
+                return complete
+                
+        except ProcessingCancelled:
+            # ไม่แก้สถานะเอกสาร: ผู้ที่รับงานต่อเป็นผู้บันทึก
+            raise
         except Exception as e:
             logger.error(f"เกิดข้อผิดพลาดในการประมวลผลเอกสาร {document_id}: {e}")
             
-            # อัพเดทสถานะเป็น failed
+            # อัพเดทสถานะเป็น failed (chunks ที่บันทึกแล้วยังอยู่ ใช้ต่อในครั้งถัดไป)
             try:
                 with get_db_session() as session:
                     document = session.query(Document).filter(
                         Document.id == document_id
                     ).first()
                     if document:
+                        document.chunks_count = session.query(DocumentChunk).filter(
+                            DocumentChunk.document_id == document_id
+                        ).count()
+                        document.has_embeddings = document.chunks_count > 0
                         document.processing_status = "failed"
                         session.commit()
             except:
@@ -199,75 +479,442 @@ class EmbeddingService:
                 
             return False
     
+    @staticmethod
+    def insert_chunks(session, rows: List[Dict[str, Any]], batch_size: int = None) -> int:
+        """เพิ่มแถว document_chunks ด้วย Core INSERT แบบ executemany และ commit ทีละ batch ส่งคืนจำนวนแถวที่เพิ่ม
+        (chunk_index ที่มีอยู่แล้วจะถูกข้าม เช่นเมื่อ process อื่นประมวลผลเอกสารเดียวกันพร้อมกัน)"""
+        batch_size = batch_size or config.embedding.chunk_insert_batch_size
+        table = DocumentChunk.__table__
+        inserted = 0
+        
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            try:
+                session.execute(table.insert(), batch)
+                session.commit()
+            except IntegrityError:
+                session.rollback()
+                keys = {(row['document_id'], row['chunk_index']) for row in batch}
+                existing = {
+                    (row.document_id, row.chunk_index) for row in session.query(
+                        DocumentChunk.document_id, DocumentChunk.chunk_index
+                    ).filter(
+                        DocumentChunk.document_id.in_({key[0] for key in keys}),
+                        DocumentChunk.chunk_index.in_({key[1] for key in keys})
+                    ).all()
+                }
+                batch = [row for row in batch if (row['document_id'], row['chunk_index']) not in existing]
+                if batch:
+                    session.execute(table.insert(), batch)
+                session.commit()
+            inserted += len(batch)
+        
+        return inserted
+    
     def search_similar_chunks(self, query: str, limit: int = 5,
-                            document_ids: List[int] = None) -> List[Dict[str, Any]]:
-        """ค้นหา chunks ที่คล้ายคลึงกับ query"""
+                            document_ids: List[int] = None,
+                            category: Union[str, List[str]] = None,
+                            is_public: Optional[bool] = None,
+                            uploaded_by: Union[int, List[int]] = None,
+                            visible_to: Optional[int] = None,
+                            mode: str = None) -> List[Dict[str, Any]]:
+        """ค้นหา chunks ที่คล้ายคลึงกับ query (ตัวกรองถูกใช้ในดัชนีก่อนคำนวณคะแนน)
+        visible_to = user id: เฉพาะเอกสารที่เผยแพร่หรือผู้ใช้นั้นอัพโหลด
+        mode = vector, keyword (BM25) หรือ hybrid (รวมอันดับทั้งสองแบบ) ค่าเริ่มต้นจาก config.embedding.search_mode"""
         try:
+            mode = mode or config.embedding.search_mode
+            if mode != "vector" and not self.keywords.enabled:
+                mode = "vector"
+            
+            # ก่อนสร้าง embedding ของ query: การสลับโมเดลเกิดที่นี่ จึงใช้โมเดลเดียวกับดัชนี
+            if not self.ensure_index():
+                # ดัชนี vector กำลังสร้างในพื้นหลัง: ใช้ดัชนีคำที่พร้อมแล้วแทนการรอ
+                if mode != "keyword":
+                    if not (self.keywords.enabled and self.keywords.is_built):
+                        logger.warning("ดัชนี vector กำลังสร้างในพื้นหลัง ยังค้นหาไม่ได้")
+                        return []
+                    logger.info("ดัชนี vector กำลังสร้างในพื้นหลัง จะค้นหาด้วยดัชนีคำ")
+                    mode = "keyword"
+                # ตัวกรองใช้คุณสมบัติเอกสารของดัชนี (sync เฉพาะตาราง documents)
+                self.index.documents.sync()
+            
             # สร้าง embedding สำหรับ query
-            query_embedding = self.create_embedding(query)
-            if not query_embedding:
-                logger.error("ไม่สามารถสร้าง embedding สำหรับ query")
-                return []
+            query_embedding = None
+            if mode != "keyword":
+                query_embedding = self.embed_query(query)
+                if not query_embedding:
+                    if mode == "vector":
+                        logger.error("ไม่สามารถสร้าง embedding สำหรับ query")
+                        return []
+                    logger.warning("ไม่สามารถสร้าง embedding สำหรับ query จะค้นหาด้วยดัชนีคำอย่างเดียว")
+                    mode = "keyword"
             
-            with get_db_session() as session:
-                # สร้าง base query
-                sql_query = """
-                SELECT 
-                    dc.id,
-                    dc.content,
-                    dc.chunk_index,
-                    dc.embedding,
-                    d.id as document_id,
-                    d.filename,
-                    d.title,
-                    d.category
-                FROM document_chunks dc
-                JOIN documents d ON dc.document_id = d.id
-                WHERE dc.embedding IS NOT NULL
-                AND d.is_processed = TRUE
-                """
-                
-                params = {}
-                
-                # เพิ่มเงื่อนไขถ้ามีการระบุเอกสาร
-                if document_ids:
-                    placeholders = ','.join([f':doc_id_{i}' for i in range(len(document_ids))])
-                    sql_query += f" AND d.id IN ({placeholders})"
-                    for i, doc_id in enumerate(document_ids):
-                        params[f'doc_id_{i}'] = doc_id
-                
-                # ดำเนินการ query
-                result = session.execute(text(sql_query), params).fetchall()
-                
-                # คำนวณ cosine similarity
-                similarities = []
-                for row in result:
-                    try:
-                        chunk_embedding = json.loads(row.embedding) if isinstance(row.embedding, str) else row.embedding
-                        similarity = self.cosine_similarity(query_embedding, chunk_embedding)
-                        
-                        similarities.append({
-                            'chunk_id': row.id,
-                            'content': row.content,
-                            'chunk_index': row.chunk_index,
-                            'document_id': row.document_id,
-                            'filename': row.filename,
-                            'title': row.title or row.filename,
-                            'category': row.category,
-                            'similarity': similarity
-                        })
-                    except Exception as e:
-                        logger.warning(f"ไม่สามารถคำนวณ similarity สำหรับ chunk {row.id}: {e}")
-                        continue
-                
-                # เรียงลำดับตาม similarity และคืนผลลัพธ์
-                similarities.sort(key=lambda x: x['similarity'], reverse=True)
-                return similarities[:limit]
+            # แปลงตัวกรองเป็นชุด document id จากตารางคุณสมบัติเอกสารในดัชนี
+            allowed_documents = None
+            substitutes: Dict[int, int] = {}
+            aliases: Dict[int, int] = {}
+            filters = {
+                'document_ids': document_ids or None,
+                'category': category,
+                'is_public': is_public,
+                'uploaded_by': uploaded_by,
+                'visible_to': visible_to
+            }
+            if any(value is not None for value in filters.values()):
+                allowed_documents = self.index.documents.matching(**filters)
+                if allowed_documents.size == 0:
+                    return []
+                # chunks ของเอกสารที่เลือกซึ่งซ้ำกับ chunk หลักในเอกสารอื่น (ไม่อยู่ในดัชนี vector) ค้นหาผ่าน chunk หลัก
+                # และเอกสารที่อัพโหลดซ้ำค้นหาใน chunks ของต้นฉบับ แล้วแสดงผลเป็นของเอกสารที่เลือก
+                substitutes = self.index.documents.copies(allowed_documents)
+                aliases = self.index.documents.sources(allowed_documents)
+                if aliases:
+                    allowed_documents = np.union1d(allowed_documents, list(aliases))
+            
+            if mode == "vector":
+                top_ids, scores = self._search_vectors(query_embedding, limit, allowed_documents, substitutes)
+                if len(top_ids) == 0:
+                    return []
+                return self._fetch_chunk_results(top_ids.tolist(), scores.tolist(), aliases)
+            
+            self.keywords.ensure_built()
+            if mode == "keyword":
+                top_ids, scores = self.keywords.search(query, limit, allowed_documents)
+                if len(top_ids) == 0:
+                    return []
+                # ไม่มี cosine similarity จึงใช้คะแนน BM25 เทียบกับอันดับแรก (0-1)
+                results = self._fetch_chunk_results(top_ids.tolist(), (scores / scores[0]).tolist(), aliases)
+                bm25 = dict(zip(top_ids.tolist(), scores.tolist()))
+                for result in results:
+                    result['bm25'] = bm25[result['chunk_id']]
+                return results
+            
+            return self._search_hybrid(query, query_embedding, limit, allowed_documents, substitutes, aliases)
                 
         except Exception as e:
             logger.error(f"เกิดข้อผิดพลาดในการค้นหา: {e}")
             return []
     
+    def _search_hybrid(self, query: str, query_embedding: List[float], limit: int,
+                       allowed_documents: Optional[np.ndarray], substitutes: Dict[int, int] = None,
+                       aliases: Dict[int, int] = None) -> List[Dict[str, Any]]:
+        """รวมอันดับจาก vectors และ BM25 ด้วย reciprocal rank fusion: คะแนน = Σ 1 / (rrf_k + อันดับ)"""
+        candidates = max(limit, config.embedding.hybrid_candidates)
+        vector_ids, vector_scores = self._search_vectors(query_embedding, candidates, allowed_documents, substitutes)
+        keyword_ids, keyword_scores = self.keywords.search(query, candidates, allowed_documents)
+        
+        fused: Dict[int, float] = {}
+        for ids in (vector_ids, keyword_ids):
+            for rank, chunk_id in enumerate(ids.tolist(), start=1):
+                fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (config.embedding.rrf_k + rank)
+        top = sorted(fused, key=fused.get, reverse=True)[:limit]
+        if not top:
+            return []
+        
+        # chunks ที่พบจากดัชนีคำอย่างเดียว: คำนวณ cosine similarity เฉพาะ chunks เหล่านั้น
+        # (chunks ที่ซ้ำไม่อยู่ในดัชนี vector จึงใช้ vector ของ chunk หลัก)
+        similarities = dict(zip(vector_ids.tolist(), vector_scores.tolist()))
+        missing = [chunk_id for chunk_id in top if chunk_id not in similarities]
+        if missing:
+            canonical = self.index.documents.canonical_of(missing)
+            lookup = [canonical.get(chunk_id, chunk_id) for chunk_id in missing]
+            ids, scores = self.index.search(query_embedding, len(missing), candidate_ids=lookup)
+            found = dict(zip(ids.tolist(), scores.tolist()))
+            similarities.update(
+                (chunk_id, found[target]) for chunk_id, target in zip(missing, lookup) if target in found
+            )
+        
+        bm25 = dict(zip(keyword_ids.tolist(), keyword_scores.tolist()))
+        results = self._fetch_chunk_results(top, [similarities.get(chunk_id, 0.0) for chunk_id in top], aliases)
+        for result in results:
+            result['score'] = fused[result['chunk_id']]
+            result['bm25'] = bm25.get(result['chunk_id'], 0.0)
+        return results
+    
+    def ensure_index(self, wait: bool = False) -> bool:
+        """เตรียมดัชนี vector และดัชนี ANN เมื่อคลังใหญ่พอ ส่งคืน False ถ้าดัชนียังไม่พร้อม
+        ครั้งแรกสร้างจากฐานข้อมูลใน thread พื้นหลัง (คำขอไม่ต้องรอ) wait=True: สร้างให้เสร็จก่อน (CLI/benchmark)"""
+        self.sync_active_model()
+        if not self.index.is_built:
+            if not wait:
+                self._start_index_build()
+                return False
+            self.index.ensure_built()
+        self.refresh_index()
+        self._prepare_ann(self.index, self.ann, self.model)
+        return True
+    
+    def _start_index_build(self):
+        """สร้างดัชนีของโมเดลปัจจุบันในพื้นหลังแล้วสลับเมื่อพร้อม (ครั้งเดียว แม้หลายคำขอเรียกพร้อมกัน)"""
+        model = self.model
+        with self._switch_lock:
+            if self.index.is_built or self._pending_model is not None:
+                return
+            self._pending_model = model
+        logger.info(f"เริ่มสร้างดัชนี vector ของโมเดล {model} ในพื้นหลัง")
+        threading.Thread(target=self._prepare_model, args=(model,),
+                         name="embedding-index-build", daemon=True).start()
+    
+    def _prepare_ann(self, index: VectorIndex, ann: AnnIndex, model: str):
+        """โหลดดัชนี ANN จากดิสก์แล้วปรับให้ตรงกับดัชนี vector หรือสร้างใหม่ (เฉพาะเมื่อคลังใหญ่พอ)"""
+        if not ann.enabled or index.size < config.embedding.ann_min_corpus_size:
+            return
+        
+        if ann.is_ready and not ann.needs_rebuild:
+            return
+        
+        with self._ann_lock:
+            if ann.is_ready and not ann.needs_rebuild:
+                return
+            
+            ids, matrix = index.snapshot()
+            if not ann.is_ready and ann.load(model):
+                # ดัชนีบนดิสก์อาจเก่ากว่าฐานข้อมูล จึงปรับให้ตรงกันก่อนใช้งาน
+                added, removed = ann.sync(ids, matrix)
+                logger.info(f"ปรับดัชนี ANN ให้ตรงกับฐานข้อมูล: เพิ่ม {added} ลบ {removed}")
+            else:
+                ann.build(ids, matrix, model)
+            ann.save(force=True)
+    
+    def sync_active_model(self):
+        """ตรวจโมเดลที่ active ถ้าเปลี่ยน: สร้างดัชนีของโมเดลใหม่ในพื้นหลังระหว่างที่ดัชนีเดิมยังค้นหาได้ แล้วสลับเมื่อพร้อม
+        (ดัชนีที่ยังไม่เคยสร้างสลับได้ทันที)"""
+        model = self.models.active_model()
+        if model == self.model or model == self._pending_model:
+            return
+        
+        with self._switch_lock:
+            if model == self.model or model == self._pending_model:
+                return
+            if not self.index.is_built:
+                # ดัชนีแรกของโมเดลเดิมที่กำลังสร้างในพื้นหลัง (ถ้ามี) จะไม่ถูกสลับเข้ามา
+                self._pending_model = None
+                self._activate(model, create_vector_index(model), create_ann_index(model))
+                return
+            self._pending_model = model
+            threading.Thread(target=self._prepare_model, args=(model,),
+                             name="embedding-model-switch", daemon=True).start()
+    
+    def _prepare_model(self, model: str):
+        """สร้างดัชนี vector/ANN ของโมเดลใหม่ให้ครบก่อน แล้วสลับ model/index/ann พร้อมกันภายใต้ lock"""
+        try:
+            started = time.monotonic()
+            index = create_vector_index(model)
+            index.build_from_database()
+            ann = create_ann_index(model)
+            self._prepare_ann(index, ann, model)
+            with self._switch_lock:
+                if self._pending_model == model:
+                    self._activate(model, index, ann)
+                    logger.info(f"เตรียมดัชนีของโมเดล {model} ใน {time.monotonic() - started:.1f} วินาที")
+        except Exception as e:
+            logger.error(f"ไม่สามารถสร้างดัชนีของโมเดล {model}: {e}")
+        finally:
+            with self._switch_lock:
+                if self._pending_model == model:
+                    self._pending_model = None
+    
+    def _activate(self, model: str, index: VectorIndex, ann: AnnIndex):
+        """สลับไปใช้โมเดลและดัชนีชุดใหม่ (ดัชนีเดิมถูกปล่อยเมื่อการค้นหาที่ใช้อยู่จบ)"""
+        previous = self.model
+        self.model, self.index, self.ann = model, index, ann
+        if previous != model:
+            logger.info(f"สลับโมเดล embedding จาก {previous} เป็น {model}")
+    
+    def _use_ann(self, document_ids: Optional[np.ndarray]) -> bool:
+        """ใช้ ANN เมื่อพร้อมและคลังใหญ่เกินเกณฑ์ (การค้นหาที่มีตัวกรองใช้ดัชนี exact ที่กรองก่อนคำนวณ)"""
+        return (document_ids is None
+                and self.ann.is_ready
+                and self.index.size >= config.embedding.ann_min_corpus_size)
+    
+    def _hierarchical_documents(self, query_embedding: List[float],
+                                document_ids: Optional[np.ndarray]) -> Optional[np.ndarray]:
+        """รอบแรกของการค้นหาสองระดับ: เอกสารที่จะคำนวณคะแนน chunks (None = ค้นหาตามปกติ)"""
+        if not config.embedding.hierarchical_search:
+            return None
+        documents = self.index.documents
+        if documents.summarized < max(config.embedding.hierarchical_min_documents, 1):
+            return None
+        return documents.nearest(VectorIndex.normalize(query_embedding)[0],
+                                 config.embedding.hierarchical_top_documents, document_ids)
+    
+    def _search_vectors(self, query_embedding: List[float], limit: int,
+                        document_ids: Optional[np.ndarray] = None,
+                        substitutes: Dict[int, int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """เลือกดัชนีที่เหมาะสมและค้นหา ส่งคืน (chunk_ids, similarities)
+        substitutes = {chunk หลัก: chunk ที่ซ้ำในเอกสารที่เลือก} ค้นหา chunks หลักเหล่านี้เพิ่มและส่งคืนเป็น chunk ที่ซ้ำ"""
+        # การค้นหาสองระดับ: คำนวณคะแนนเฉพาะ chunks ของเอกสารที่ได้จากรอบแรก (ต้นทุนตามจำนวนเอกสาร ไม่ใช่จำนวน chunks)
+        candidates = self._hierarchical_documents(query_embedding, document_ids)
+        if candidates is not None:
+            ids, scores = self.index.search(query_embedding, limit, document_ids=candidates)
+        elif self._use_ann(document_ids):
+            return self.ann.search(VectorIndex.normalize(query_embedding)[0], limit)
+        else:
+            ids, scores = self.index.search(query_embedding, limit, document_ids=document_ids)
+        if not substitutes:
+            return ids, scores
+        
+        copy_ids, copy_scores = self.index.search(query_embedding, limit, candidate_ids=list(substitutes))
+        ids = np.concatenate([ids, [substitutes[int(chunk_id)] for chunk_id in copy_ids]]).astype(np.int64)
+        scores = np.concatenate([scores, copy_scores])
+        order = np.argsort(-scores, kind="stable")[:limit]
+        return ids[order], scores[order]
+    
+    def refresh_index(self, force: bool = False):
+        """ดึงเฉพาะ chunks ที่เพิ่ม/ลบตั้งแต่ sync ครั้งก่อนเข้าดัชนี (เว้นช่วงตาม index_refresh_interval)"""
+        index, ann = self.index, self.ann
+        added_ids, added_vectors, removed_ids = index.refresh(force=force)
+        if not ann.is_ready or (len(added_ids) == 0 and len(removed_ids) == 0):
+            return
+        
+        ann.remove(removed_ids)
+        ann.add(added_ids, added_vectors)
+        ann.save()
+    
+    def delete_document_embeddings(self, document_id: int, release_references: bool = True) -> bool:
+        """ลบ chunks และ embeddings ของเอกสาร พร้อมนำออกจากดัชนี
+        
+        release_references: เอกสารที่อัพโหลดซ้ำและใช้ chunks ของเอกสารนี้จะถูกส่งเข้าคิวสร้าง chunks ของตัวเอง
+        (False เมื่อกำลังสร้าง chunks ของเอกสารนี้ใหม่)
+        """
+        try:
+            with get_db_session() as session:
+                chunk_ids = [
+                    row.id for row in session.query(DocumentChunk.id).filter(
+                        DocumentChunk.document_id == document_id
+                    ).all()
+                ]
+                
+                session.query(DocumentChunk).filter(
+                    DocumentChunk.document_id == document_id
+                ).delete(synchronize_session=False)
+                
+                # bulk delete ไม่ผ่าน ORM event จึงบันทึกการลบเอง ให้ process อื่นลบออกจากดัชนีตาม
+                session.bulk_insert_mappings(ChunkDeletion, [
+                    {"chunk_id": chunk_id, "document_id": document_id} for chunk_id in chunk_ids
+                ])
+                if chunk_ids:
+                    session.query(ChunkEmbedding).filter(
+                        ChunkEmbedding.chunk_id.in_(chunk_ids)
+                    ).delete(synchronize_session=False)
+                
+                # chunks ของเอกสารอื่นที่ใช้ chunks เหล่านี้เป็น chunk หลัก: ยกขึ้นเป็น chunk หลักแทน (ได้ id ใหม่)
+                promoted = self.duplicates.promote(session, chunk_ids)
+                
+                document = session.query(Document).filter(Document.id == document_id).first()
+                if document:
+                    document.has_embeddings = False
+                    document.chunks_count = 0
+                    document.summary_vector = None
+                    document.summary_model = None
+                
+                # เอกสารที่อัพโหลดซ้ำและใช้ chunks ของเอกสารนี้ร่วมกัน: ให้ worker สร้าง chunks ของตัวเอง
+                references = [
+                    row.id for row in session.query(Document.id).filter(
+                        Document.source_document_id == document_id,
+                        Document.chunks_total.is_(None),
+                        Document.extracted_text.isnot(None),
+                        Document.extracted_text != ""
+                    ).all()
+                ] if release_references else []
+                if references:
+                    session.query(Document).filter(Document.id.in_(references)).update(
+                        {Document.processing_status: "pending"}, synchronize_session=False
+                    )
+                
+                session.commit()
+            
+            index, ann = self.index, self.ann
+            index.remove(chunk_ids)
+            self.keywords.remove(chunk_ids)
+            if ann.is_ready:
+                ann.remove(chunk_ids)
+                ann.save()
+            
+            if promoted:
+                logger.info(f"ยก {len(promoted)} chunks ที่ซ้ำขึ้นเป็น chunk หลักแทน chunks ของเอกสาร {document_id}")
+                # สำเนา vector เป็นของโมเดลเดิม: ให้ worker สร้าง vector ของโมเดลที่ active
+                active = self.models.active_model()
+                if any(row['embedding_model'] != active for row in promoted) and self.models.target_model() != active:
+                    self.models.start(active, updated_by="promote_duplicates")
+                self.summaries.update({row['document_id'] for row in promoted}, active)
+                if index.is_built:
+                    self.refresh_index(force=True)
+                if self.keywords.is_built:
+                    self.keywords.refresh(force=True)
+            
+            if references:
+                logger.info(f"เพิ่มเอกสารที่อ้างอิงเอกสาร {document_id} เข้าคิว embeddings {len(references)} เอกสาร")
+                embedding_job_queue.enqueue(references)
+            
+            logger.info(f"ลบ embeddings ของเอกสาร {document_id} จำนวน {len(chunk_ids)} chunks")
+            return True
+            
+        except Exception as e:
+            logger.error(f"เกิดข้อผิดพลาดในการลบ embeddings ของเอกสาร {document_id}: {e}")
+            return False
+    
+    def _fetch_chunk_results(self, chunk_ids: List[int], scores: List[float],
+                             aliases: Dict[int, int] = None) -> List[Dict[str, Any]]:
+        """ดึงข้อมูล chunks และเอกสารตาม id โดยคงลำดับตามคะแนน
+        aliases = {เอกสารต้นฉบับ: เอกสารที่อัพโหลดซ้ำ} แสดง chunks ของต้นฉบับเป็นของเอกสารที่อัพโหลดซ้ำ"""
+        aliases = aliases or {}
+        with get_db_session() as session:
+            rows = session.query(
+                DocumentChunk.id,
+                DocumentChunk.content,
+                DocumentChunk.chunk_index,
+                Document.id.label('document_id'),
+                Document.filename,
+                Document.title,
+                Document.category
+            ).join(Document, DocumentChunk.document_id == Document.id).filter(
+                DocumentChunk.id.in_(chunk_ids)
+            ).all()
+            
+            # อ้างอิงกลับ: เอกสารที่มี chunks เกือบซ้ำกับ chunks ในผลลัพธ์
+            copies: Dict[int, set] = {}
+            for row in session.query(DocumentChunk.canonical_chunk_id, DocumentChunk.document_id).filter(
+                DocumentChunk.canonical_chunk_id.in_(chunk_ids)
+            ).all():
+                copies.setdefault(row.canonical_chunk_id, set()).add(row.document_id)
+            
+            # เอกสารที่อัพโหลดไฟล์เดียวกันซ้ำ (อ้างอิงเอกสารต้นฉบับ)
+            references: Dict[int, set] = {}
+            for row in session.query(Document.id, Document.source_document_id).filter(
+                Document.source_document_id.in_({row.document_id for row in rows})
+            ).all():
+                references.setdefault(row.source_document_id, set()).add(row.id)
+            
+            shown = {
+                row.id: row for row in session.query(
+                    Document.id, Document.filename, Document.title, Document.category
+                ).filter(Document.id.in_(set(aliases.values()))).all()
+            } if aliases else {}
+        
+        rows_by_id = {row.id: row for row in rows}
+        results = []
+        for chunk_id, similarity in zip(chunk_ids, scores):
+            row = rows_by_id.get(chunk_id)
+            if row is None:
+                continue
+            document = shown.get(aliases.get(row.document_id), row)
+            document_id = row.document_id if document is row else document.id
+            duplicates = copies.get(row.id, set()) | references.get(row.document_id, set()) | {row.document_id}
+            results.append({
+                'chunk_id': row.id,
+                'content': row.content,
+                'chunk_index': row.chunk_index,
+                'document_id': document_id,
+                'filename': document.filename,
+                'title': document.title or document.filename,
+                'category': document.category,
+                'similarity': float(similarity),
+                'duplicate_document_ids': sorted(duplicates - {document_id})
+            })
+        
+        return results
+    
     @staticmethod
     def cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
         """คำนวณ cosine similarity ระหว่างสอง vector"""
@@ -299,7 +946,9 @@ class EmbeddingService:
                         Document.has_embeddings == True
                     ).count(),
                     'total_chunks': session.query(DocumentChunk).count(),
-                    'embedding_model': self.model
+                    'embedding_model': self.model,
+                    'embedding_backend': 'local' if self.local.handles(self.model) else 'ollama',
+                    'document_summaries': self.summaries.status()
                 }
                 
                 # สถิติเพิ่มเติม
@@ -317,6 +966,22 @@ class EmbeddingService:
                     'success_rate': (stats['processed_documents'] / max(stats['total_documents'], 1)) * 100
                 })
                 
+                stats['embedding_cache'] = self.cache.stats()
+                stats['query_cache'] = self.query_cache.stats()
+                
+                # หน่วยความจำของดัชนี vector ต่อ chunk (codes ที่บีบอัดเทียบกับ float32 เต็ม)
+                if self.index.is_built:
+                    stats['index_memory'] = self.index.memory_stats()
+                if self.keywords.is_built:
+                    stats['keyword_index'] = self.keywords.stats()
+                
+                stats['near_duplicates'] = self.duplicates.report(top=0)
+                
+                # ความคืบหน้าการสร้าง embeddings ด้วยโมเดลใหม่ในพื้นหลัง
+                target = self.models.target_model()
+                if target:
+                    stats['reembedding'] = {'target_model': target, **self.models.coverage(target)}
+                
                 return stats
                 
         except Exception as e:
@@ -335,7 +1000,29 @@ def process_document_embeddings(document_id: int, progress_bar=None):
             progress = current / total
             progress_bar.progress(progress, text=message)
     
-    return embedding_service.process_document(document_id)
+    return embedding_service.process_document(document_id, progress_callback)
+
+def enqueue_document_embeddings(document_ids: List[int]) -> int:
+    """เพิ่มเอกสารเข้าคิว embeddings (python -m services.embedding_worker เป็นผู้ประมวลผล)"""
+    return embedding_job_queue.enqueue(document_ids)
+
+def rebuild_document_embeddings(document_ids: List[int]) -> int:
+    """ลบ chunks เดิมแล้วเพิ่มเข้าคิวเพื่อสร้างใหม่ทั้งหมด (งานที่ retry อัตโนมัติจะทำต่อจาก chunks เดิม)"""
+    for document_id in document_ids:
+        embedding_service.delete_document_embeddings(document_id, release_references=False)
+    return embedding_job_queue.enqueue(document_ids)
+
+def process_all_pending_embeddings() -> int:
+    """เพิ่มเอกสารทั้งหมดที่รอสร้าง embeddings เข้าคิว ส่งคืนจำนวนที่เพิ่ม"""
+    return embedding_job_queue.enqueue_pending()
+
+def get_embedding_queue_status() -> Dict[str, Any]:
+    """จำนวนงานในคิว embeddings แยกตามสถานะ"""
+    return embedding_job_queue.stats()
+
+def delete_document_embeddings(document_id: int) -> bool:
+    """ลบ embeddings ของเอกสาร (ใช้ก่อนลบเอกสารหรือประมวลผลใหม่)"""
+    return embedding_service.delete_document_embeddings(document_id)
 
 def search_documents(query: str, limit: int = 5) -> List[Dict[str, Any]]:
     """ค้นหาเอกสารที่เกี่ยวข้องกับ query"""
@@ -0,0 +1,243 @@
+"""
+ที่เก็บ embeddings แบบ shard (.npy) ใน config.app.embeddings_folder
+shard เขียนครั้งเดียวแล้วไม่แก้ไข (append-only) และเปิดด้วย np.memmap
+ทำให้ Streamlit หลาย process บนเครื่องเดียวกันใช้ page cache ร่วมกันได้
+"""
+
+import glob
+import json
+import logging
+import os
+import re
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from config import config
+from services.quantization import load_quantizer, save_quantizer
+
+try:
+    import fcntl
+except ImportError:  # Windows ไม่มี fcntl
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+def model_slug(model: str) -> str:
+    """แปลงชื่อโมเดลเป็นชื่อโฟลเดอร์ที่ปลอดภัย"""
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", model).strip("_") or "default"
+
+class ShardedEmbeddingStore:
+    """ที่เก็บ vectors (normalize แล้ว) แยกตามโมเดล พร้อม manifest บอกช่วง chunk id ของแต่ละ shard"""
+
+    def __init__(self, model: str = None, folder: str = None):
+        self.model = model or config.embedding.model
+        self.folder = os.path.join(folder or config.app.embeddings_folder, "shards", model_slug(self.model))
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.folder, "manifest.json")
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """ล็อกข้าม process ระหว่างเขียน shard และ manifest"""
+        os.makedirs(self.folder, exist_ok=True)
+        with open(os.path.join(self.folder, "manifest.lock"), "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def load_manifest(self) -> Dict:
+        """อ่าน manifest (ถ้ายังไม่มีจะส่งคืน manifest ว่าง)"""
+        try:
+            with open(self.manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return {"version": MANIFEST_VERSION, "model": self.model, "dim": None, "next_shard": 1, "shards": []}
+
+        if manifest.get("model") != self.model:
+            logger.warning(f"manifest ใน {self.folder} เป็นของโมเดล {manifest.get('model')} จะไม่ใช้งาน")
+            return {"version": MANIFEST_VERSION, "model": self.model, "dim": None, "next_shard": 1, "shards": []}
+        return manifest
+
+    def _write_manifest(self, manifest: Dict):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def open_shard(self, entry: Dict) -> Tuple[np.ndarray, np.ndarray]:
+        """เปิด shard แบบ memory-mapped ส่งคืน (chunk_ids, matrix) แบบอ่านอย่างเดียว"""
+        ids = np.load(os.path.join(self.folder, entry["ids_file"]), mmap_mode="r")
+        matrix = np.load(os.path.join(self.folder, entry["file"]), mmap_mode="r")
+        return ids, matrix
+
+    def shards(self) -> List[Dict]:
+        """รายการ shard ตาม manifest ปัจจุบัน (อ่านภายใต้ lock เพื่อไม่ให้ได้ manifest ที่ compact กำลังแก้)"""
+        with self._locked():
+            return self.load_manifest()["shards"]
+
+    def documents_path(self, shard_file: str) -> str:
+        """ไฟล์ document id ของแต่ละแถวใน shard เช่น shard_000001_docs.npy"""
+        return os.path.join(self.folder, f"{os.path.splitext(shard_file)[0]}_docs.npy")
+
+    def load_documents(self, shard_file: str) -> Optional[np.ndarray]:
+        """document id ของแต่ละแถวใน shard (-1 = ไม่ทราบ, ไม่มีไฟล์จะส่งคืน None)"""
+        try:
+            return np.load(self.documents_path(shard_file))
+        except (OSError, ValueError):
+            return None
+
+    def save_documents(self, shard_file: str, documents: np.ndarray):
+        """บันทึก document id ของ shard (ใช้เติมให้ shard ที่เขียนก่อนมีไฟล์นี้)"""
+        path = self.documents_path(shard_file)
+        np.save(path + ".tmp.npy", np.asarray(documents, dtype=np.int32))
+        os.replace(path + ".tmp.npy", path)
+
+    def _shard_documents(self, entry: Dict) -> np.ndarray:
+        documents = self.load_documents(entry["file"])
+        if documents is None or len(documents) != entry["count"]:
+            return np.full(entry["count"], -1, dtype=np.int32)
+        return documents
+
+    def _write_shard(self, manifest: Dict, ids: np.ndarray, vectors: np.ndarray,
+                     documents: Optional[np.ndarray] = None) -> Dict:
+        """เขียน shard ใหม่หนึ่งไฟล์ (ยังไม่อัพเดท manifest)"""
+        number = manifest["next_shard"]
+        manifest["next_shard"] = number + 1
+        entry = {
+            "file": f"shard_{number:06d}.npy",
+            "ids_file": f"shard_{number:06d}_ids.npy",
+            "model": self.model,
+            "dim": int(vectors.shape[1]),
+            "count": int(len(ids)),
+            "min_id": int(ids.min()),
+            "max_id": int(ids.max()),
+            "created_at": time.time()
+        }
+        for name, data in ((entry["file"], vectors), (entry["ids_file"], ids)):
+            tmp_path = os.path.join(self.folder, name + ".tmp.npy")
+            np.save(tmp_path, data)
+            os.replace(tmp_path, os.path.join(self.folder, name))
+        if documents is not None:
+            self.save_documents(entry["file"], documents)
+        return entry
+
+    def append(self, ids: np.ndarray, vectors: np.ndarray, documents: Optional[np.ndarray] = None) -> List[Dict]:
+        """เขียน vectors ที่ยังไม่มีใน store เป็น shard ใหม่ ส่งคืนรายการ shard ที่เขียน"""
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        documents = np.full(len(ids), -1, dtype=np.int32) if documents is None else np.asarray(documents, dtype=np.int32)
+        if len(ids) == 0:
+            return []
+
+        with self._locked():
+            manifest = self.load_manifest()
+            if manifest["dim"] is not None and manifest["dim"] != vectors.shape[1]:
+                logger.error(f"มิติ {vectors.shape[1]} ไม่ตรงกับ store ({manifest['dim']}) ไม่บันทึก shard")
+                return []
+
+            # process อื่นอาจเขียน chunk เดียวกันไปแล้ว
+            for entry in manifest["shards"]:
+                if len(ids) == 0:
+                    break
+                shard_ids, _ = self.open_shard(entry)
+                keep = ~np.isin(ids, shard_ids)
+                ids, vectors, documents = ids[keep], vectors[keep], documents[keep]
+
+            if len(ids) == 0:
+                return []
+
+            order = np.argsort(ids)
+            entry = self._write_shard(manifest, ids[order], np.ascontiguousarray(vectors[order]), documents[order])
+            manifest["dim"] = entry["dim"]
+            manifest["shards"].append(entry)
+            self._write_manifest(manifest)
+
+        logger.info(f"บันทึก shard {entry['file']}: {entry['count']} vectors (chunk id {entry['min_id']}-{entry['max_id']})")
+        return [entry]
+
+    def compact(self, target_rows: int = None, min_shards: int = 2) -> Optional[Dict]:
+        """รวม shard เล็กๆ ให้เป็น shard เดียว (process ที่เปิดไฟล์เก่าไว้ยังอ่านได้ตามปกติบน Linux)"""
+        target_rows = target_rows or config.embedding.shard_target_rows
+
+        with self._locked():
+            manifest = self.load_manifest()
+            small = [entry for entry in manifest["shards"] if entry["count"] < target_rows]
+            if len(small) < max(2, min_shards):
+                return None
+
+            parts = [self.open_shard(entry) for entry in small]
+            ids = np.concatenate([part[0] for part in parts])
+            vectors = np.concatenate([part[1] for part in parts])
+            documents = np.concatenate([self._shard_documents(entry) for entry in small])
+            order = np.argsort(ids)
+            merged = self._write_shard(manifest, ids[order], np.ascontiguousarray(vectors[order]), documents[order])
+
+            small_files = {entry["file"] for entry in small}
+            manifest["shards"] = [entry for entry in manifest["shards"] if entry["file"] not in small_files]
+            manifest["shards"].append(merged)
+            self._write_manifest(manifest)
+
+            for entry in small:
+                codes = [os.path.basename(path) for path in glob.glob(self.codes_path(entry["file"], "*"))]
+                names = [entry["file"], entry["ids_file"], os.path.basename(self.documents_path(entry["file"]))] + codes
+                for name in names:
+                    try:
+                        os.remove(os.path.join(self.folder, name))
+                    except OSError:
+                        pass
+
+        logger.info(f"รวม {len(small)} shards เป็น {merged['file']} ({merged['count']} vectors)")
+        return merged
+
+    def quantizer_path(self, kind: str) -> str:
+        return os.path.join(self.folder, f"quantizer_{kind}.npz")
+
+    def load_quantizer(self, kind: str):
+        """โหลดพารามิเตอร์ quantizer ที่ train ไว้ (ไม่มีจะส่งคืน None)"""
+        path = self.quantizer_path(kind)
+        if not os.path.exists(path):
+            return None
+        try:
+            return load_quantizer(path)
+        except Exception as e:
+            logger.error(f"ไม่สามารถโหลด quantizer {path}: {e}")
+            return None
+
+    def save_quantizer(self, quantizer):
+        """บันทึกพารามิเตอร์ quantizer ถ้ายังไม่มี process อื่นบันทึกไว้ก่อน ส่งคืนชุดที่ใช้จริง"""
+        with self._locked():
+            existing = self.load_quantizer(quantizer.kind)
+            if existing is not None and existing.dim == quantizer.dim and existing.code_size == quantizer.code_size:
+                return existing
+            path = self.quantizer_path(quantizer.kind)
+            save_quantizer(quantizer, path + ".tmp.npz")
+            os.replace(path + ".tmp.npz", path)
+        logger.info(f"บันทึก quantizer {quantizer.kind} ใน {self.folder}")
+        return quantizer
+
+    def codes_path(self, shard_file: str, tag: str) -> str:
+        """ไฟล์ codes ของ shard เช่น shard_000001.sq8-<fingerprint>.npy"""
+        return os.path.join(self.folder, f"{os.path.splitext(shard_file)[0]}.{tag}.npy")
+
+    def load_codes(self, shard_file: str, tag: str) -> Optional[np.ndarray]:
+        """โหลด codes ของ shard เข้าหน่วยความจำ (ไม่มีจะส่งคืน None)"""
+        try:
+            return np.load(self.codes_path(shard_file, tag))
+        except (OSError, ValueError):
+            return None
+
+    def save_codes(self, shard_file: str, tag: str, codes: np.ndarray):
+        """บันทึก codes ของ shard (shard ไม่เปลี่ยนแปลงจึงคำนวณเพียงครั้งเดียว)"""
+        path = self.codes_path(shard_file, tag)
+        np.save(path + ".tmp.npy", codes)
+        os.replace(path + ".tmp.npy", path)
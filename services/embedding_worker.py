@@ -0,0 +1,172 @@
+"""
+worker ประมวลผลคิว embeddings แยกจาก Streamlit
+รันได้หลายตัวพร้อมกัน (เครื่องเดียวหรือหลายเครื่อง) ความเร็วรวมเพิ่มตามจำนวน worker
+
+ตัวอย่าง:
+    python -m services.embedding_worker
+    python -m services.embedding_worker --once          # ทำงานที่ค้างจนหมดแล้วออก
+    python -m services.embedding_worker --worker-id node2-a
+
+เมื่อคิวว่าง worker จะสร้าง embeddings ของโมเดลใหม่ในพื้นหลัง (python -m services.embedding_models start <model>)
+คำนวณ vector ระดับเอกสารที่ขาด (python -m services.document_summaries) และรวม shard เล็กของดัชนี vector
+"""
+
+import argparse
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+from typing import Optional
+
+from config import config
+from database.database import init_database, run_migrations
+from database.models import EmbeddingJob
+from services.document_summaries import document_summaries
+from services.embedding_jobs import EmbeddingJobQueue, embedding_job_queue
+from services.embedding_models import ReembeddingJob
+from services.embedding_service import EmbeddingService, ProcessingCancelled, embedding_service
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingWorker:
+    """วนรับงานจากคิว เรียก EmbeddingService.process_document และต่ออายุ lease จาก thread แยกระหว่างทำงาน"""
+
+    def __init__(self, worker_id: str = None, queue: EmbeddingJobQueue = None,
+                 service: EmbeddingService = None):
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.queue = queue or embedding_job_queue
+        self.service = service or embedding_service
+        self.poll_interval = config.embedding.job_poll_interval
+        self.reembedding = ReembeddingJob(self.service)
+        self.summaries = document_summaries
+        self._stop = threading.Event()
+        self.processed = 0
+        self.failed = 0
+
+    def stop(self, *args):
+        """หยุดหลังงานปัจจุบันเสร็จ"""
+        logger.info(f"worker {self.worker_id} กำลังหยุด")
+        self._stop.set()
+
+    def run(self, once: bool = False):
+        """วนทำงานจนถูกหยุด (once=True: ออกเมื่อคิวว่าง)"""
+        logger.info(f"เริ่ม worker {self.worker_id}")
+        while not self._stop.is_set():
+            try:
+                self.queue.enqueue_pending()
+                jobs = self.queue.claim(self.worker_id)
+            except Exception as e:
+                logger.error(f"ไม่สามารถอ่านคิว embeddings: {e}")
+                jobs = []
+
+            if jobs:
+                self.process_job(jobs[0])
+            elif once:
+                break
+            elif not self.reembed() and not self.summarize() and not self.compact():
+                # รอรอบถัดไปของการสร้าง embeddings ในพื้นหลังตามงบความเร็ว แต่ไม่นานกว่า poll_interval
+                self._stop.wait(min(self.reembedding.wait_time() or self.poll_interval, self.poll_interval))
+
+        logger.info(f"worker {self.worker_id} หยุดทำงาน: สำเร็จ {self.processed} ล้มเหลว {self.failed}")
+
+    def reembed(self) -> bool:
+        """สร้าง embeddings ของโมเดลเป้าหมายหนึ่ง batch (ส่งคืน True ถ้าได้ทำงาน)"""
+        try:
+            return self.reembedding.run_batch() > 0
+        except Exception as e:
+            logger.error(f"ไม่สามารถสร้าง embeddings ด้วยโมเดลใหม่: {e}")
+            return False
+
+    def summarize(self) -> bool:
+        """คำนวณ vector ระดับเอกสารที่ขาดหนึ่ง batch (ส่งคืน True ถ้าได้ทำงาน)"""
+        try:
+            return self.summaries.run_batch() > 0
+        except Exception as e:
+            logger.error(f"ไม่สามารถคำนวณ vector ระดับเอกสาร: {e}")
+            return False
+
+    def compact(self) -> bool:
+        """รวม shard เล็กของดัชนี vector (ส่งคืน True ถ้าได้รวม)"""
+        try:
+            return self.service.index.compact()
+        except Exception as e:
+            logger.error(f"ไม่สามารถรวม shard ของดัชนี vector: {e}")
+            return False
+
+    def _heartbeat(self, job: EmbeddingJob, finished: threading.Event, lost: threading.Event):
+        """ต่ออายุ lease ทุก 1/3 ของ job_lease_seconds ตลอดงาน (ทุกขั้น ไม่เฉพาะระหว่างสร้าง embeddings)
+        ถ้างานไม่ได้เป็นของ worker นี้แล้ว set lost เพื่อให้ process_document หยุด"""
+        interval = config.embedding.job_lease_seconds / 3
+        while not finished.wait(interval):
+            try:
+                renewed = self.queue.extend_lease(job.id, self.worker_id)
+            except Exception as e:
+                # ฐานข้อมูลขัดข้องชั่วคราว: ลองใหม่รอบถัดไป (lease ยังเหลือ 2/3)
+                logger.error(f"ไม่สามารถต่ออายุ lease ของงาน {job.id}: {e}")
+                continue
+            if not renewed:
+                logger.warning(f"งาน {job.id} ถูก worker อื่นรับไปแล้ว หยุดประมวลผลเอกสาร {job.document_id}")
+                lost.set()
+                return
+
+    def process_job(self, job: EmbeddingJob) -> bool:
+        """ประมวลผลงานเดียว (process_document ทำต่อจาก chunks ที่บันทึกไว้ในรอบก่อน)"""
+        started = time.monotonic()
+        finished = threading.Event()
+        lost = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(job, finished, lost), name=f"lease-{job.id}", daemon=True
+        )
+        heartbeat.start()
+
+        error: Optional[str] = None
+        try:
+            success = self.service.process_document(job.document_id, cancel=lost)
+            if not success:
+                error = "process_document ไม่สำเร็จ (ดู log ของ worker)"
+        except ProcessingCancelled as e:
+            # worker อื่นรับงานไปแล้ว: ไม่บันทึกผลของงานนี้
+            logger.warning(str(e))
+            return False
+        except Exception as e:
+            success = False
+            error = str(e)
+        finally:
+            finished.set()
+            heartbeat.join()
+
+        if success:
+            self.queue.complete(job.id, self.worker_id)
+            self.processed += 1
+        else:
+            self.queue.fail(job.id, self.worker_id, error)
+            self.failed += 1
+
+        logger.info(
+            f"งาน {job.id} (เอกสาร {job.document_id}, ครั้งที่ {job.attempts}) "
+            f"{'สำเร็จ' if success else 'ล้มเหลว'} ใน {time.monotonic() - started:.1f} วินาที"
+        )
+        return success
+
+def main():
+    parser = argparse.ArgumentParser(description="worker ประมวลผลคิว embeddings")
+    parser.add_argument("--worker-id", help="ชื่อ worker (ค่าเริ่มต้น: hostname-pid-สุ่ม)")
+    parser.add_argument("--once", action="store_true", help="ทำงานที่ค้างจนหมดแล้วออก")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    # สร้างตาราง embedding_jobs และเพิ่มคอลัมน์/index ที่ worker ใช้ถ้ายังไม่มี
+    init_database()
+    run_migrations()
+    
+    worker = EmbeddingWorker(worker_id=args.worker_id)
+    signal.signal(signal.SIGINT, worker.stop)
+    signal.signal(signal.SIGTERM, worker.stop)
+    worker.run(once=args.once)
+
+if __name__ == "__main__":
+    main()
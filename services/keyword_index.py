@@ -0,0 +1,629 @@
+"""
+ดัชนีคำ (inverted index) ของ document_chunks.content สำหรับค้นหาแบบ BM25
+ช่วยคำค้นที่เป็นรหัส เลขที่แบบฟอร์ม หรือชื่อเฉพาะ ซึ่งการค้นหาด้วย embeddings ทำได้ไม่ดี
+postings เก็บเป็น array (แถวแบบ delta + ความถี่ 1 ไบต์) บันทึกเป็น .npz ใน config.app.embeddings_folder
+"""
+
+import abc
+import atexit
+import io
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import text
+
+from config import config
+from database.database import get_db_session
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+THAI = "ก-ฺเ-๎"  # พยัญชนะ สระ วรรณยุกต์ (ไม่รวมตัวเลขไทยและ ฿)
+ALNUM = "a-z0-9À-ɏ"
+# รหัสที่มีตัวคั่น เช่น ภ.ง.ด.91, NT-2024/15, ก.พ.7 (ส่วนภาษาไทยยาวไม่เกิน 3 ตัว จึงไม่รวมคำทั้งประโยค)
+CODE_PART = f"(?:[{THAI}]{{1,3}}|[{ALNUM}]+)"
+TOKEN_PATTERN = re.compile(
+    f"(?P<code>(?<![{THAI}{ALNUM}]){CODE_PART}(?:[./_-]{CODE_PART})+(?![{THAI}{ALNUM}]))"
+    f"|(?P<thai>[{THAI}]+)"
+    f"|(?P<word>[{ALNUM}]+)"
+)
+CODE_SEPARATORS = re.compile(r"[./_-]")
+THAI_DIGITS = str.maketrans("๐๑๒๓๔๕๖๗๘๙", "0123456789")
+THAI_DIGIT_PATTERN = re.compile("[๐-๙]")
+
+def _thai_bigrams(run: str) -> List[str]:
+    """แบ่งข้อความไทยเป็นคู่ตัวอักษรที่ซ้อนกัน (ไม่ต้องใช้พจนานุกรม คำค้นตรงกับคำในเอกสารได้ทุกตำแหน่ง)"""
+    if len(run) < 2:
+        return [run]
+    return list(map(str.__add__, run[:-1], run[1:]))
+
+def _load_thai_segmenter(name: str) -> Tuple[str, Callable[[str], List[str]]]:
+    """ตัวตัดคำภาษาไทย: pythainlp (newmm) ถ้าติดตั้งและตั้งค่าให้ใช้ ไม่เช่นนั้นใช้ bigram"""
+    if name in ("auto", "pythainlp"):
+        try:
+            from pythainlp.tokenize import word_tokenize
+        except ImportError:
+            if name == "pythainlp":
+                logger.warning("ไม่ได้ติดตั้ง pythainlp จะตัดคำภาษาไทยแบบ bigram แทน")
+        else:
+            def segment(run: str) -> List[str]:
+                return [word for word in word_tokenize(run, engine="newmm", keep_whitespace=False) if word.strip()]
+            return "pythainlp-newmm", segment
+    return "bigram", _thai_bigrams
+
+class KeywordTokenizer:
+    """แปลงข้อความเป็นคำสำหรับดัชนี: ภาษาไทยตัดคำ/bigram ส่วนคำภาษาอังกฤษ ตัวเลข และรหัสคงไว้ทั้งคำ"""
+
+    def __init__(self, thai_segmenter: str = None):
+        self.name, self._segment_thai = _load_thai_segmenter(thai_segmenter or config.embedding.keyword_tokenizer)
+
+    def __call__(self, content: str) -> List[str]:
+        content = unicodedata.normalize("NFKC", content).lower()
+        if THAI_DIGIT_PATTERN.search(content):
+            content = content.translate(THAI_DIGITS)
+        tokens: List[str] = []
+        for match in TOKEN_PATTERN.finditer(content):
+            kind, value = match.lastgroup, match.group()
+            if kind == "code":
+                # เก็บทั้งรหัสเต็ม รหัสที่ไม่มีตัวคั่น และส่วนที่เป็นตัวอักษร/ตัวเลข (ค้นหา "ภงด91" หรือ "2024" ก็พบ)
+                parts = CODE_SEPARATORS.split(value)
+                tokens.append(value)
+                tokens.append("".join(parts))
+                tokens.extend(part for part in parts if re.fullmatch(f"[{ALNUM}]+", part))
+            elif kind == "thai":
+                tokens.extend(self._segment_thai(value))
+            else:
+                tokens.append(value)
+        return tokens
+
+class _Postings:
+    """postings แบบ CSR: แถวของ term t อยู่ที่ rows[offsets[t]:offsets[t + 1]] (เรียงจากน้อยไปมาก)"""
+
+    __slots__ = ("offsets", "rows", "freqs", "terms")
+
+    def __init__(self, offsets: np.ndarray, rows: np.ndarray, freqs: np.ndarray, terms: Optional[np.ndarray] = None):
+        self.offsets = offsets
+        self.rows = rows
+        self.freqs = freqs
+        self.terms = terms  # term id ของแต่ละ posting (เฉพาะส่วนใหม่ที่ยังไม่รวม ใช้ binary search)
+
+    @classmethod
+    def empty(cls) -> "_Postings":
+        return cls(np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int32), np.empty(0, dtype=np.uint8))
+
+    @classmethod
+    def from_triples(cls, terms: np.ndarray, rows: np.ndarray, freqs: np.ndarray) -> "_Postings":
+        """postings ส่วนใหม่จาก (term, row, freq) เรียงตาม term แล้วตาม row"""
+        order = np.lexsort((rows, terms))
+        return cls(None, rows[order].astype(np.int32), freqs[order], terms[order])
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def lookup(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        if self.terms is not None:
+            start = np.searchsorted(self.terms, term_id, side="left")
+            end = np.searchsorted(self.terms, term_id, side="right")
+        elif term_id + 1 < len(self.offsets):
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        else:
+            return self.rows[:0], self.freqs[:0]
+        return self.rows[start:end], self.freqs[start:end]
+
+    def triples(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        if self.terms is not None:
+            return self.terms, self.rows, self.freqs
+        counts = np.diff(self.offsets)
+        return np.repeat(np.arange(len(counts), dtype=np.int32), counts), self.rows, self.freqs
+
+class InvertedIndex(abc.ABC):
+    """ดัชนี BM25 ในหน่วยความจำ: postings หลัก (รวมแล้ว) + ส่วนใหม่จาก refresh ที่รวมเป็นระยะ
+    แต่ละแถวมี key (chunk id หรือ document id) และ document id สำหรับตัวกรอง
+    แถวที่ถูกลบถูกซ่อนด้วย mask จนกว่าจะรวม postings ครั้งถัดไป (คลาสลูกกำหนดการ sync กับฐานข้อมูล)"""
+
+    name = "index"
+    version = ""  # เปลี่ยนเมื่อวิธีนับคำเปลี่ยน เพื่อไม่ให้โหลดดัชนีเดิมจากดิสก์
+
+    def __init__(self, folder: str = None, tokenizer: KeywordTokenizer = None):
+        self.folder = os.path.join(folder or config.app.embeddings_folder, "keyword")
+        self._tokenizer = tokenizer
+        # _lock ป้องกัน postings/array ที่การค้นหาอ่าน (ถือเฉพาะตอนรวม postings)
+        # _write_lock ให้การสร้าง/refresh ทำทีละราย: อ่านฐานข้อมูลและตัดคำโดยไม่ถือ _lock
+        self._lock = threading.RLock()
+        self._write_lock = threading.RLock()
+        self.clear()
+
+    @property
+    def tokenizer(self) -> KeywordTokenizer:
+        if self._tokenizer is None:
+            self._tokenizer = KeywordTokenizer()
+        return self._tokenizer
+
+    @property
+    def size(self) -> int:
+        """จำนวนแถวที่ค้นหาได้"""
+        return self._alive_count
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.folder, f"{self.name}.npz")
+
+    @property
+    def signature(self) -> str:
+        """ดัชนีบนดิสก์ใช้ได้เมื่อรูปแบบและตัวตัดคำตรงกัน"""
+        return f"v{FORMAT_VERSION}{self.version}:{self.tokenizer.name}"
+
+    def clear(self):
+        """ล้างข้อมูลในดัชนี"""
+        with self._lock:
+            self._terms: Dict[str, int] = {}
+            self._base = _Postings.empty()
+            self._pending: List[_Postings] = []
+            self._pending_count = 0
+            self._keys = np.empty(0, dtype=np.int64)  # key ของแต่ละแถว
+            self._documents = np.empty(0, dtype=np.int32)
+            self._lengths = np.empty(0, dtype=np.int32)  # จำนวนคำของแต่ละแถว
+            self._alive = np.empty(0, dtype=bool)
+            self._rows = 0
+            self._alive_count = 0
+            self._total_length = 0
+            self._last_refresh = 0.0
+            self._last_saved = 0.0
+            self._dirty = False
+            self.is_built = False
+            self._clear_sync_state()
+
+    def _clear_sync_state(self):
+        """ล้างสถานะการ sync กับฐานข้อมูล (คลาสลูก)"""
+
+    def _sync_state(self) -> Dict:
+        """สถานะการ sync ที่บันทึกไปพร้อมดัชนี (คลาสลูก)"""
+        return {}
+
+    def _restore_sync_state(self, meta: Dict):
+        """คืนสถานะการ sync จาก meta ที่โหลดจากดิสก์ (คลาสลูก)"""
+
+    def _count_terms(self, content) -> Counter:
+        """จำนวนครั้งของแต่ละคำในเนื้อหาของแถว"""
+        return Counter(self.tokenizer(content or ""))
+
+    def _reserve(self, extra: int):
+        """ขยาย array ของแถวแบบเพิ่มเท่าตัว (สร้าง array ใหม่ การค้นหาที่ถือ reference เดิมไม่ได้รับผลกระทบ)"""
+        needed = self._rows + extra
+        if needed <= len(self._keys):
+            return
+        capacity = max(1024, 2 * len(self._keys), needed)
+        for name in ("_keys", "_documents", "_lengths", "_alive"):
+            array = getattr(self, name)
+            grown = np.zeros(capacity, dtype=array.dtype)
+            grown[:self._rows] = array[:self._rows]
+            setattr(self, name, grown)
+
+    def add(self, rows: Iterable[Tuple]) -> int:
+        """เพิ่มแถว (key, document_id, content) ส่งคืนจำนวนที่เพิ่ม"""
+        rows = list(rows)
+        if not rows:
+            return 0
+
+        # ตัดคำนอก lock (ส่วนที่ใช้เวลามากที่สุด)
+        tokenized = [(key, document_id, self._count_terms(content)) for key, document_id, content in rows]
+
+        with self._lock:
+            self._reserve(len(tokenized))
+            start, end = self._rows, self._rows + len(tokenized)
+            lengths = [sum(counts.values()) for _, _, counts in tokenized]
+            self._keys[start:end] = [key for key, _, _ in tokenized]
+            self._documents[start:end] = [document_id for _, document_id, _ in tokenized]
+            self._lengths[start:end] = lengths
+            self._alive[start:end] = True
+            self._rows = end
+            self._alive_count += len(tokenized)
+            self._total_length += sum(lengths)
+
+            terms: List[str] = []
+            freqs: List[int] = []
+            for _, _, counts in tokenized:
+                terms.extend(counts.keys())
+                freqs.extend(counts.values())
+            for term in set(terms).difference(self._terms):
+                self._terms[term] = len(self._terms)
+
+            if terms:
+                part = _Postings.from_triples(
+                    np.fromiter(map(self._terms.__getitem__, terms), dtype=np.int32, count=len(terms)),
+                    np.repeat(np.arange(start, end, dtype=np.int32), [len(counts) for _, _, counts in tokenized]),
+                    np.minimum(np.asarray(freqs, dtype=np.int64), 255).astype(np.uint8)
+                )
+                self._pending = self._pending + [part]
+                self._pending_count += len(part)
+            self._dirty = True
+            if self._pending_count >= max(config.embedding.keyword_merge_postings, len(self._base) // 4):
+                self._merge()
+        return len(tokenized)
+
+    def remove(self, keys: Sequence[int]) -> int:
+        """ซ่อนแถวออกจากผลค้นหา (postings ถูกลบจริงตอนรวมครั้งถัดไป)"""
+        if len(keys) == 0:
+            return 0
+        with self._lock:
+            rows = np.flatnonzero(np.isin(self._keys[:self._rows], np.asarray(keys, dtype=np.int64)))
+            rows = rows[self._alive[rows]]
+            if rows.size == 0:
+                return 0
+            alive = self._alive.copy()
+            alive[rows] = False
+            self._alive = alive
+            self._alive_count -= int(rows.size)
+            self._total_length -= int(self._lengths[rows].sum())
+            self._dirty = True
+            if self._rows - self._alive_count > max(1024, self._rows // 5):
+                self._merge()
+            return int(rows.size)
+
+    def _merge(self):
+        """รวม postings ส่วนใหม่เข้า postings หลัก ตัดแถวที่ถูกลบและคำที่ไม่มีแล้ว"""
+        parts = [self._base] + self._pending
+        terms, rows, freqs = (np.concatenate(arrays) for arrays in zip(*(part.triples() for part in parts)))
+
+        alive = self._alive[:self._rows]
+        keep = alive[rows]
+        terms, rows, freqs = terms[keep], rows[keep], freqs[keep]
+        row_map = np.cumsum(alive, dtype=np.int64) - 1
+        rows = row_map[rows].astype(np.int32)
+
+        counts = np.bincount(terms, minlength=len(self._terms))
+        used = counts > 0
+        term_map = np.cumsum(used, dtype=np.int64) - 1
+        terms = term_map[terms]
+        order = np.lexsort((rows, terms))
+
+        names = np.empty(len(self._terms), dtype=object)
+        names[list(self._terms.values())] = list(self._terms.keys())
+        self._terms = {name: i for i, name in enumerate(names[used])}
+        offsets = np.zeros(len(self._terms) + 1, dtype=np.int64)
+        np.cumsum(counts[used], out=offsets[1:])
+        self._base = _Postings(offsets, rows[order], freqs[order])
+        self._pending = []
+        self._pending_count = 0
+
+        kept = np.flatnonzero(alive)
+        self._keys, self._documents, self._lengths = (
+            array[kept].copy() for array in (self._keys, self._documents, self._lengths)
+        )
+        self._alive = np.ones(len(kept), dtype=bool)
+        self._rows = len(kept)
+
+    def score(self, query: str,
+              document_ids: Optional[Sequence[int]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """คะแนน BM25 ของทุกแถวที่มีคำค้นอย่างน้อยหนึ่งคำ ส่งคืน (keys, scores) ไม่เรียงลำดับ
+        document_ids จำกัดผลก่อนรวมคะแนน (idf คำนวณจากทั้งดัชนี)"""
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+        terms = list(dict.fromkeys(self.tokenizer(query)))
+
+        with self._lock:
+            parts = [self._base] + self._pending
+            term_ids = [self._terms[term] for term in terms if term in self._terms]
+            keys, documents, lengths, alive = self._keys, self._documents, self._lengths, self._alive
+            count, total_length = self._alive_count, self._total_length
+        if not term_ids or count == 0:
+            return empty
+
+        k1, b = config.embedding.bm25_k1, config.embedding.bm25_b
+        average_length = max(total_length / count, 1.0)
+        allowed = None if document_ids is None else np.asarray(document_ids, dtype=np.int64)
+
+        found_rows, found_scores = [], []
+        for term_id in term_ids:
+            rows, freqs = (np.concatenate(arrays) for arrays in zip(*(part.lookup(term_id) for part in parts)))
+            rows, freqs = rows[alive[rows]], freqs[alive[rows]]
+            if rows.size == 0:
+                continue
+            idf = math.log(1.0 + (count - rows.size + 0.5) / (rows.size + 0.5))
+            if allowed is not None:
+                inside = np.isin(documents[rows], allowed)
+                rows, freqs = rows[inside], freqs[inside]
+            freqs = freqs.astype(np.float32)
+            norms = k1 * (1.0 - b + b * lengths[rows] / average_length)
+            found_rows.append(rows)
+            found_scores.append(idf * freqs * (k1 + 1.0) / (freqs + norms))
+
+        if not found_rows:
+            return empty
+        # รวมคะแนนด้วย bincount บน array ขนาดเท่าจำนวนแถว (เร็วกว่าการเรียง postings ของทุกคำ)
+        scores = np.bincount(np.concatenate(found_rows), weights=np.concatenate(found_scores),
+                             minlength=len(keys))
+        rows = np.flatnonzero(scores)
+        return keys[rows], scores[rows].astype(np.float32)
+
+    @staticmethod
+    def top(keys: np.ndarray, scores: np.ndarray, k: int, offset: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+        """อันดับที่ offset ถึง offset + k จากผลของ score() เรียงจากมากไปน้อย"""
+        end = min(offset + k, scores.shape[0])
+        if end <= offset:
+            return keys[:0], scores[:0]
+        top = np.argpartition(-scores, end - 1)[:end]
+        top = top[np.argsort(-scores[top], kind="stable")][offset:]
+        return keys[top], scores[top]
+
+    def search(self, query: str, k: int,
+               document_ids: Optional[Sequence[int]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """ค้นหาด้วย BM25 ส่งคืน (keys, scores) k อันดับแรกเรียงจากมากไปน้อย
+        document_ids (เช่นจาก VectorIndex.documents.matching) จำกัดผลก่อนจัดอันดับ"""
+        keys, scores = self.score(query, document_ids)
+        return self.top(keys, scores, k)
+
+    def save(self, force: bool = False) -> bool:
+        """รวม postings แล้วบันทึกลงดิสก์ (ไฟล์ชั่วคราวต่อ process แล้วเปลี่ยนชื่อ)"""
+        with self._lock:
+            if not self.is_built or not self._dirty:
+                return False
+            if not force and time.time() - self._last_saved < config.embedding.keyword_save_interval:
+                return False
+
+            self._merge()
+            base = self._base
+            # แถวใน postings ของแต่ละคำเรียงจากน้อยไปมาก จึงเก็บเป็นผลต่างกับแถวก่อนหน้า (บีบอัดได้ดี)
+            deltas = np.diff(base.rows, prepend=0).astype(np.int64)
+            starts = base.offsets[:-1][np.diff(base.offsets) > 0]
+            deltas[starts] = base.rows[starts]
+            meta = dict(self._sync_state(), signature=self.signature, saved_at=time.time())
+            arrays = {
+                "meta": np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8),
+                "terms": np.frombuffer("\n".join(self._terms).encode("utf-8"), dtype=np.uint8),
+                "offsets": base.offsets,
+                "deltas": deltas.astype(np.uint32),
+                "freqs": base.freqs,
+                "keys": self._keys[:self._rows],
+                "documents": self._documents[:self._rows],
+                "lengths": self._lengths[:self._rows]
+            }
+            rows = self._rows
+
+        os.makedirs(self.folder, exist_ok=True)
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, **arrays)
+        with open(tmp_path, "wb") as f:
+            f.write(buffer.getbuffer())
+        os.replace(tmp_path, self.index_path)
+
+        with self._lock:
+            self._last_saved = time.time()
+            self._dirty = False
+        logger.info(f"บันทึกดัชนีคำ {self.name}: {rows} แถว {len(arrays['offsets']) - 1} คำ "
+                    f"({os.path.getsize(self.index_path) / 1024 / 1024:.1f} MB)")
+        return True
+
+    def load(self) -> bool:
+        """โหลดดัชนีจากดิสก์ (ไม่โหลดถ้าสร้างด้วยตัวตัดคำหรือรูปแบบอื่น)"""
+        if not os.path.exists(self.index_path):
+            return False
+        try:
+            with np.load(self.index_path) as data:
+                meta = json.loads(data["meta"].tobytes().decode("utf-8"))
+                if meta.get("signature") != self.signature:
+                    logger.warning(f"ดัชนีคำ {self.name} บนดิสก์สร้างด้วย {meta.get('signature')} จะสร้างใหม่")
+                    return False
+                terms = data["terms"].tobytes().decode("utf-8")
+                offsets = data["offsets"].astype(np.int64)
+                deltas = data["deltas"].astype(np.int64)
+                freqs = data["freqs"]
+                keys = data["keys"].astype(np.int64)
+                documents = data["documents"].astype(np.int32)
+                lengths = data["lengths"].astype(np.int32)
+        except Exception as e:
+            logger.error(f"ไม่สามารถโหลดดัชนีคำ {self.name} ได้: {e}")
+            return False
+
+        # ถอด delta: ผลรวมสะสมทั้ง array ลบด้วยผลรวมสะสมก่อนจุดเริ่มของแต่ละคำ
+        counts = np.diff(offsets)
+        cumulative = np.cumsum(deltas)
+        before = np.concatenate([[0], cumulative])[offsets[:-1]]
+        rows = (cumulative - np.repeat(before, counts)).astype(np.int32)
+
+        with self._lock:
+            self.clear()
+            self._terms = {term: i for i, term in enumerate(terms.split("\n"))} if terms else {}
+            self._base = _Postings(offsets, rows, freqs)
+            self._keys, self._documents, self._lengths = keys, documents, lengths
+            self._alive = np.ones(len(keys), dtype=bool)
+            self._rows = self._alive_count = len(keys)
+            self._total_length = int(lengths.sum())
+            self._restore_sync_state(meta)
+            self._last_saved = time.time()
+            self.is_built = True
+        logger.info(f"โหลดดัชนีคำ {self.name}: {self._rows} แถว {len(self._terms)} คำ")
+        return True
+
+    def ensure_built(self) -> int:
+        """สร้างดัชนีครั้งแรกที่ถูกใช้งาน แล้ว refresh ตามรอบ"""
+        if not self.is_built:
+            with self._write_lock:
+                if not self.is_built:
+                    self.build_from_database()
+        else:
+            self.refresh()
+        return self._alive_count
+
+    def stats(self) -> Dict[str, int]:
+        """ขนาดดัชนีในหน่วยความจำ"""
+        with self._lock:
+            postings = len(self._base) + self._pending_count
+            return {
+                "rows": self._alive_count,
+                "terms": len(self._terms),
+                "postings": postings,
+                "memory_bytes": int(postings * 5 + self._rows * 17),
+                "tokenizer": self.tokenizer.name
+            }
+
+    @abc.abstractmethod
+    def build_from_database(self) -> int:
+        """สร้างดัชนีใหม่ทั้งหมดจากฐานข้อมูล ส่งคืนจำนวนแถว"""
+
+    @abc.abstractmethod
+    def refresh(self, force: bool = False) -> Tuple[int, int]:
+        """sync แถวที่เพิ่ม/ลบในฐานข้อมูลตั้งแต่ครั้งก่อน ส่งคืน (จำนวนที่เพิ่ม, จำนวนที่ลบ)"""
+
+class KeywordIndex(InvertedIndex):
+    """ดัชนี BM25 ของ document_chunks.content (key = chunk id) sync ด้วย high-water mark และ chunk_deletions
+    รวม chunks ที่ซ้ำกับ chunk หลัก (ข้อความของตัวเอง) ตัวกรองตามเอกสารจึงพบ chunks ของทุกเอกสาร"""
+
+    name = "bm25"
+    version = "-dup"  # ดัชนีเดิมบนดิสก์ไม่มี chunks ที่ซ้ำ ต้องสร้างใหม่
+
+    @property
+    def enabled(self) -> bool:
+        return config.embedding.keyword_index_enabled
+
+    def _clear_sync_state(self):
+        self._high_water = 0  # document_chunks.id สูงสุดที่ sync แล้ว
+        self._deletion_high_water = 0  # chunk_deletions.id สูงสุดที่นำไปลบแล้ว
+
+    def _sync_state(self) -> Dict:
+        return {"high_water": self._high_water, "deletion_high_water": self._deletion_high_water}
+
+    def _restore_sync_state(self, meta: Dict):
+        self._high_water = int(meta.get("high_water", 0))
+        self._deletion_high_water = int(meta.get("deletion_high_water", 0))
+
+    @staticmethod
+    def _iter_database_rows(chunk_ids: Optional[np.ndarray] = None,
+                            batch_size: int = 2000) -> Iterable[List[Tuple[int, int, str]]]:
+        """ดึง (chunk_id, document_id, content) ของเอกสารที่ประมวลผลแล้วทีละ batch ตามลำดับ id"""
+        base_query = """
+            SELECT dc.id, dc.document_id, dc.content
+            FROM document_chunks dc
+            JOIN documents d ON dc.document_id = d.id
+            WHERE d.is_processed = TRUE
+        """
+        if chunk_ids is not None:
+            for start in range(0, len(chunk_ids), batch_size):
+                batch = [int(chunk_id) for chunk_id in chunk_ids[start:start + batch_size]]
+                placeholders = ",".join(f":id_{i}" for i in range(len(batch)))
+                params = {f"id_{i}": chunk_id for i, chunk_id in enumerate(batch)}
+                with get_db_session() as session:
+                    rows = session.execute(
+                        text(base_query + f" AND dc.id IN ({placeholders}) ORDER BY dc.id"), params
+                    ).fetchall()
+                yield [(row.id, row.document_id, row.content) for row in rows]
+            return
+
+        last_id = 0
+        while True:
+            with get_db_session() as session:
+                rows = session.execute(
+                    text(base_query + " AND dc.id > :last_id ORDER BY dc.id LIMIT :limit"),
+                    {"last_id": last_id, "limit": batch_size}
+                ).fetchall()
+            if not rows:
+                return
+            yield [(row.id, row.document_id, row.content) for row in rows]
+            last_id = rows[-1].id
+
+    @staticmethod
+    def _fetch_indexable_ids(after_id: int = 0) -> np.ndarray:
+        with get_db_session() as session:
+            rows = session.execute(text("""
+                SELECT dc.id
+                FROM document_chunks dc
+                JOIN documents d ON dc.document_id = d.id
+                WHERE d.is_processed = TRUE AND dc.id > :after_id
+            """), {"after_id": after_id}).fetchall()
+        return np.fromiter((row.id for row in rows), dtype=np.int64, count=len(rows))
+
+    @staticmethod
+    def _fetch_deletions(after_id: int) -> List[Tuple[int, int]]:
+        """(id, chunk_id) ของบันทึกการลบ chunk_id = -1 เมื่อ chunk ยังอยู่ (ถูกรวมเป็น chunk ที่ซ้ำ ยังค้นหาด้วยคำได้)"""
+        with get_db_session() as session:
+            return [
+                (row.id, -1 if row.alive else row.chunk_id) for row in session.execute(text("""
+                    SELECT cd.id, cd.chunk_id, dc.id AS alive
+                    FROM chunk_deletions cd
+                    LEFT JOIN document_chunks dc ON dc.id = cd.chunk_id
+                    WHERE cd.id > :after_id
+                    ORDER BY cd.id
+                """), {"after_id": after_id}).fetchall()
+            ]
+
+    def build_from_database(self) -> int:
+        """โหลดดัชนีจากดิสก์แล้ว sync ส่วนที่เปลี่ยน หรือสร้างใหม่จาก document_chunks ทั้งหมด"""
+        with self._write_lock:
+            if self.load():
+                self.refresh(force=True)
+                return self._alive_count
+
+            self.clear()
+            with get_db_session() as session:
+                # อ่านก่อนดึงข้อมูล: การลบที่เกิดระหว่างสร้างดัชนีจะถูกนำไปใช้ซ้ำใน refresh (ไม่มีผลเสีย)
+                deletion_high_water = session.execute(
+                    text("SELECT COALESCE(MAX(id), 0) FROM chunk_deletions")
+                ).scalar() or 0
+
+            for rows in self._iter_database_rows():
+                self.add(rows)
+                self._high_water = max(self._high_water, rows[-1][0])
+            self._deletion_high_water = deletion_high_water
+            self._last_refresh = time.monotonic()
+            self.is_built = True
+            self._dirty = True
+            self.save(force=True)
+            logger.info(f"สร้างดัชนีคำเรียบร้อย: {self._alive_count} chunks {len(self._terms)} คำ")
+            return self._alive_count
+
+    def refresh(self, force: bool = False) -> Tuple[int, int]:
+        """sync เฉพาะ chunks ที่เพิ่ม/ลบตั้งแต่ครั้งก่อน (เว้นช่วงตาม index_refresh_interval) ส่งคืน (เพิ่ม, ลบ)
+        อ่านฐานข้อมูลและตัดคำโดยไม่ถือ lock ของการค้นหา (ผู้เรียกที่ไม่ force ข้ามถ้ามี refresh อื่นกำลังทำงาน)"""
+        if not self.is_built or not self._write_lock.acquire(blocking=force):
+            return 0, 0
+        try:
+            now = time.monotonic()
+            if not force and now - self._last_refresh < config.embedding.index_refresh_interval:
+                return 0, 0
+            self._last_refresh = now
+
+            deletions = self._fetch_deletions(self._deletion_high_water)
+            removed_ids = np.asarray([chunk_id for _, chunk_id in deletions if chunk_id >= 0], dtype=np.int64)
+            if deletions:
+                self.remove(removed_ids)
+                self._deletion_high_water = deletions[-1][0]
+
+            # chunks ใหม่: ตรวจย้อนหลังเล็กน้อยเผื่อ transaction ที่ได้ id น้อยกว่าแต่ commit ทีหลัง
+            low_id = max(0, self._high_water - config.embedding.index_refresh_lookback)
+            candidate_ids = self._fetch_indexable_ids(low_id)
+            with self._lock:
+                held = self._keys[:self._rows]
+                held = held[self._alive[:self._rows] & (held > low_id)]
+            new_ids = np.setdiff1d(candidate_ids, held)
+            new_ids = new_ids[~np.isin(new_ids, removed_ids)]
+
+            # add() ตัดคำก่อนแล้วถือ _lock เฉพาะตอนรวม postings
+            added = 0
+            for rows in self._iter_database_rows(new_ids):
+                added += self.add(rows)
+            if candidate_ids.size:
+                self._high_water = max(self._high_water, int(candidate_ids.max()))
+
+            if added or deletions:
+                self._dirty = True
+                logger.info(f"refresh ดัชนีคำ: เพิ่ม {added} ลบ {len(deletions)} chunks")
+                self.save()
+            return added, len(deletions)
+        finally:
+            self._write_lock.release()
+
+# สร้าง instance หลัก
+keyword_index = KeywordIndex()
+
+# บันทึกส่วนที่ยังไม่ได้เขียนลงดิสก์เมื่อปิดแอปพลิเคชัน
+atexit.register(keyword_index.save, True)
@@ -0,0 +1,112 @@
+"""
+สร้าง embeddings ใน process ด้วย sentence-transformers บน CPU (แทนการเรียก Ollama ผ่าน HTTP)
+รองรับ torch, ONNX และ ONNX แบบ int8 (dynamic quantization ครั้งแรกแล้วเก็บไว้ใน embeddings_folder)
+"""
+
+import glob
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Sequence
+
+from config import config
+from services.embedding_store import model_slug
+
+logger = logging.getLogger(__name__)
+
+RUNTIMES = ("torch", "onnx", "onnx-int8")
+
+class LocalEmbeddingBackend:
+    """โหลดโมเดล sentence-transformers ครั้งแรกที่ใช้ (แยกตามชื่อโมเดล) และเข้ารหัสเป็น batch"""
+
+    def __init__(self):
+        self._models: Dict[str, object] = {}
+        self._load_lock = threading.Lock()
+        # torch/onnxruntime ใช้ทุก thread ที่ตั้งไว้อยู่แล้ว การเข้ารหัสพร้อมกันหลายงานมีแต่แย่ง CPU กัน
+        self._encode_lock = threading.Lock()
+
+    @staticmethod
+    def handles(model: str) -> bool:
+        """โมเดลนี้สร้าง embeddings ใน process หรือไม่"""
+        return config.embedding.backend == "local" or model in config.embedding.local_models
+
+    @staticmethod
+    def _onnx_options() -> dict:
+        """session options ของ onnxruntime (จำนวน thread)"""
+        if config.embedding.local_threads <= 0:
+            return {}
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = config.embedding.local_threads
+        return {"session_options": options}
+
+    def _load_int8(self, SentenceTransformer, model: str):
+        """โหลดโมเดล ONNX int8 จากโฟลเดอร์ที่ quantize ไว้แล้ว (ครั้งแรก: export จากโมเดล ONNX ปกติ)"""
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+
+        folder = os.path.join(config.app.embeddings_folder, "onnx", model_slug(model))
+        pattern = os.path.join(folder, "onnx", f"model_*int8_{config.embedding.local_int8_config}.onnx")
+        if not glob.glob(pattern):
+            logger.info(f"quantize โมเดล {model} เป็น int8 ({config.embedding.local_int8_config}) ไปที่ {folder}")
+            source = SentenceTransformer(model, device="cpu", backend="onnx",
+                                         trust_remote_code=config.embedding.local_trust_remote_code)
+            source.save_pretrained(folder)
+            export_dynamic_quantized_onnx_model(source, config.embedding.local_int8_config, folder)
+
+        file_name = os.path.relpath(sorted(glob.glob(pattern))[0], folder)
+        return SentenceTransformer(folder, device="cpu", backend="onnx",
+                                   trust_remote_code=config.embedding.local_trust_remote_code,
+                                   model_kwargs={"file_name": file_name, **self._onnx_options()})
+
+    def _load(self, model: str):
+        with self._load_lock:
+            if model in self._models:
+                return self._models[model]
+
+            # sentence-transformers/torch เป็น dependency หนัก import เมื่อใช้ backend นี้เท่านั้น
+            from sentence_transformers import SentenceTransformer
+
+            runtime = config.embedding.local_runtime
+            if runtime not in RUNTIMES:
+                raise ValueError(f"local_runtime ต้องเป็นหนึ่งใน {RUNTIMES} (ได้ {runtime})")
+
+            if runtime == "torch":
+                if config.embedding.local_threads > 0:
+                    import torch
+                    torch.set_num_threads(config.embedding.local_threads)
+                encoder = SentenceTransformer(model, device="cpu",
+                                              trust_remote_code=config.embedding.local_trust_remote_code)
+            elif runtime == "onnx":
+                encoder = SentenceTransformer(model, device="cpu", backend="onnx",
+                                              trust_remote_code=config.embedding.local_trust_remote_code,
+                                              model_kwargs=self._onnx_options())
+            else:
+                encoder = self._load_int8(SentenceTransformer, model)
+
+            if config.embedding.local_max_seq_length:
+                encoder.max_seq_length = config.embedding.local_max_seq_length
+            logger.info(f"โหลดโมเดล embedding {model} ใน process ({runtime}, "
+                        f"{encoder.get_sentence_embedding_dimension()} มิติ)")
+            self._models[model] = encoder
+            return encoder
+
+    def encode(self, texts: Sequence[str], model: str) -> List[Optional[List[float]]]:
+        """เข้ารหัส texts เป็น batch ตาม local_batch_size (ล้มเหลว = None ทุกรายการ)"""
+        try:
+            encoder = self._models.get(model) or self._load(model)
+            with self._encode_lock:
+                vectors = encoder.encode(
+                    list(texts),
+                    batch_size=config.embedding.local_batch_size,
+                    convert_to_numpy=True,
+                    show_progress_bar=False
+                )
+            return vectors.tolist()
+        except ImportError as e:
+            logger.error(f"ไม่สามารถใช้ backend local ได้ (ต้องติดตั้ง sentence-transformers และ optimum[onnxruntime] สำหรับ ONNX): {e}")
+        except Exception as e:
+            logger.error(f"เกิดข้อผิดพลาดในการสร้าง embedding ด้วยโมเดล {model} ใน process: {e}")
+        return [None] * len(texts)
+
+# สร้าง instance หลัก (โมเดลที่โหลดแล้วใช้ร่วมกันทั้ง process)
+local_embedding_backend = LocalEmbeddingBackend()
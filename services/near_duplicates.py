@@ -0,0 +1,348 @@
+"""
+ตรวจจับ chunks ที่ซ้ำกัน (รายงานประจำเดือน แบบฟอร์มที่สแกนซ้ำ จดหมายจากแม่แบบ): SimHash 64 บิตใช้คัด candidate
+แล้วรวมเฉพาะ chunks ที่ข้อความ (normalize แล้ว) ตรงกันทุกตัวอักษร chunks จากแม่แบบเดียวกันที่ต่างกันแค่เลขที่แบบฟอร์ม
+หรือตัวเลขจึงไม่ถูกรวม
+chunk ที่ซ้ำกับ chunk หลัก (canonical) ในขอบเขตเดียวกัน (ผู้อัพโหลด การเผยแพร่ หมวดหมู่) ไม่ต้องเรียก embedding API
+และไม่อยู่ในดัชนี vector (ใช้ vector ของ chunk หลัก) แต่ยังอยู่ในดัชนีคำด้วยข้อความของตัวเอง
+
+ตัวอย่าง:
+    python -m services.near_duplicates report
+    python -m services.near_duplicates collapse     # คำนวณลายเซ็นของ chunks เดิมและรวม chunks ที่ซ้ำ
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import bindparam, text
+
+from config import config
+from database.database import get_db_session
+from database.models import ChunkDeletion, Document, DocumentChunk
+from services.embedding_cache import normalize_text
+from services.keyword_index import KeywordTokenizer
+
+logger = logging.getLogger(__name__)
+
+SIMHASH_BITS = 64
+_BIT_SHIFTS = np.arange(SIMHASH_BITS, dtype=np.uint64)
+
+# ลายเซ็นต้องเหมือนกันทุก process จึงใช้ bigram เสมอ (ไม่ขึ้นกับการติดตั้ง pythainlp)
+_tokenizer = KeywordTokenizer("bigram")
+
+def simhash(content: str) -> int:
+    """ลายเซ็น SimHash ของข้อความจาก shingle 2 คำติดกัน (int64 แบบมีเครื่องหมายสำหรับคอลัมน์ BIGINT)"""
+    tokens = _tokenizer(content)
+    features = Counter(map(" ".join, zip(tokens, tokens[1:]))) or Counter(tokens)
+    if not features:
+        return 0
+
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+         for feature in features),
+        dtype=np.uint64, count=len(features)
+    )
+    weights = np.fromiter(features.values(), dtype=np.float64, count=len(features))
+    bits = ((hashes[:, None] >> _BIT_SHIFTS) & np.uint64(1)).astype(bool)
+    totals = np.where(bits, weights[:, None], -weights[:, None]).sum(axis=0)
+    signature = sum(1 << int(bit) for bit in np.flatnonzero(totals > 0))
+    return signature - (1 << SIMHASH_BITS) if signature >= 1 << (SIMHASH_BITS - 1) else signature
+
+def _popcount(values: np.ndarray) -> np.ndarray:
+    """จำนวนบิตที่เป็น 1 ของแต่ละค่า uint64"""
+    if hasattr(np, "bitwise_count"):  # numpy >= 2.0
+        return np.bitwise_count(values)
+    return np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+def _as_unsigned(signatures) -> np.ndarray:
+    return np.asarray(signatures, dtype=np.int64).view(np.uint64)
+
+def max_distance() -> int:
+    """จำนวนบิตที่ต่างกันได้สูงสุดตาม dedup_threshold"""
+    return max(0, int((1.0 - config.embedding.dedup_threshold) * SIMHASH_BITS))
+
+def nearest(signatures: Sequence[int], candidate_ids: np.ndarray, candidate_signatures: np.ndarray,
+            distance: int) -> np.ndarray:
+    """chunk id ของ candidate ที่ใกล้ที่สุด (ต่างกันไม่เกิน distance บิต) ของแต่ละลายเซ็น (-1 = ไม่ซ้ำ)
+    แบ่ง 64 บิตเป็น distance + 1 ช่วง: ลายเซ็นที่ต่างกันไม่เกิน distance บิตต้องมีอย่างน้อยหนึ่งช่วงที่เหมือนกันทุกบิต"""
+    queries = _as_unsigned(signatures)
+    candidates = _as_unsigned(candidate_signatures)
+    best = np.full(len(queries), -1, dtype=np.int64)
+    best_distance = np.full(len(queries), distance + 1, dtype=np.int64)
+    if not len(queries) or not len(candidates):
+        return best
+
+    bands = distance + 1
+    width = SIMHASH_BITS // bands
+    for band in range(bands):
+        shift = np.uint64(band * width)
+        bits = SIMHASH_BITS - band * width if band == bands - 1 else width
+        mask = np.uint64((1 << bits) - 1)
+        keys = (candidates >> shift) & mask
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        query_keys = (queries >> shift) & mask
+        left = np.searchsorted(sorted_keys, query_keys, side="left")
+        right = np.searchsorted(sorted_keys, query_keys, side="right")
+
+        for i in np.flatnonzero(right > left):
+            rows = order[left[i]:right[i]]
+            distances = _popcount(candidates[rows] ^ queries[i])
+            j = int(np.argmin(distances))
+            if distances[j] < best_distance[i]:
+                best_distance[i] = distances[j]
+                best[i] = rows[j]
+
+    found = best >= 0
+    best[found] = np.asarray(candidate_ids, dtype=np.int64)[best[found]]
+    return best
+
+def group(contents: Sequence[str]) -> np.ndarray:
+    """จัดกลุ่มข้อความที่ตรงกัน (normalize แล้ว) ภายในชุดเดียวกัน ส่งคืนตำแหน่งของตัวแทนกลุ่ม (ตัวแรกที่พบ) ของแต่ละรายการ"""
+    first: Dict[str, int] = {}
+    return np.fromiter(
+        (first.setdefault(normalize_text(content), i) for i, content in enumerate(contents)),
+        dtype=np.int64, count=len(contents)
+    )
+
+class NearDuplicateDetector:
+    """หา chunk หลักของ chunks ใหม่จากลายเซ็นของ chunks ที่บันทึกแล้วในขอบเขตเดียวกัน"""
+
+    @property
+    def enabled(self) -> bool:
+        return config.embedding.dedup_enabled
+
+    @staticmethod
+    def _fetch_candidates(uploaded_by: int, is_public: bool, category: Optional[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """(chunk ids, ลายเซ็น) ของ chunks หลักในขอบเขตเดียวกัน (ผลการค้นหาที่กรองตามสิทธิ์/หมวดหมู่จึงยังพบ chunk หลัก)"""
+        with get_db_session() as session:
+            rows = session.execute(text("""
+                SELECT dc.id, dc.simhash
+                FROM document_chunks dc
+                JOIN documents d ON dc.document_id = d.id
+                WHERE dc.simhash IS NOT NULL AND dc.canonical_chunk_id IS NULL
+                AND d.uploaded_by = :uploaded_by AND d.is_public = :is_public
+                AND COALESCE(d.category, '') = :category
+                ORDER BY dc.id
+            """), {"uploaded_by": uploaded_by, "is_public": bool(is_public), "category": category or ""}).fetchall()
+        ids = np.fromiter((row.id for row in rows), dtype=np.int64, count=len(rows))
+        signatures = np.fromiter((row.simhash for row in rows), dtype=np.int64, count=len(rows))
+        return ids, signatures
+
+    @staticmethod
+    def verify(contents: Sequence[str], matches: np.ndarray) -> np.ndarray:
+        """ยืนยัน candidate จาก SimHash ด้วยข้อความจริง: ข้อความที่ไม่ตรงกับ chunk หลักจะกลายเป็น -1"""
+        matched = np.flatnonzero(matches >= 0)
+        if not matched.size:
+            return matches
+        with get_db_session() as session:
+            originals = {
+                row.id: row.content for row in session.query(DocumentChunk.id, DocumentChunk.content).filter(
+                    DocumentChunk.id.in_({int(matches[i]) for i in matched})
+                ).all()
+            }
+        verified = matches.copy()
+        for i in matched:
+            original = originals.get(int(matches[i]))
+            if original is None or normalize_text(original) != normalize_text(contents[i]):
+                verified[i] = -1
+        return verified
+
+    def assign(self, document, contents: Sequence[str], signatures: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """ส่งคืน (chunk id หลักที่บันทึกแล้ว หรือ -1, ตำแหน่งของตัวแทนภายในชุดนี้) ของแต่ละ chunk
+        รายการที่ต้องสร้าง embedding คือรายการที่ไม่ซ้ำกับที่บันทึกแล้วและเป็นตัวแทนของตัวเอง"""
+        candidate_ids, candidate_signatures = self._fetch_candidates(
+            document.uploaded_by, document.is_public, document.category
+        )
+        existing = self.verify(contents, nearest(signatures, candidate_ids, candidate_signatures, max_distance()))
+
+        leaders = np.arange(len(signatures))
+        fresh = np.flatnonzero(existing < 0)
+        if fresh.size:
+            leaders[fresh] = fresh[group([contents[i] for i in fresh])]
+        return existing, leaders
+
+    @staticmethod
+    def fetch_vectors(chunk_ids: Sequence[int]) -> Dict[int, Any]:
+        """embedding ของ chunks หลัก (คัดลอกให้ chunks ที่ซ้ำ ใช้เมื่อถูกยกขึ้นเป็น chunk หลักแทน)"""
+        if not len(chunk_ids):
+            return {}
+        with get_db_session() as session:
+            rows = session.query(
+                DocumentChunk.id, DocumentChunk.embedding_vector, DocumentChunk.embedding_model
+            ).filter(DocumentChunk.id.in_([int(chunk_id) for chunk_id in chunk_ids])).all()
+        return {row.id: row for row in rows}
+
+    @staticmethod
+    def promote(session, chunk_ids: Sequence[int]) -> List[Dict[str, Any]]:
+        """chunks ที่อ้างถึง chunk หลักที่ถูกลบ: chunk แรกของแต่ละกลุ่มถูกเพิ่มใหม่เป็น chunk หลัก
+        (ได้ id ใหม่ ดัชนีจึงดึงเข้าตาม high-water mark ตามปกติ) ที่เหลืออ้างถึง chunk นั้นแทน ส่งคืนแถวที่ยกขึ้น"""
+        if not chunk_ids:
+            return []
+        table = DocumentChunk.__table__
+        rows = session.execute(
+            table.select().where(table.c.canonical_chunk_id.in_(list(chunk_ids))).order_by(table.c.id)
+        ).mappings().all()
+
+        groups: Dict[int, List[Dict[str, Any]]] = {}
+        for row in rows:
+            groups.setdefault(row["canonical_chunk_id"], []).append(dict(row))
+
+        promoted = []
+        for members in groups.values():
+            first = members[0]
+            # ลบก่อนเพิ่ม: (document_id, chunk_index) เป็น unique
+            session.execute(table.delete().where(table.c.id == first["id"]))
+            values = {key: value for key, value in first.items() if key != "id"}
+            values["canonical_chunk_id"] = None
+            new_id = session.execute(table.insert().values(**values)).inserted_primary_key[0]
+            # id เดิมอยู่ในดัชนีคำ: บันทึกการลบให้ทุก process นำออก (chunk ที่ยกขึ้นเข้าดัชนีด้วย id ใหม่)
+            session.add(ChunkDeletion(chunk_id=first["id"], document_id=first["document_id"]))
+            rest = [member["id"] for member in members[1:]]
+            if rest:
+                session.execute(table.update().where(table.c.id.in_(rest)).values(canonical_chunk_id=new_id))
+            promoted.append({**values, "id": new_id})
+
+        # chunk หลักของเอกสารเหล่านี้เปลี่ยน: ให้ DocumentAttributes ของทุก process sync chunks ที่ซ้ำใหม่
+        touched = {member["document_id"] for members in groups.values() for member in members}
+        if touched:
+            session.query(Document).filter(Document.id.in_(touched)).update(
+                {Document.updated_at: datetime.utcnow()}, synchronize_session=False
+            )
+        return promoted
+
+    def collapse_existing(self, batch_size: int = 2000) -> Dict[str, int]:
+        """คำนวณลายเซ็นของ chunks เดิมที่ยังไม่มี แล้วรวม chunks ที่ซ้ำกับ chunk หลักในขอบเขตเดียวกัน
+        (chunks ที่ถูกรวมถูกบันทึกใน chunk_deletions ให้ทุก process นำออกจากดัชนี, รันซ้ำได้)"""
+        distance = max_distance()
+        signed = collapsed = 0
+        last_id = 0
+        while True:
+            with get_db_session() as session:
+                rows = session.execute(text("""
+                    SELECT dc.id, dc.document_id, dc.content, d.uploaded_by, d.is_public, d.category
+                    FROM document_chunks dc
+                    JOIN documents d ON dc.document_id = d.id
+                    WHERE dc.simhash IS NULL AND dc.canonical_chunk_id IS NULL AND dc.id > :last_id
+                    ORDER BY dc.id
+                    LIMIT :limit
+                """), {"last_id": last_id, "limit": batch_size}).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            scopes: Dict[Tuple, List] = {}
+            for row in rows:
+                scopes.setdefault((row.uploaded_by, bool(row.is_public), row.category or ""), []).append(row)
+
+            signatures: Dict[int, int] = {}
+            canonical: Dict[int, int] = {}
+            for scope, members in scopes.items():
+                contents = [row.content for row in members]
+                values = [simhash(content) for content in contents]
+                candidate_ids, candidate_signatures = self._fetch_candidates(*scope)
+                existing = self.verify(contents, nearest(values, candidate_ids, candidate_signatures, distance))
+                fresh = np.flatnonzero(existing < 0)
+                leaders = fresh[group([contents[i] for i in fresh])] if fresh.size else fresh
+                for i, row in enumerate(members):
+                    signatures[row.id] = values[i]
+                    if existing[i] >= 0:
+                        canonical[row.id] = int(existing[i])
+                for i, leader in zip(fresh, leaders):
+                    if leader != i:
+                        canonical[members[i].id] = members[leader].id
+
+            document_ids = {row.id: row.document_id for row in rows}
+            table = DocumentChunk.__table__
+            with get_db_session() as session:
+                session.execute(
+                    table.update().where(table.c.id == bindparam("chunk_id")).values(simhash=bindparam("signature")),
+                    [{"chunk_id": chunk_id, "signature": signature} for chunk_id, signature in signatures.items()]
+                )
+                if canonical:
+                    session.execute(
+                        table.update().where(table.c.id == bindparam("chunk_id")).values(canonical_chunk_id=bindparam("canonical")),
+                        [{"chunk_id": chunk_id, "canonical": target} for chunk_id, target in canonical.items()]
+                    )
+                    session.bulk_insert_mappings(ChunkDeletion, [
+                        {"chunk_id": chunk_id, "document_id": document_ids[chunk_id], "deleted_at": datetime.utcnow()}
+                        for chunk_id in canonical
+                    ])
+                    # chunks ในดัชนีของเอกสารเหล่านี้เปลี่ยน: ให้ worker คำนวณ vector ระดับเอกสารใหม่
+                    session.query(Document).filter(
+                        Document.id.in_({document_ids[chunk_id] for chunk_id in canonical})
+                    ).update({Document.summary_model: None}, synchronize_session=False)
+                session.commit()
+
+            signed += len(signatures)
+            collapsed += len(canonical)
+            logger.info(f"คำนวณลายเซ็น {signed} chunks รวม chunks ที่ซ้ำแล้ว {collapsed} (ถึง chunk {last_id})")
+
+        return {"signed": signed, "collapsed": collapsed}
+
+    @staticmethod
+    def report(top: int = 10) -> Dict[str, Any]:
+        """จำนวน chunks ที่ซ้ำ และพื้นที่/การเรียก embedding ที่ประหยัดได้"""
+        with get_db_session() as session:
+            counts = session.execute(text("""
+                SELECT COUNT(*) AS total,
+                       COALESCE(SUM(CASE WHEN simhash IS NOT NULL THEN 1 ELSE 0 END), 0) AS signed,
+                       COALESCE(SUM(CASE WHEN canonical_chunk_id IS NOT NULL THEN 1 ELSE 0 END), 0) AS duplicates,
+                       AVG(CASE WHEN canonical_chunk_id IS NULL THEN LENGTH(embedding_vector) END) AS vector_bytes
+                FROM document_chunks
+            """)).first()
+            largest = session.execute(text("""
+                SELECT canonical_chunk_id, COUNT(*) AS copies
+                FROM document_chunks
+                WHERE canonical_chunk_id IS NOT NULL
+                GROUP BY canonical_chunk_id
+                ORDER BY copies DESC
+                LIMIT :top
+            """), {"top": top}).fetchall() if top else []
+
+        total, duplicates = int(counts.total), int(counts.duplicates)
+        vector_bytes = float(counts.vector_bytes or 0)
+        return {
+            "chunks": total,
+            "signed_chunks": int(counts.signed),
+            "duplicate_chunks": duplicates,
+            "duplicate_ratio": duplicates / total if total else 0.0,
+            "indexed_chunks": total - duplicates,
+            # ดัชนี vector และ ANN ในหน่วยความจำไม่มีแถวของ chunks ที่ซ้ำ
+            "index_vector_bytes_saved": int(duplicates * vector_bytes),
+            # chunks ที่ซ้ำตอนนำเข้าไม่เรียก embedding API และไม่ต้องสร้างใหม่เมื่อเปลี่ยนโมเดล
+            "embedding_calls_saved": duplicates,
+            "largest_groups": [
+                {"canonical_chunk_id": row.canonical_chunk_id, "copies": int(row.copies)} for row in largest
+            ],
+            "threshold": config.embedding.dedup_threshold,
+            "max_hamming_distance": max_distance()
+        }
+
+# สร้าง instance หลัก
+near_duplicate_detector = NearDuplicateDetector()
+
+def main():
+    parser = argparse.ArgumentParser(description="ตรวจจับและรวม chunks ที่เกือบซ้ำกัน")
+    parser.add_argument("command", choices=["report", "collapse"])
+    parser.add_argument("--batch-size", type=int, default=2000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    from database.database import init_database, run_migrations
+    init_database()
+    run_migrations()
+
+    if args.command == "collapse":
+        result = near_duplicate_detector.collapse_existing(args.batch_size)
+        logger.info(f"คำนวณลายเซ็น {result['signed']} chunks รวม {result['collapsed']} chunks ที่ซ้ำ")
+    print(json.dumps(near_duplicate_detector.report(), ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
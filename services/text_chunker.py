@@ -0,0 +1,353 @@
+"""
+การแบ่งข้อความเป็น chunks แบบ streaming
+รับข้อความเป็นลำดับของส่วนย่อย (เช่นทีละหน้า) และส่ง chunks ออกเป็น generator
+จุดตัดหาจากตาราง offset ที่คำนวณครั้งเดียวต่อ buffer (numpy บนรหัสตัวอักษร) แล้วค้นด้วย bisect (ไม่วนทีละตัวอักษร)
+"""
+
+import logging
+import os
+import re
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# เครื่องหมายหน้า/สไลด์/แผ่นงานที่ utils/file_handler.py ใส่ไว้ในข้อความที่สกัด
+PAGE_MARKER = re.compile(r"--- (?:หน้า|สไลด์) (\d+) ---$", re.MULTILINE)
+
+# หัวข้อหน้า/สไลด์/แผ่นงาน/ตาราง (ขึ้นต้นด้วย literal จึงค้นได้เร็ว)
+SECTION_MARKER = re.compile(r"\n--- [^\n]{1,60} ---$", re.MULTILINE)
+
+# ระดับของจุดตัดเรียงตามลำดับความสำคัญ
+TIER_SECTION, TIER_PARAGRAPH, TIER_SENTENCE, TIER_SPACE = range(4)
+
+# ตารางประเภทตัวอักษร (bit flags) สำหรับรหัส 0-0xFFFF: lookup ครั้งเดียวต่อ buffer แทนการเทียบทีละชุด
+SPACE, HSPACE, NEWLINE, SENTENCE_END, THAI = 1, 2, 4, 8, 16
+CHAR_CLASS = np.zeros(0x10000, dtype=np.uint8)
+CHAR_CLASS[[0x09, 0x0A, 0x0B, 0x0C, 0x0D, 0x20, 0xA0, 0x200B, 0x3000]] |= SPACE  # 0x200B: zero-width space ที่ใช้คั่นคำไทย
+CHAR_CLASS[[0x09, 0x20, 0xA0, 0x3000]] |= HSPACE
+CHAR_CLASS[0x0A] |= NEWLINE
+CHAR_CLASS[[ord(c) for c in ".!?\u0964\u2026"]] |= SENTENCE_END
+CHAR_CLASS[0x0E00:0x0E80] |= THAI
+
+# สระ/วรรณยุกต์ไทยที่ต้องอยู่กับพยัญชนะก่อนหน้า และสระหน้าที่ต้องอยู่กับพยัญชนะถัดไป (ห้ามตัดคั่นกลาง)
+THAI_COMBINING = {"\u0E31"} | {chr(c) for c in range(0x0E34, 0x0E3B)} | {chr(c) for c in range(0x0E47, 0x0E4F)}
+THAI_LEADING = {chr(c) for c in range(0x0E40, 0x0E45)}
+
+@dataclass
+class Chunk:
+    """chunk หนึ่งชิ้นพร้อมตำแหน่งในข้อความต้นฉบับ"""
+    index: int
+    text: str
+    start_char: int
+    end_char: int
+    page_number: Optional[int] = None
+
+def iter_segments(text: str, size: int = 65536) -> Iterator[str]:
+    """แบ่งข้อความที่อยู่ในหน่วยความจำแล้วเป็นส่วนละไม่เกิน size ตัวอักษร (buffer ของ chunker จึงไม่โตตามเอกสาร)"""
+    for start in range(0, len(text), size):
+        yield text[start:start + size]
+
+class TextChunker:
+    """แบ่งข้อความเป็น chunks ขนาดไม่เกิน chunk_size ตัวอักษร ซ้อนกัน overlap ตัวอักษร"""
+
+    version = "stream-v1"  # เปลี่ยนเมื่อกฎการตัดเปลี่ยน (chunks เดิมในฐานข้อมูลจะถูกสร้างใหม่)
+
+    def __init__(self, chunk_size: int = None, overlap: int = None, min_fill: float = 0.5):
+        self.chunk_size = chunk_size or config.embedding.chunk_size
+        self.overlap = config.embedding.chunk_overlap if overlap is None else overlap
+        if self.overlap >= self.chunk_size:
+            raise ValueError("chunk_overlap ต้องน้อยกว่า chunk_size")
+        self.min_fill = min_fill
+        # buffer ต้องยาวกว่า chunk หลายเท่า ส่วนที่ต้องสแกนซ้ำตอนเติม buffer จึงน้อยเมื่อเทียบกับทั้งหมด
+        self.window = max(self.chunk_size * 32, 16384)
+
+    def chunk_text(self, text: str) -> List[str]:
+        """แบ่งข้อความทั้งก้อนเป็น list ของข้อความ"""
+        return [chunk.text for chunk in self.chunks(iter_segments(text))]
+
+    def chunks(self, segments: Iterable[str]) -> Iterator[Chunk]:
+        """แบ่งข้อความจากลำดับของส่วนย่อย ส่งคืน Chunk ทีละชิ้น (ตำแหน่งนับจากต้นข้อความที่ต่อกันแล้ว)"""
+        segments = iter(segments)
+        buffer = ""
+        base = 0  # ตำแหน่งของ buffer[0] ในข้อความทั้งหมด
+        start = 0  # จุดเริ่ม chunk ถัดไปใน buffer
+        index = 0
+        pages: List[Tuple[int, int]] = []  # (ตำแหน่ง, เลขหน้า) เรียงตามตำแหน่ง
+        exhausted = False
+
+        while True:
+            # ตัดส่วนที่ใช้แล้วทิ้งและเติม buffer ให้ยาวพอ
+            parts = [buffer[start:]]
+            length = len(parts[0])
+            base += start
+            start = 0
+            while not exhausted and length < self.window:
+                segment = next(segments, None)
+                if segment is None:
+                    exhausted = True
+                    break
+                parts.append(segment)
+                length += len(segment)
+            buffer = "".join(parts)
+
+            tables = self._boundary_tables(buffer)
+            for section in tables[TIER_SECTION]:
+                section += buffer[section] == "\n"
+                match = PAGE_MARKER.match(buffer, section)
+                if match and (not pages or base + section > pages[-1][0]):
+                    pages.append((base + section, int(match.group(1))))
+            spaces = tables[TIER_SPACE]
+            self._prepare(buffer)
+
+            # chunk ที่ยังไม่ถึงท้าย buffer ตัดได้เลย ส่วนท้ายรอข้อความถัดไป (ยกเว้นข้อความหมดแล้ว)
+            while start < len(buffer) and (exhausted or self._has_room(buffer, start)):
+                end, tier = self._find_end(buffer, start, tables)
+                chunk = self._make_chunk(buffer, start, end, base, index, pages)
+                if chunk is not None:
+                    yield chunk
+                    index += 1
+                if end >= len(buffer):
+                    start = len(buffer)
+                    break
+                start = self._next_start(buffer, start, end, tier, spaces)
+
+            if exhausted:
+                return
+
+    @staticmethod
+    def _boundary_tables(buffer: str) -> List[List[int]]:
+        """ตำแหน่งจุดตัดของแต่ละระดับ (เรียงจากน้อยไปมาก) คำนวณแบบ vectorized จากรหัสตัวอักษรของทั้ง buffer
+        ตำแหน่งคือจุดสิ้นสุดของ chunk ที่ตัด ณ จุดนั้น (ช่องว่างรอบจุดตัดถูก strip ภายหลัง)"""
+        codes = np.frombuffer(buffer.encode("utf-32-le"), dtype=np.uint32)
+        classes = CHAR_CLASS[np.minimum(codes, 0xFFFF)]
+        n = len(classes)
+        space = (classes & SPACE).astype(bool)
+        hspace = (classes & HSPACE).astype(bool)
+        thai = (classes & THAI).astype(bool)
+        
+        sections = [match.start() for match in SECTION_MARKER.finditer(buffer)]
+        if buffer.startswith("--- "):
+            sections.insert(0, 0)
+        
+        # ย่อหน้า: ขึ้นบรรทัดใหม่ที่บรรทัดถัดไปว่าง (มีแต่ช่องว่าง/tab) ตัดที่ newline ตัวแรก
+        newlines = np.flatnonzero(classes & NEWLINE)
+        solid = np.cumsum(~space)
+        paragraphs = newlines[:-1][solid[newlines[1:] - 1] == solid[newlines[:-1]]]
+        
+        # ประโยค: เครื่องหมายจบประโยคที่ตามด้วยช่องว่าง และช่องว่างที่อยู่ระหว่างอักษรไทย (ภาษาไทยเว้นวรรคระหว่างประโยค/วลี)
+        next_space = np.append(space[1:], True)
+        punct_end = np.flatnonzero((classes & SENTENCE_END).astype(bool) & next_space) + 1
+        thai_gap = np.zeros(n, dtype=bool)
+        if n > 2:
+            thai_gap[1:-1] = hspace[1:-1] & thai[:-2] & thai[2:]
+        sentences = np.sort(np.concatenate([punct_end, np.flatnonzero(thai_gap)]))
+        
+        # ช่องว่าง: ต้นของช่องว่างแต่ละช่วง
+        spaces = np.flatnonzero(space & ~np.insert(space[:-1], 0, False))
+        
+        # ค้นทีละตำแหน่งด้วย bisect บน list เร็วกว่าเรียก np.searchsorted ทีละค่า
+        return [sections, paragraphs.tolist(), sentences.tolist(), spaces.tolist()]
+    
+    def signature(self) -> str:
+        """กฎการแบ่งและพารามิเตอร์ (ใช้ตรวจว่า chunks เดิมในฐานข้อมูลยังใช้ต่อได้)"""
+        return f"{self.version}|chars|{self.chunk_size}|{self.overlap}"
+
+    # ขนาดของ chunk วัดเป็นตัวอักษร (TokenChunker วัดเป็น tokens โดย override ส่วนนี้)
+    def _prepare(self, buffer: str):
+        """เตรียมข้อมูลของ buffer ใหม่ก่อนตัด chunks"""
+
+    def _has_room(self, buffer: str, start: int) -> bool:
+        """buffer มีข้อความพอสำหรับ chunk เต็มขนาดที่เริ่มจาก start หรือไม่"""
+        return start + self.chunk_size < len(buffer)
+
+    def _span(self, buffer: str, start: int) -> Tuple[int, int, int]:
+        """ช่วงที่จุดสิ้นสุดของ chunk อยู่ได้: (ต่ำสุด, ต่ำสุดที่ต้องการ ตาม min_fill, สูงสุด)"""
+        lowest = start + self.overlap + 1
+        preferred = start + max(self.overlap + 1, int(self.chunk_size * self.min_fill))
+        return lowest, preferred, start + self.chunk_size
+
+    def _overlap_position(self, buffer: str, end: int) -> int:
+        """จุดเริ่ม chunk ถัดไปก่อนปรับให้ตรงขอบคำ"""
+        return end - self.overlap
+
+    def _find_end(self, buffer: str, start: int, tables: List[List[int]]) -> Tuple[int, int]:
+        """หาจุดสิ้นสุดของ chunk: จุดตัดระดับสูงสุดที่ทำให้ chunk ยาวอย่างน้อย min_fill ของขนาด chunk"""
+        minimum, preferred, limit = self._span(buffer, start)
+        if limit >= len(buffer):
+            return len(buffer), -1
+
+        # หัวข้อหน้า/สไลด์ตัดได้เสมอ (chunk ไม่คร่อมหน้า เลขหน้าของ chunk จึงถูกต้อง)
+        sections = tables[TIER_SECTION]
+        i = bisect_right(sections, limit) - 1
+        if i >= 0 and sections[i] >= minimum:
+            return sections[i], TIER_SECTION
+        
+        for lowest in (preferred, minimum):
+            for tier, positions in enumerate(tables):
+                i = bisect_right(positions, limit) - 1
+                if i >= 0 and positions[i] >= lowest:
+                    return positions[i], tier
+
+        # ไม่มีจุดตัดเลย (เช่นภาษาไทยยาวต่อเนื่องไม่เว้นวรรค): ตัดตามขนาดแต่ไม่แยกสระ/วรรณยุกต์ออกจากพยัญชนะ
+        return self._safe_cut(buffer, limit, minimum), len(tables)
+
+    @staticmethod
+    def _safe_cut(buffer: str, position: int, lowest: int) -> int:
+        cut = position
+        while cut > lowest and (buffer[cut] in THAI_COMBINING or buffer[cut - 1] in THAI_LEADING):
+            cut -= 1
+        return cut if cut > lowest else position
+
+    def _next_start(self, buffer: str, start: int, end: int, tier: int, spaces: List[int]) -> int:
+        """จุดเริ่ม chunk ถัดไป: ย้อนจาก end ไม่เกิน overlap และเริ่มที่ขอบคำ/วลีถ้ามี"""
+        # ตัดที่หัวข้อหน้า/สไลด์: chunk ถัดไปเริ่มหน้าใหม่เลยโดยไม่ซ้อนกับหน้าก่อน
+        if tier == TIER_SECTION or self.overlap == 0:
+            return end
+
+        position = self._overlap_position(buffer, end)
+        i = bisect_left(spaces, position)
+        if i < len(spaces) and spaces[i] < end:
+            return spaces[i]
+        return max(self._safe_cut(buffer, position, start + 1), start + 1)
+
+    @staticmethod
+    def _make_chunk(buffer: str, start: int, end: int, base: int, index: int,
+                    pages: List[Tuple[int, int]]) -> Optional[Chunk]:
+        raw = buffer[start:end]
+        text = raw.strip()
+        if not text:
+            return None
+
+        start_char = base + start + (len(raw) - len(raw.lstrip()))
+        page_number = None
+        i = bisect_right(pages, (start_char, float("inf"))) - 1
+        if i >= 0:
+            page_number = pages[i][1]
+        return Chunk(index=index, text=text, start_char=start_char,
+                     end_char=start_char + len(text), page_number=page_number)
+
+class LocalTokenizer:
+    """tokenizer ของโมเดล embedding ที่โหลดจากเครื่อง ใช้นับ tokens และหาตำแหน่งตัวอักษรของแต่ละ token"""
+
+    def __init__(self, name: str, encode, special_tokens: int = 2):
+        self.name = name
+        self._encode = encode  # text -> list ของ (start_char, end_char)
+        self.special_tokens = special_tokens  # เช่น [CLS] และ [SEP] ที่โมเดลเติมให้ทุกข้อความ
+
+    def offsets(self, text: str) -> Tuple[List[int], List[int]]:
+        """ตำแหน่งเริ่ม/สิ้นสุดของแต่ละ token (ไม่รวม special tokens)"""
+        pairs = [pair for pair in self._encode(text) if pair[1] > pair[0]]
+        return [pair[0] for pair in pairs], [pair[1] for pair in pairs]
+
+    def count(self, text: str) -> int:
+        """จำนวน tokens ที่โมเดลเห็น (รวม special tokens)"""
+        return len(self.offsets(text)[0]) + self.special_tokens
+
+_tokenizers = {}
+
+def load_tokenizer(name_or_path: str = None) -> Optional[LocalTokenizer]:
+    """โหลด tokenizer จากโฟลเดอร์หรือ cache ของ Hugging Face โดยไม่ดาวน์โหลด (โหลดไม่ได้จะส่งคืน None)
+    ใช้ tokenizers (tokenizer.json) ถ้ามี ไม่เช่นนั้นใช้ fast tokenizer ของ transformers"""
+    name_or_path = name_or_path or config.embedding.tokenizer_path
+    if name_or_path in _tokenizers:
+        return _tokenizers[name_or_path]
+
+    # tokenizers/transformers เป็น dependency เสริม (import เมื่อใช้ chunk_mode = "tokens" เท่านั้น)
+    try:
+        from tokenizers import Tokenizer
+    except ImportError:
+        Tokenizer = None
+    try:
+        from transformers import AutoTokenizer
+    except ImportError:
+        AutoTokenizer = None
+
+    tokenizer = None
+    tokenizer_file = os.path.join(name_or_path, "tokenizer.json")
+    try:
+        if Tokenizer is not None and os.path.isfile(tokenizer_file):
+            backend = Tokenizer.from_file(tokenizer_file)
+            backend.no_truncation()
+            tokenizer = LocalTokenizer(
+                name_or_path,
+                lambda text: backend.encode(text, add_special_tokens=False).offsets,
+                backend.post_processor.num_special_tokens_to_add(False) if backend.post_processor else 0
+            )
+        elif AutoTokenizer is not None:
+            backend = AutoTokenizer.from_pretrained(name_or_path, local_files_only=True)
+            if not backend.is_fast:
+                raise ValueError("ต้องเป็น fast tokenizer (ต้องการตำแหน่งตัวอักษรของแต่ละ token)")
+            tokenizer = LocalTokenizer(
+                name_or_path,
+                lambda text: backend(text, add_special_tokens=False, return_offsets_mapping=True,
+                                     verbose=False)["offset_mapping"],
+                backend.num_special_tokens_to_add()
+            )
+        elif Tokenizer is None:
+            logger.warning("ไม่ได้ติดตั้ง tokenizers หรือ transformers จะแบ่ง chunks ตามจำนวนตัวอักษร")
+        else:
+            logger.warning(f"ไม่พบ {tokenizer_file} จะแบ่ง chunks ตามจำนวนตัวอักษร")
+    except Exception as e:
+        logger.warning(f"ไม่สามารถโหลด tokenizer {name_or_path} จะแบ่ง chunks ตามจำนวนตัวอักษร: {e}")
+        tokenizer = None
+
+    _tokenizers[name_or_path] = tokenizer
+    return tokenizer
+
+class TokenChunker(TextChunker):
+    """แบ่ง chunks ตามงบ tokens ของโมเดล embedding (max_tokens รวม special tokens) ซ้อนกัน overlap tokens"""
+
+    def __init__(self, tokenizer: LocalTokenizer, max_tokens: int = None, overlap: int = None,
+                 min_fill: float = 0.5):
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens or config.embedding.chunk_tokens
+        self.budget = self.max_tokens - tokenizer.special_tokens
+        self.token_overlap = config.embedding.chunk_token_overlap if overlap is None else overlap
+        if self.token_overlap >= self.budget:
+            raise ValueError("chunk_token_overlap ต้องน้อยกว่า chunk_tokens")
+        # ขนาดตัวอักษรโดยประมาณ (ใช้กำหนดขนาด buffer เท่านั้น)
+        super().__init__(chunk_size=self.budget * 4, overlap=0, min_fill=min_fill)
+        self.overlap = self.token_overlap
+        self._starts: List[int] = []
+        self._ends: List[int] = []
+
+    def signature(self) -> str:
+        return f"{self.version}|tokens|{self.tokenizer.name}|{self.max_tokens}|{self.token_overlap}"
+
+    def _prepare(self, buffer: str):
+        # tokenize ทั้ง buffer ครั้งเดียว แล้วแปลงงบ tokens เป็นตำแหน่งตัวอักษรด้วย bisect
+        self._starts, self._ends = self.tokenizer.offsets(buffer)
+
+    def _token_at(self, position: int) -> int:
+        """ลำดับของ token แรกที่จบหลัง position"""
+        return bisect_right(self._ends, position)
+
+    def _has_room(self, buffer: str, start: int) -> bool:
+        # เผื่อ tokens ท้าย buffer ที่อาจถูกตัดกลางคำ (จะ tokenize ใหม่เมื่อเติม buffer)
+        return self._token_at(start) + self.budget + 8 < len(self._starts)
+
+    def _span(self, buffer: str, start: int) -> Tuple[int, int, int]:
+        first = self._token_at(start)
+        count = len(self._starts)
+
+        def position(offset: int) -> int:
+            index = first + offset
+            return self._starts[index] if index < count else len(buffer)
+
+        lowest = position(self.token_overlap + 1)
+        preferred = position(max(self.token_overlap + 1, int(self.budget * self.min_fill)))
+        return lowest, preferred, position(self.budget)
+
+    def _overlap_position(self, buffer: str, end: int) -> int:
+        last = bisect_left(self._starts, end)  # จำนวน tokens ก่อน end
+        return self._starts[max(last - self.token_overlap, 0)] if self._starts else end
+
+def chunk_text(text: str, chunk_size: int = None, overlap: int = None) -> List[str]:
+    """แบ่งข้อความเป็น list ของ chunks"""
+    return TextChunker(chunk_size, overlap).chunk_text(text)
@@ -0,0 +1,1083 @@
+"""
+ดัชนี Vector ในหน่วยความจำสำหรับการค้นหา chunks
+เก็บ embeddings เป็น matrix float32 ที่ normalize แล้ว พร้อม array ของ chunk id
+ส่วนที่บันทึกเป็น shard แล้วจะเปิดแบบ memory-mapped ส่วน chunks ใหม่อยู่ใน matrix ท้าย (tail)
+เมื่อคลังใหญ่พอ shard จะมี codes ที่บีบอัด (sq8/pq) ในหน่วยความจำสำหรับการค้นหารอบแรก
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import text
+
+from config import config
+from database.database import get_db_session
+from services.embedding_models import HAS_MODEL_VECTOR, MODEL_VECTOR_JOIN, NATIVE_VECTOR, model_params
+from services.embedding_store import ShardedEmbeddingStore
+from services.quantization import create_quantizer, fingerprint
+from utils.vector_codec import decode_embedding, load_embedding
+
+logger = logging.getLogger(__name__)
+
+# จำนวน shard ที่เล็กกว่า shard_target_rows ขั้นต่ำก่อนรวม (ยิ่งมากยิ่งเขียน shard ที่รวมแล้วซ้ำน้อยครั้ง)
+COMPACT_MIN_SHARDS = 8
+
+class _Segment:
+    """ส่วนของดัชนีที่มาจาก shard (อ่านอย่างเดียว) valid=None หมายถึงทุกแถวใช้งานได้"""
+
+    __slots__ = ("name", "ids", "matrix", "valid", "codes", "documents", "_document_order")
+
+    def __init__(self, name: str, ids: np.ndarray, matrix: np.ndarray, valid: Optional[np.ndarray] = None,
+                 codes: Optional[np.ndarray] = None, documents: Optional[np.ndarray] = None):
+        self.name = name
+        self.ids = ids
+        self.matrix = matrix
+        self.valid = None if valid is None or valid.all() else valid
+        self.codes = codes  # codes ที่บีบอัดของทุกแถว (None = ค้นหาด้วย vectors เต็ม)
+        self.documents = documents  # document id ของแต่ละแถว (-1 = ไม่ทราบ)
+        self._document_order = None  # (ลำดับแถวเรียงตาม document id, document id ที่เรียงแล้ว)
+
+    def with_valid(self, valid: np.ndarray) -> "_Segment":
+        """สำเนาของ segment ที่ใช้ valid mask ใหม่ (ข้อมูลอื่นใช้ร่วมกัน)"""
+        segment = _Segment(self.name, self.ids, self.matrix, valid, self.codes, self.documents)
+        segment._document_order = self._document_order
+        return segment
+
+    @property
+    def count(self) -> int:
+        return len(self.ids) if self.valid is None else int(self.valid.sum())
+
+    def valid_ids(self) -> np.ndarray:
+        return np.asarray(self.ids) if self.valid is None else np.asarray(self.ids)[self.valid]
+
+    def rows_of(self, ids: np.ndarray) -> np.ndarray:
+        """ตำแหน่งแถวของ ids ที่อยู่ใน segment (shard เรียงตาม id จึงใช้ binary search ได้)"""
+        ids = np.unique(ids)
+        positions = np.searchsorted(self.ids, ids)
+        inside = positions < len(self.ids)
+        positions = positions[inside]
+        return positions[np.asarray(self.ids)[positions] == ids[inside]]
+
+    def ids_after(self, low_id: int) -> np.ndarray:
+        """ids ที่มากกว่า low_id"""
+        return np.asarray(self.ids[np.searchsorted(self.ids, low_id, side="right"):])
+
+    def document_rows(self, document_ids: np.ndarray) -> np.ndarray:
+        """แถว (เรียงจากน้อยไปมาก) ของ chunks ในเอกสารที่ระบุ ใช้ช่วงจากการเรียงตาม document id จึงไม่ต้องสแกนทุกแถว"""
+        if self.documents is None:
+            return np.empty(0, dtype=np.int64)
+        if self._document_order is None:
+            order = np.argsort(self.documents, kind="stable").astype(np.int32)
+            self._document_order = (order, np.asarray(self.documents)[order])
+        order, sorted_documents = self._document_order
+
+        starts = np.searchsorted(sorted_documents, document_ids, side="left")
+        lengths = np.searchsorted(sorted_documents, document_ids, side="right") - starts
+        present = lengths > 0
+        starts, lengths = starts[present], lengths[present]
+        if lengths.size == 0:
+            return np.empty(0, dtype=np.int64)
+
+        # รวมหลายช่วง [start, start + length) เป็น array เดียวโดยไม่ต้องวน loop
+        offsets = np.cumsum(lengths) - lengths
+        positions = np.arange(int(lengths.sum())) - np.repeat(offsets - starts, lengths)
+        return np.sort(order[positions]).astype(np.int64)
+
+class DocumentAttributes:
+    """คุณสมบัติของเอกสารที่ใช้กรองการค้นหา เก็บเป็น array ตาม document id (ไม่ต้อง join ตอนค้นหา)
+    รวมถึงเอกสารที่ถือสำเนาของ chunks ในดัชนี (chunks ที่ซ้ำและเอกสารที่อัพโหลดซ้ำ) เพื่อให้ตัวกรองตามเอกสารพบ chunk หลัก
+    เมื่อเปิด hierarchical_search เก็บ vector ระดับเอกสารของโมเดลนี้ด้วย (รอบแรกของการค้นหาสองระดับ)"""
+
+    def __init__(self, model: str = None):
+        self.model = model or config.embedding.model
+        self._lock = threading.Lock()
+        self.clear()
+
+    @property
+    def summarized(self) -> int:
+        """จำนวนเอกสารที่มี vector ระดับเอกสาร"""
+        return self._summarized
+
+    def clear(self):
+        with self._lock:
+            self._known = np.zeros(0, dtype=bool)
+            self._public = np.zeros(0, dtype=bool)
+            self._owner = np.zeros(0, dtype=np.int32)
+            self._category = np.zeros(0, dtype=np.int32)  # -1 = ไม่มีหมวดหมู่
+            self._source = np.zeros(0, dtype=np.int32)  # เอกสารต้นฉบับที่ใช้ chunks ร่วมกัน (-1 = มี chunks ของตัวเอง)
+            # chunks ที่ซ้ำ (ไม่อยู่ในดัชนี vector): id, chunk หลัก, เอกสารของ chunk ที่ซ้ำ, เอกสารของ chunk หลัก
+            self._copies = np.zeros((4, 0), dtype=np.int64)
+            self._categories: Dict[str, int] = {}
+            self._synced_at: Optional[datetime] = None  # updated_at ล่าสุดที่ sync แล้ว
+            self._vectors: Optional[np.ndarray] = None  # (capacity, dim) ตาม document id ใช้ได้เฉพาะแถวที่ _has_vector
+            self._has_vector = np.zeros(0, dtype=bool)
+            self._summarized = 0
+            self._with_vectors = False  # sync ครั้งก่อนดึง vector ระดับเอกสารหรือไม่
+
+    def sync(self) -> int:
+        """ดึงเอกสารที่เพิ่ม/แก้ไขตั้งแต่ sync ครั้งก่อน (ตาม documents.updated_at) ส่งคืนจำนวนที่อัพเดท"""
+        with_vectors = config.embedding.hierarchical_search
+        if with_vectors and not self._with_vectors:
+            # เพิ่งเปิดการค้นหาสองระดับ: ดึงทุกเอกสารใหม่พร้อม vector ระดับเอกสาร
+            self._synced_at = None
+        self._with_vectors = with_vectors
+
+        query = "SELECT id, category, is_public, uploaded_by, source_document_id, chunks_total, updated_at"
+        query += ", summary_vector, summary_model FROM documents" if with_vectors else " FROM documents"
+
+        params = {}
+        if self._synced_at is not None:
+            # ใช้ >= เผื่อเอกสารที่แก้ไขในวินาทีเดียวกับ sync ครั้งก่อน (อัพเดทซ้ำไม่มีผลเสีย)
+            query += " WHERE updated_at >= :since"
+            params["since"] = self._synced_at
+
+        with get_db_session() as session:
+            rows = session.execute(text(query), params).fetchall()
+            copies = self._fetch_copies(session) if rows else None
+        if not rows:
+            return 0
+
+        ids = np.fromiter((row.id for row in rows), dtype=np.int64, count=len(rows))
+        with self._lock:
+            size = int(ids.max()) + 1
+            known, public, owner, category, source = self._known, self._public, self._owner, self._category, self._source
+            if size > len(known):
+                # ขยายแบบเพิ่มเท่าตัวและสร้าง array ใหม่ เพื่อไม่กระทบการค้นหาที่กำลังอ่านอยู่
+                capacity = max(size, 2 * len(known), 1024)
+                known, public, owner, category, source = (
+                    np.concatenate([array, np.full(capacity - len(array), fill, dtype=array.dtype)])
+                    for array, fill in ((known, False), (public, False), (owner, -1), (category, -1), (source, -1))
+                )
+            else:
+                known, public, owner, category, source = (
+                    known.copy(), public.copy(), owner.copy(), category.copy(), source.copy()
+                )
+
+            for name in {row.category for row in rows if row.category}:
+                self._categories.setdefault(name, len(self._categories))
+            known[ids] = True
+            public[ids] = [bool(row.is_public) for row in rows]
+            owner[ids] = [row.uploaded_by or -1 for row in rows]
+            category[ids] = [self._categories[row.category] if row.category else -1 for row in rows]
+            # เอกสารที่อัพโหลดซ้ำในขอบเขตเดียวกันไม่เคยแบ่ง chunks (chunks_total ว่าง) ใช้ chunks ของต้นฉบับ
+            source[ids] = [
+                row.source_document_id if row.source_document_id and row.chunks_total is None else -1 for row in rows
+            ]
+
+            # chunks ที่ซ้ำของเอกสารที่ sync แทนที่ชุดเดิมของเอกสารเหล่านั้น
+            kept = self._copies[:, ~np.isin(self._copies[2], ids)]
+            self._copies = np.concatenate([kept, copies[:, np.isin(copies[2], ids)]], axis=1)
+            self._known, self._public, self._owner, self._category, self._source = known, public, owner, category, source
+            if with_vectors:
+                self._sync_vectors(rows, ids, len(known))
+            updated = [row.updated_at for row in rows if row.updated_at is not None]
+            if updated:
+                self._synced_at = max(updated + ([self._synced_at] if self._synced_at else []))
+        return len(rows)
+
+    def _fetch_copies(self, session) -> np.ndarray:
+        """chunks ที่ซ้ำของเอกสารที่แก้ไขตั้งแต่ sync ครั้งก่อน (4, n): id, chunk หลัก, เอกสาร, เอกสารของ chunk หลัก"""
+        query = """
+            SELECT dc.id, dc.canonical_chunk_id, dc.document_id, c.document_id AS canonical_document_id
+            FROM document_chunks dc
+            JOIN documents d ON dc.document_id = d.id
+            JOIN document_chunks c ON c.id = dc.canonical_chunk_id
+            WHERE dc.canonical_chunk_id IS NOT NULL
+        """
+        params = {}
+        if self._synced_at is not None:
+            query += " AND d.updated_at >= :since"
+            params["since"] = self._synced_at
+        rows = session.execute(text(query), params).fetchall()
+        return np.array(
+            [[row.id, row.canonical_chunk_id, row.document_id, row.canonical_document_id] for row in rows],
+            dtype=np.int64
+        ).reshape(-1, 4).T
+
+    def _sync_vectors(self, rows, ids: np.ndarray, capacity: int):
+        """อัพเดท vector ระดับเอกสารของแถวที่ sync (เรียกภายใต้ lock)"""
+        vectors = self._vectors
+        has_vector = np.concatenate([self._has_vector, np.zeros(capacity - len(self._has_vector), dtype=bool)])
+        has_vector[ids] = False
+
+        decoded = [
+            (row.id, decode_embedding(row.summary_vector)) for row in rows
+            if row.summary_vector is not None and row.summary_model == self.model
+        ]
+        if decoded:
+            dim = decoded[0][1].shape[0]
+            if vectors is None or vectors.shape[1] != dim:
+                vectors = np.zeros((capacity, dim), dtype=np.float32)
+                has_vector[:] = False
+            elif len(vectors) < capacity:
+                vectors = np.concatenate([vectors, np.zeros((capacity - len(vectors), dim), dtype=np.float32)])
+            # แถวของเอกสารที่มีอยู่แล้วเขียนทับในที่เดิม (การค้นหาที่อ่านพร้อมกันได้ vector เก่าหรือใหม่ของเอกสารนั้น)
+            for document_id, vector in decoded:
+                if vector.shape[0] == dim:
+                    vectors[document_id] = vector
+                    has_vector[document_id] = True
+
+        self._vectors, self._has_vector = vectors, has_vector
+        self._summarized = int(has_vector.sum())
+
+    def nearest(self, query: np.ndarray, count: int,
+                document_ids: Optional[np.ndarray] = None) -> Optional[np.ndarray]:
+        """รอบแรกของการค้นหาสองระดับ: count เอกสารที่ vector ระดับเอกสารใกล้ query (normalize แล้ว) ที่สุด
+        รวมกับเอกสารที่ยังไม่มี vector ระดับเอกสาร (ไม่ทราบคะแนนจึงไม่ตัดทิ้ง) ส่งคืน None ถ้ายังไม่มี vectors"""
+        vectors, has_vector, known = self._vectors, self._has_vector, self._known
+        if vectors is None or vectors.shape[1] != query.shape[0]:
+            return None
+
+        size = min(len(vectors), len(has_vector), len(known))
+        if document_ids is None:
+            candidates = np.flatnonzero(known[:size])
+        else:
+            candidates = np.asarray(document_ids, dtype=np.int64)
+            candidates = candidates[candidates < size]
+        summarized = candidates[has_vector[candidates]]
+        unsummarized = candidates[~has_vector[candidates]]
+
+        if summarized.size > count:
+            if document_ids is None:
+                scores = (vectors[:size] @ query)[summarized]
+            else:
+                scores = vectors[summarized] @ query
+            summarized = summarized[np.argpartition(-scores, count - 1)[:count]]
+        return np.union1d(summarized, unsummarized)
+
+    def sources(self, document_ids: np.ndarray) -> Dict[int, int]:
+        """{เอกสารต้นฉบับ: เอกสารที่อัพโหลดซ้ำ} ของเอกสารใน document_ids ที่ใช้ chunks ของต้นฉบับนอก document_ids"""
+        source = self._source
+        document_ids = np.asarray(document_ids, dtype=np.int64)
+        document_ids = document_ids[document_ids < len(source)]
+        origins = source[document_ids]
+        found = (origins >= 0) & ~np.isin(origins, document_ids)
+        return dict(zip(origins[found].tolist(), document_ids[found].tolist()))
+
+    def copies(self, document_ids: np.ndarray) -> Dict[int, int]:
+        """{chunk หลัก: chunk ที่ซ้ำ} ของ chunks ที่ซ้ำในเอกสาร document_ids ที่ chunk หลักอยู่ในเอกสารอื่น"""
+        copies = self._copies
+        found = np.isin(copies[2], document_ids) & ~np.isin(copies[3], document_ids)
+        return dict(zip(copies[1, found].tolist(), copies[0, found].tolist()))
+
+    def canonical_of(self, chunk_ids: Sequence[int]) -> Dict[int, int]:
+        """{chunk ที่ซ้ำ: chunk หลัก} ของ chunk ids ที่เป็น chunk ที่ซ้ำ (ไม่อยู่ในดัชนี vector)"""
+        copies = self._copies
+        found = np.isin(copies[0], np.asarray(chunk_ids, dtype=np.int64))
+        return dict(zip(copies[0, found].tolist(), copies[1, found].tolist()))
+
+    def matching(self, document_ids: Optional[Sequence[int]] = None, category=None,
+                 is_public: Optional[bool] = None, uploaded_by=None,
+                 visible_to: Optional[int] = None) -> np.ndarray:
+        """document ids (เรียงแล้ว) ที่ตรงกับทุกเงื่อนไข category/uploaded_by รับค่าเดียวหรือ list
+        visible_to = เอกสารที่เผยแพร่หรือเป็นของผู้ใช้คนนั้น"""
+        known, public, owner, category_codes = self._known, self._public, self._owner, self._category
+        mask = known.copy()
+
+        if document_ids is not None:
+            requested = np.asarray(document_ids, dtype=np.int64)
+            requested = requested[(requested >= 0) & (requested < len(mask))]
+            selected = np.zeros(len(mask), dtype=bool)
+            selected[requested] = True
+            mask &= selected
+        if category is not None:
+            names = [category] if isinstance(category, str) else list(category)
+            mask &= np.isin(category_codes, [self._categories[name] for name in names if name in self._categories])
+        if is_public is not None:
+            mask &= public == bool(is_public)
+        if uploaded_by is not None:
+            mask &= np.isin(owner, np.atleast_1d(uploaded_by))
+        if visible_to is not None:
+            mask &= public | (owner == visible_to)
+        return np.flatnonzero(mask)
+
+class VectorIndex:
+    """ดัชนี vector: matrix-vector product ต่อ segment + argpartition top-k (หรือ codes รอบแรก + จัดอันดับใหม่)"""
+
+    def __init__(self, initial_capacity: int = 1024, store: Optional[ShardedEmbeddingStore] = None,
+                 model: str = None):
+        # _lock ป้องกันเฉพาะการอ่าน/สลับ reference ที่ search ใช้ (ถือสั้นๆ)
+        # _write_lock ให้ผู้แก้ไขดัชนีทำทีละราย: อ่านฐานข้อมูลและสร้าง array ใหม่นอก _lock แล้วค่อยสลับ
+        self._lock = threading.RLock()
+        self._write_lock = threading.RLock()
+        self._initial_capacity = initial_capacity
+        self.store = store
+        # ดัชนีหนึ่งชุดต่อโมเดล: vectors จาก document_chunks หรือ chunk_embeddings ของโมเดลนี้
+        self.model = model or (store.model if store is not None else config.embedding.model)
+        # segments ถูกแทนที่ทั้ง list เมื่อมีการเปลี่ยนแปลง เพื่อให้ search อ่านได้นอก lock
+        self._segments: List[_Segment] = []
+        self._matrix: Optional[np.ndarray] = None  # tail: (capacity, dim) float32
+        self._ids = np.empty(0, dtype=np.int64)
+        self._documents = np.empty(0, dtype=np.int32)  # document id ของแต่ละแถวใน tail
+        self._size = 0
+        self._count = 0
+        self._dim: Optional[int] = None
+        self._high_water = 0  # document_chunks.id สูงสุดที่ sync แล้ว
+        self._deletion_high_water = 0  # chunk_deletions.id สูงสุดที่นำไปลบแล้ว
+        self._model_high_water = 0  # chunk_embeddings.id สูงสุดที่ sync แล้ว (chunks เดิมที่สร้าง vector ของโมเดลนี้ภายหลัง)
+        self._last_refresh = 0.0
+        self.quantizer = None
+        self._codes_tag: Optional[str] = None
+        self.documents = DocumentAttributes(self.model)
+        self.is_built = False
+
+    @property
+    def size(self) -> int:
+        """จำนวน vectors ที่ค้นหาได้ในดัชนี"""
+        return self._count
+
+    @property
+    def dim(self) -> Optional[int]:
+        """มิติของ vector"""
+        return self._dim
+
+    @staticmethod
+    def normalize(vectors: np.ndarray) -> np.ndarray:
+        """normalize แต่ละแถวให้มีความยาวเป็น 1 (แถวที่เป็นศูนย์คงเป็นศูนย์)"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors.reshape(1, -1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def clear(self):
+        """ล้างข้อมูลในดัชนี"""
+        with self._write_lock, self._lock:
+            self._segments = []
+            self._matrix = None
+            self._ids = np.empty(0, dtype=np.int64)
+            self._documents = np.empty(0, dtype=np.int32)
+            self._size = 0
+            self._count = 0
+            self._dim = None
+            self._high_water = 0
+            self._deletion_high_water = 0
+            self._model_high_water = 0
+            self._last_refresh = 0.0
+            self.quantizer = None
+            self._codes_tag = None
+            self.documents.clear()
+            self.is_built = False
+
+    def _recount(self):
+        with self._lock:
+            self._count = sum(segment.count for segment in self._segments) + self._size
+
+    def _reserve(self, extra: int):
+        """ขยายพื้นที่ของ tail แบบเพิ่มเท่าตัว เพื่อให้การเพิ่มทีละน้อยไม่ต้องคัดลอกทุกครั้ง"""
+        needed = self._size + extra
+        capacity = 0 if self._matrix is None else self._matrix.shape[0]
+        if needed <= capacity:
+            return
+
+        new_capacity = max(self._initial_capacity, capacity * 2, needed)
+        matrix = np.empty((new_capacity, self._dim), dtype=np.float32)
+        ids = np.empty(new_capacity, dtype=np.int64)
+        documents = np.empty(new_capacity, dtype=np.int32)
+        if self._size:
+            matrix[:self._size] = self._matrix[:self._size]
+            ids[:self._size] = self._ids[:self._size]
+            documents[:self._size] = self._documents[:self._size]
+        with self._lock:
+            self._matrix, self._ids, self._documents = matrix, ids, documents
+
+    def add(self, ids: Sequence[int], vectors: Sequence[Sequence[float]],
+            documents: Optional[Sequence[int]] = None) -> int:
+        """เพิ่ม vectors เข้าดัชนี พร้อม document id ของแต่ละ chunk ถ้าทราบ (ส่งคืนจำนวนที่เพิ่มได้)"""
+        if len(ids) == 0:
+            return 0
+
+        vectors = self.normalize(np.asarray(vectors, dtype=np.float32))
+        ids = np.asarray(ids, dtype=np.int64)
+
+        with self._write_lock:
+            if self._dim is None:
+                self._dim = vectors.shape[1]
+            if vectors.shape[1] != self._dim:
+                logger.warning(f"ข้ามการเพิ่ม {len(ids)} vectors: มิติ {vectors.shape[1]} ไม่ตรงกับดัชนี ({self._dim})")
+                return 0
+
+            # แถวหลัง _size ยังไม่มีการค้นหาใดอ่าน จึงเขียนนอก _lock ได้
+            self._reserve(len(ids))
+            end = self._size + len(ids)
+            self._matrix[self._size:end] = vectors
+            self._ids[self._size:end] = ids
+            self._documents[self._size:end] = -1 if documents is None else documents
+            with self._lock:
+                self._size = end
+                self._count += len(ids)
+
+            if self.is_built:
+                self.flush()
+            return len(ids)
+
+    def _drop_from_tail(self, ids: np.ndarray) -> int:
+        """ลบแถวออกจาก tail (สร้าง array ใหม่ เพื่อไม่กระทบการค้นหาที่กำลังทำงานอยู่)"""
+        if self._size == 0:
+            return 0
+        keep = ~np.isin(self._ids[:self._size], ids)
+        removed = self._size - int(keep.sum())
+        if removed:
+            matrix = self._matrix[:self._size][keep]
+            chunk_ids = self._ids[:self._size][keep]
+            documents = self._documents[:self._size][keep]
+            with self._lock:
+                self._matrix, self._ids, self._documents = matrix, chunk_ids, documents
+                self._size = matrix.shape[0]
+        return removed
+
+    def remove(self, ids: Sequence[int]) -> int:
+        """ลบ vectors ตาม chunk id (shard ถูกทำเครื่องหมายว่าใช้ไม่ได้ ส่วน tail ถูกลบออกจริง)"""
+        if len(ids) == 0:
+            return 0
+
+        ids = np.asarray(ids, dtype=np.int64)
+        with self._write_lock:
+            segments = []
+            for segment in self._segments:
+                rows = segment.rows_of(ids)
+                if segment.valid is not None:
+                    rows = rows[segment.valid[rows]]
+                if rows.size:
+                    valid = np.ones(len(segment.ids), dtype=bool) if segment.valid is None else segment.valid.copy()
+                    valid[rows] = False
+                    segment = segment.with_valid(valid)
+                segments.append(segment)
+            with self._lock:
+                self._segments = segments
+
+            self._drop_from_tail(ids)
+            before = self._count
+            self._recount()
+            return before - self._count
+
+    def snapshot(self) -> Tuple[np.ndarray, np.ndarray]:
+        """ส่งคืน (chunk_ids, matrix) ของแถวที่ใช้งานได้ทั้งหมด (ถ้ามี shard จะเป็นสำเนา, ห้ามแก้ไข)"""
+        with self._lock:
+            segments = self._segments
+            tail_ids = self._ids[:self._size]
+            tail_matrix = self._matrix[:self._size] if self._size else np.empty((0, self._dim or 0), dtype=np.float32)
+
+        if not segments:
+            return tail_ids, tail_matrix
+
+        ids = [segment.valid_ids() for segment in segments] + [tail_ids]
+        matrices = [
+            segment.matrix if segment.valid is None else segment.matrix[segment.valid]
+            for segment in segments
+        ] + [tail_matrix]
+        return np.concatenate(ids), np.concatenate(matrices)
+
+    def _attach_store_shards(self, attempts: int = 3) -> int:
+        """เปิด shard ใน store ที่ยังไม่ได้เปิด (รวมถึงที่ process อื่นเขียน) ส่งคืนจำนวน shard ที่เพิ่ม"""
+        for attempt in range(attempts):
+            try:
+                return self._attach_entries(self.store.shards())
+            except FileNotFoundError as e:
+                # process อื่น compact แล้วลบ shard หลังจากอ่าน manifest: อ่าน manifest ใหม่
+                logger.info(f"shard ถูกรวมระหว่างเปิด ({e}) จะอ่าน manifest ใหม่")
+        logger.warning(f"ไม่สามารถเปิด shard ใน {self.store.folder} หลังลอง {attempts} ครั้ง")
+        return 0
+
+    def _attach_entries(self, entries: List[dict]) -> int:
+        names = {entry["file"] for entry in entries}
+
+        # shard ที่ถูกรวมแล้วจะหายไปจาก manifest: เก็บ id ที่ลบไว้เพื่อไม่ให้กลับมาใน shard ใหม่
+        removed = [
+            np.asarray(segment.ids)[~segment.valid]
+            for segment in self._segments
+            if segment.name not in names and segment.valid is not None
+        ]
+        removed_ids = np.concatenate(removed) if removed else np.empty(0, dtype=np.int64)
+        segments = [segment for segment in self._segments if segment.name in names]
+        attached = {segment.name for segment in segments}
+        held = [np.asarray(segment.ids) for segment in segments]
+
+        added = 0
+        for entry in entries:
+            if entry["file"] in attached:
+                continue
+            if self._dim is not None and entry["dim"] != self._dim:
+                logger.warning(f"ข้าม shard {entry['file']}: มิติ {entry['dim']} ไม่ตรงกับดัชนี ({self._dim})")
+                continue
+
+            ids, matrix = self.store.open_shard(entry)
+            held_ids = np.concatenate(held) if held else np.empty(0, dtype=np.int64)
+            valid = ~np.isin(ids, held_ids) & ~np.isin(ids, removed_ids)
+            segment = _Segment(entry["file"], ids, matrix, valid, documents=self._shard_documents(entry, ids))
+            segments.append(self._with_codes(segment))
+            held.append(np.asarray(ids))
+            self._dim = self._dim or entry["dim"]
+            added += 1
+
+        # แถวใน tail ที่อยู่ใน shard แล้ว (ไม่ว่า process ไหนเขียน) ไม่ต้องเก็บในหน่วยความจำอีก
+        # สลับ segments และตัด tail พร้อมกัน เพื่อไม่ให้การค้นหาเห็น chunk เดียวกันสองแถว
+        tail = self._ids[:self._size]
+        stored = tail[np.isin(tail, np.concatenate(held))] if held and self._size else tail[:0]
+        with self._lock:
+            self._segments = segments
+            self._drop_from_tail(stored)
+            self._recount()
+        return added
+
+    def _shard_documents(self, entry: dict, ids: np.ndarray) -> np.ndarray:
+        """document id ของแต่ละแถวใน shard (shard ที่เขียนก่อนมีไฟล์นี้จะดึงจากฐานข้อมูลแล้วบันทึกไว้)"""
+        documents = self.store.load_documents(entry["file"])
+        if documents is not None and len(documents) == len(ids) and (documents >= 0).all():
+            return documents
+
+        if documents is None or len(documents) != len(ids):
+            documents = np.full(len(ids), -1, dtype=np.int32)
+        unknown = np.flatnonzero(documents < 0)
+        try:
+            found_ids, found_documents = self._fetch_chunk_documents(int(ids[unknown[0]]), int(ids[unknown[-1]]))
+        except Exception as e:
+            logger.warning(f"ไม่สามารถดึง document id ของ {entry['file']}: {e}")
+            return documents
+
+        positions = np.searchsorted(found_ids, np.asarray(ids)[unknown])
+        positions = np.minimum(positions, max(len(found_ids) - 1, 0))
+        matched = found_ids[positions] == np.asarray(ids)[unknown] if len(found_ids) else np.zeros(len(unknown), dtype=bool)
+        if matched.any():
+            documents = documents.copy()
+            documents[unknown[matched]] = found_documents[positions[matched]]
+            try:
+                self.store.save_documents(entry["file"], documents)
+            except OSError as e:
+                logger.warning(f"ไม่สามารถบันทึก document id ของ {entry['file']}: {e}")
+        return documents
+
+    def _with_codes(self, segment: _Segment, quantizer=None, codes_tag: str = None) -> _Segment:
+        """เติม codes ให้ segment (โหลดจากไฟล์ข้าง shard หรือ encode แล้วบันทึกไว้ใช้ครั้งต่อไป)"""
+        quantizer = quantizer or self.quantizer
+        codes_tag = codes_tag or self._codes_tag
+        if quantizer is None or segment.codes is not None:
+            return segment
+
+        codes = self.store.load_codes(segment.name, codes_tag)
+        if codes is None or len(codes) != len(segment.ids):
+            codes = quantizer.encode(segment.matrix)
+            try:
+                self.store.save_codes(segment.name, codes_tag, codes)
+            except OSError as e:
+                logger.warning(f"ไม่สามารถบันทึก codes ของ {segment.name}: {e}")
+        segment.codes = codes
+        return segment
+
+    def _training_sample(self, size: int) -> np.ndarray:
+        """สุ่มแถวจากทุก shard ตามสัดส่วน (อ่านเฉพาะแถวที่สุ่มได้ ไม่คัดลอกทั้งดัชนี)"""
+        rng = np.random.default_rng(0)
+        total = sum(len(segment.ids) for segment in self._segments)
+        parts = []
+        for segment in self._segments:
+            take = min(len(segment.ids), max(1, size * len(segment.ids) // max(total, 1)))
+            rows = np.sort(rng.choice(len(segment.ids), take, replace=False))
+            parts.append(np.asarray(segment.matrix[rows]))
+        return np.concatenate(parts)
+
+    def _ensure_quantizer(self):
+        """โหลดหรือ train quantizer เมื่อคลังใหญ่เกิน quantization_min_rows แล้วเติม codes ให้ทุก shard"""
+        kind = config.embedding.quantization
+        if self.store is None or kind == "none" or not self._segments:
+            return
+
+        # train และ encode นอก _lock (การค้นหาระหว่างนี้ใช้ vectors เต็ม) แล้วสลับ quantizer กับ segments พร้อมกัน
+        with self._write_lock:
+            quantizer, codes_tag = self.quantizer, self._codes_tag
+            if quantizer is None:
+                quantizer = self.store.load_quantizer(kind)
+                if quantizer is not None and quantizer.dim != self._dim:
+                    logger.warning(f"quantizer {kind} มีมิติ {quantizer.dim} ไม่ตรงกับดัชนี ({self._dim}) จะไม่ใช้งาน")
+                    return
+                if quantizer is not None and getattr(quantizer, "reduced_dim", None) not in (None, config.embedding.reduced_dim):
+                    logger.info(f"quantizer {kind} ลดเหลือ {quantizer.reduced_dim} มิติ ไม่ตรงกับ reduced_dim จะ train ใหม่")
+                    quantizer = None
+                if quantizer is None:
+                    if self._count < config.embedding.quantization_min_rows:
+                        return
+                    try:
+                        quantizer = create_quantizer(kind, self._dim, config.embedding.pq_subvectors,
+                                                     config.embedding.reduced_dim)
+                    except ValueError as e:
+                        logger.error(f"ไม่สามารถสร้าง quantizer {kind}: {e}")
+                        return
+                    if quantizer is None:
+                        logger.warning(f"ไม่รู้จัก quantization '{kind}' จะใช้ exact search")
+                        return
+                    started = time.time()
+                    quantizer.train(self._training_sample(config.embedding.quantization_train_size))
+                    quantizer = self.store.save_quantizer(quantizer)
+                    logger.info(f"train quantizer {kind} ใน {time.time() - started:.1f} วินาที")
+                codes_tag = f"{quantizer.kind}-{fingerprint(quantizer)}"
+
+            segments = [self._with_codes(segment, quantizer, codes_tag) for segment in self._segments]
+            with self._lock:
+                self.quantizer, self._codes_tag = quantizer, codes_tag
+                self._segments = segments
+
+    def memory_stats(self) -> dict:
+        """ขนาดหน่วยความจำของดัชนี: resident = อยู่ใน heap ของ process, mapped = shard แบบ memory-mapped"""
+        with self._lock:
+            segments = list(self._segments)
+            dim = self._dim or 0
+            count = self._count
+            tail_bytes = self._matrix.nbytes + self._ids.nbytes + self._documents.nbytes if self._matrix is not None else 0
+            quantizer = self.quantizer
+
+        code_bytes = sum(segment.codes.nbytes for segment in segments if segment.codes is not None)
+        mask_bytes = sum(segment.valid.nbytes for segment in segments if segment.valid is not None)
+        mask_bytes += sum(segment.documents.nbytes for segment in segments if segment.documents is not None)
+        mapped_bytes = sum(segment.matrix.nbytes + segment.ids.nbytes for segment in segments)
+        resident_bytes = code_bytes + mask_bytes + tail_bytes
+
+        return {
+            "chunks": count,
+            "dim": dim,
+            "quantization": quantizer.kind if quantizer is not None else "none",
+            "full_bytes_per_chunk": dim * 4,
+            "code_bytes_per_chunk": quantizer.code_size if quantizer is not None else None,
+            "resident_bytes": resident_bytes,
+            "resident_bytes_per_chunk": round(resident_bytes / count, 1) if count else 0.0,
+            "mapped_bytes": mapped_bytes
+        }
+
+    def flush(self, force: bool = False) -> int:
+        """เขียน tail เป็น shard แล้วเปลี่ยนไปอ่านจาก shard แบบ memory-mapped
+        (เขียนไฟล์และเปิด shard นอก _lock: การค้นหาระหว่างนี้ยังอ่าน tail เดิม)"""
+        with self._write_lock:
+            if self.store is None or self._size == 0:
+                return 0
+            if not force and self._size < config.embedding.shard_flush_rows:
+                return 0
+
+            size = self._size
+            self.store.append(self._ids[:size].copy(), self._matrix[:size], self._documents[:size])
+            self._attach_store_shards()
+            self._ensure_quantizer()
+            return size - self._size
+
+    def compact(self, min_shards: int = COMPACT_MIN_SHARDS) -> bool:
+        """รวม shard เล็กใน store แล้วเปิด shard ที่รวมแล้ว (worker เรียกเมื่อคิวว่าง ไม่ทำใน flush ที่อยู่บนเส้นทางของคำขอ)"""
+        if self.store is None or self.store.compact(min_shards=min_shards) is None:
+            return False
+        with self._write_lock:
+            if self.is_built:
+                self._attach_store_shards()
+                self._ensure_quantizer()
+        return True
+
+    def build(self, rows: Iterable[Tuple], batch_size: int = 5000) -> int:
+        """เพิ่ม (chunk_id, embedding[, document_id]) เข้าดัชนีเป็น batch แล้วทำเครื่องหมายว่าพร้อมใช้งาน"""
+        with self._write_lock:
+            batch_ids: List[int] = []
+            batch_vectors: List[Sequence[float]] = []
+            batch_documents: List[int] = []
+
+            for chunk_id, embedding, *document_id in rows:
+                if embedding is None or len(embedding) == 0:
+                    continue
+                if self._dim is None:
+                    self._dim = len(embedding)
+                if len(embedding) != self._dim:
+                    logger.warning(f"ข้าม chunk {chunk_id}: มิติ embedding ไม่ตรงกับดัชนี")
+                    continue
+                batch_ids.append(chunk_id)
+                batch_vectors.append(embedding)
+                batch_documents.append(document_id[0] if document_id else -1)
+
+                if len(batch_ids) >= batch_size:
+                    self.add(batch_ids, batch_vectors, batch_documents)
+                    batch_ids, batch_vectors, batch_documents = [], [], []
+
+            if batch_ids:
+                self.add(batch_ids, batch_vectors, batch_documents)
+
+            self.is_built = True
+            self.flush(force=True)
+            self._ensure_quantizer()
+            logger.info(f"สร้างดัชนี vector เรียบร้อย: {self._count} chunks ({len(self._segments)} shards)")
+            return self._count
+
+    def _iter_database_rows(self, chunk_ids: Optional[np.ndarray] = None,
+                            batch_size: int = 5000) -> Iterator[Tuple[int, np.ndarray, int]]:
+        """ดึง (chunk_id, embedding, document_id) ของโมเดลนี้ทีละ batch ตามลำดับ id
+        (จาก document_chunks ถ้าสร้างด้วยโมเดลนี้ ไม่เช่นนั้นจาก chunk_embeddings)"""
+        base_query = f"""
+            SELECT dc.id, dc.document_id,
+                   CASE WHEN {NATIVE_VECTOR} THEN dc.embedding_vector ELSE ce.embedding_vector END AS embedding_vector,
+                   CASE WHEN {NATIVE_VECTOR} THEN dc.embedding ELSE NULL END AS embedding
+            FROM document_chunks dc
+            JOIN documents d ON dc.document_id = d.id
+            {MODEL_VECTOR_JOIN}
+            WHERE {HAS_MODEL_VECTOR}
+            AND d.is_processed = TRUE AND dc.canonical_chunk_id IS NULL
+        """
+
+        def batches():
+            if chunk_ids is not None:
+                for start in range(0, len(chunk_ids), batch_size):
+                    batch = [int(chunk_id) for chunk_id in chunk_ids[start:start + batch_size]]
+                    placeholders = ",".join(f":id_{i}" for i in range(len(batch)))
+                    params = {f"id_{i}": chunk_id for i, chunk_id in enumerate(batch)}
+                    params.update(model_params(self.model))
+                    with get_db_session() as session:
+                        yield session.execute(
+                            text(base_query + f" AND dc.id IN ({placeholders}) ORDER BY dc.id"), params
+                        ).fetchall()
+                return
+
+            last_id = 0
+            while True:
+                with get_db_session() as session:
+                    rows = session.execute(
+                        text(base_query + " AND dc.id > :last_id ORDER BY dc.id LIMIT :limit"),
+                        {"last_id": last_id, "limit": batch_size, **model_params(self.model)}
+                    ).fetchall()
+                if not rows:
+                    return
+                yield rows
+                last_id = rows[-1].id
+
+        for rows in batches():
+            for row in rows:
+                try:
+                    yield row.id, load_embedding(row.embedding_vector, row.embedding), row.document_id
+                except Exception as e:
+                    logger.warning(f"ไม่สามารถอ่าน embedding ของ chunk {row.id}: {e}")
+
+    def _fetch_indexable_ids(self, after_id: int = 0) -> np.ndarray:
+        """ดึงเฉพาะ id ของ chunks ที่มี embedding ของโมเดลนี้และ id มากกว่า after_id"""
+        with get_db_session() as session:
+            rows = session.execute(text(f"""
+                SELECT dc.id
+                FROM document_chunks dc
+                JOIN documents d ON dc.document_id = d.id
+                {MODEL_VECTOR_JOIN}
+                WHERE {HAS_MODEL_VECTOR}
+                AND d.is_processed = TRUE AND dc.canonical_chunk_id IS NULL
+                AND dc.id > :after_id
+            """), {"after_id": after_id, **model_params(self.model)}).fetchall()
+        return np.fromiter((row.id for row in rows), dtype=np.int64, count=len(rows))
+
+    def _fetch_model_vectors(self, after_id: int) -> Tuple[int, np.ndarray]:
+        """chunk ids ที่ได้ vector ของโมเดลนี้ใน chunk_embeddings หลัง after_id ส่งคืน (id สูงสุด, chunk ids)"""
+        with get_db_session() as session:
+            rows = session.execute(text("""
+                SELECT id, chunk_id FROM chunk_embeddings
+                WHERE model = :model AND id > :after_id
+            """), {"model": self.model, "after_id": after_id}).fetchall()
+        high_water = max((row.id for row in rows), default=after_id)
+        return high_water, np.fromiter((row.chunk_id for row in rows), dtype=np.int64, count=len(rows))
+
+    @staticmethod
+    def _fetch_chunk_documents(low_id: int, high_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """ดึง (chunk_ids, document_ids) ของ chunks ในช่วง id ที่ระบุ เรียงตาม chunk id"""
+        with get_db_session() as session:
+            rows = session.execute(text("""
+                SELECT id, document_id FROM document_chunks
+                WHERE id BETWEEN :low_id AND :high_id
+                ORDER BY id
+            """), {"low_id": low_id, "high_id": high_id}).fetchall()
+        ids = np.fromiter((row.id for row in rows), dtype=np.int64, count=len(rows))
+        documents = np.fromiter((row.document_id for row in rows), dtype=np.int32, count=len(rows))
+        return ids, documents
+
+    @staticmethod
+    def _fetch_deletions(after_id: int) -> List[Tuple[int, int]]:
+        """ดึงบันทึกการลบ (id, chunk_id) ที่ใหม่กว่า after_id"""
+        with get_db_session() as session:
+            return [
+                (row.id, row.chunk_id) for row in session.execute(text("""
+                    SELECT id, chunk_id FROM chunk_deletions
+                    WHERE id > :after_id
+                    ORDER BY id
+                """), {"after_id": after_id}).fetchall()
+            ]
+
+    @staticmethod
+    def _fetch_deletion_high_water() -> int:
+        with get_db_session() as session:
+            return session.execute(text("SELECT COALESCE(MAX(id), 0) FROM chunk_deletions")).scalar() or 0
+
+    def _fetch_model_high_water(self) -> int:
+        with get_db_session() as session:
+            return session.execute(
+                text("SELECT COALESCE(MAX(id), 0) FROM chunk_embeddings WHERE model = :model"),
+                {"model": self.model}
+            ).scalar() or 0
+
+    def _held_after(self, low_id: int) -> np.ndarray:
+        """chunk ids ในดัชนีที่มากกว่า low_id (ไม่ต้องสแกนทั้งดัชนี)"""
+        parts = [segment.ids_after(low_id) for segment in self._segments]
+        tail = self._ids[:self._size]
+        parts.append(tail[tail > low_id])
+        return np.concatenate(parts)
+
+    def build_from_database(self, batch_size: int = 5000) -> int:
+        """สร้างดัชนีจาก shard ที่มีอยู่ และดึงจาก document_chunks เฉพาะ chunks ที่ยังไม่อยู่ใน shard"""
+        with self._write_lock:
+            self.clear()
+            # อ่านก่อนดึงข้อมูล: การลบที่เกิดระหว่างสร้างดัชนีจะถูกนำไปใช้ซ้ำใน refresh (ไม่มีผลเสีย)
+            deletion_high_water = self._fetch_deletion_high_water()
+            self._model_high_water = self._fetch_model_high_water()
+            self.documents.sync()
+
+            if self.store is None:
+                self.build(self._iter_database_rows(batch_size=batch_size), batch_size=batch_size)
+                self._mark_synced(deletion_high_water)
+                return self._count
+
+            self._attach_store_shards()
+            existing = self._fetch_indexable_ids()
+
+            # chunks ที่ถูกลบจากฐานข้อมูลหลังเขียน shard
+            held = np.concatenate([segment.valid_ids() for segment in self._segments]) \
+                if self._segments else np.empty(0, dtype=np.int64)
+            stale = held[~np.isin(held, existing)]
+            if stale.size:
+                self.remove(stale)
+
+            missing = np.setdiff1d(existing, held)
+            logger.info(f"เปิด {len(self._segments)} shards, ดึง {len(missing)} chunks เพิ่มจากฐานข้อมูล")
+            self.build(self._iter_database_rows(missing, batch_size), batch_size=batch_size)
+            self._mark_synced(deletion_high_water, int(existing.max()) if existing.size else 0)
+            return self._count
+
+    def _mark_synced(self, deletion_high_water: int, high_water: int = None):
+        """บันทึก high-water mark หลังสร้างดัชนี"""
+        if high_water is None:
+            held = self._held_after(0)
+            high_water = int(held.max()) if held.size else 0
+        self._high_water = high_water
+        self._deletion_high_water = deletion_high_water
+        self._last_refresh = time.monotonic()
+
+    def refresh(self, force: bool = False,
+                batch_size: int = 5000) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """sync เฉพาะส่วนที่เปลี่ยนตั้งแต่ครั้งก่อน ส่งคืน (ids ที่เพิ่ม, vectors ที่ normalize แล้ว, ids ที่ลบ)
+        อ่านฐานข้อมูลนอก _lock การค้นหาจึงไม่ต้องรอ (ผู้เรียกที่ไม่ force ข้ามถ้ามี refresh อื่นกำลังทำงาน)"""
+        empty = (np.empty(0, dtype=np.int64), np.empty((0, self._dim or 0), dtype=np.float32),
+                 np.empty(0, dtype=np.int64))
+
+        if not self.is_built or not self._write_lock.acquire(blocking=force):
+            return empty
+        try:
+            now = time.monotonic()
+            if not force and now - self._last_refresh < config.embedding.index_refresh_interval:
+                return empty
+            self._last_refresh = now
+
+            # ลบตามบันทึกการลบ
+            deletions = self._fetch_deletions(self._deletion_high_water)
+            removed_ids = np.asarray([chunk_id for _, chunk_id in deletions], dtype=np.int64)
+            if deletions:
+                self.remove(removed_ids)
+                self._deletion_high_water = deletions[-1][0]
+
+            # chunks ใหม่: ตรวจย้อนหลังเล็กน้อยเผื่อ transaction ที่ได้ id น้อยกว่าแต่ commit ทีหลัง
+            low_id = max(0, self._high_water - config.embedding.index_refresh_lookback)
+            candidate_ids = self._fetch_indexable_ids(low_id)
+            new_ids = np.setdiff1d(candidate_ids, self._held_after(low_id))
+            # chunks เดิมที่เพิ่งได้ vector ของโมเดลนี้ (สร้าง embeddings ใหม่ในพื้นหลัง)
+            self._model_high_water, reembedded = self._fetch_model_vectors(self._model_high_water)
+            if reembedded.size:
+                new_ids = np.union1d(new_ids, np.setdiff1d(reembedded, self._held_after(0)))
+            new_ids = new_ids[~np.isin(new_ids, removed_ids)]
+
+            added_ids: List[int] = []
+            added_vectors: List[np.ndarray] = []
+            added_documents: List[int] = []
+            for chunk_id, embedding, document_id in self._iter_database_rows(new_ids, batch_size):
+                if embedding is None or (self._dim is not None and len(embedding) != self._dim):
+                    continue
+                added_ids.append(chunk_id)
+                added_vectors.append(embedding)
+                added_documents.append(document_id)
+
+            vectors = self.normalize(np.asarray(added_vectors)) if added_ids else empty[1]
+            if added_ids:
+                self.add(added_ids, vectors, added_documents)
+            # หมวดหมู่/การเผยแพร่/เจ้าของของเอกสารที่แก้ไขตั้งแต่ครั้งก่อน
+            self.documents.sync()
+            if candidate_ids.size:
+                self._high_water = max(self._high_water, int(candidate_ids.max()))
+
+            if added_ids or deletions:
+                logger.info(f"refresh ดัชนี vector: เพิ่ม {len(added_ids)} ลบ {len(deletions)} chunks")
+            return np.asarray(added_ids, dtype=np.int64), vectors, removed_ids
+        finally:
+            self._write_lock.release()
+
+    def ensure_built(self) -> int:
+        """สร้างดัชนีจากฐานข้อมูลถ้ายังไม่เคยสร้าง (ใช้ในงานพื้นหลังและ CLI: EmbeddingService สร้างดัชนีแรกในพื้นหลัง)"""
+        with self._write_lock:
+            if not self.is_built:
+                self.build_from_database()
+            return self._count
+
+    def search(self, query: Sequence[float], k: int,
+               candidate_ids: Optional[Sequence[int]] = None,
+               document_ids: Optional[Sequence[int]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """ค้นหา k chunks ที่ใกล้ที่สุด ส่งคืน (chunk_ids, similarities) เรียงจากมากไปน้อย
+        candidate_ids/document_ids จำกัดแถวก่อนคำนวณคะแนน (document_ids ได้จาก self.documents.matching)"""
+        with self._lock:
+            # array ที่ถูกแทนที่จะเป็น object ใหม่ จึงใช้ reference เหล่านี้นอก lock ได้อย่างปลอดภัย
+            parts = list(self._segments)
+            if self._size:
+                parts.append(_Segment("tail", self._ids[:self._size], self._matrix[:self._size],
+                                      documents=self._documents[:self._size]))
+            dim = self._dim
+            quantizer = self.quantizer
+
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+        if not parts or k <= 0:
+            return empty
+
+        query = self.normalize(query)[0]
+        if query.shape[0] != dim:
+            logger.error(f"มิติของ query ({query.shape[0]}) ไม่ตรงกับดัชนี ({dim})")
+            return empty
+
+        candidates = None if candidate_ids is None else np.asarray(candidate_ids, dtype=np.int64)
+        documents = None if document_ids is None else np.unique(np.asarray(document_ids, dtype=np.int64))
+        if quantizer is not None:
+            return self._search_quantized(parts, quantizer, query, k, candidates, documents)
+
+        found_ids, found_scores = [], []
+
+        for part in parts:
+            rows = self._filter_rows(part, candidates, documents)
+            if rows is not None and rows.size == 0:
+                continue
+            scores, rows = self._masked_scores(
+                part, rows, lambda selected: (part.matrix if selected is None else part.matrix[selected]) @ query
+            )
+            ids = np.asarray(part.ids) if rows is None else np.asarray(part.ids)[rows]
+
+            top_k = min(k, scores.shape[0])
+            top = np.argpartition(-scores, top_k - 1)[:top_k]
+            found_ids.append(ids[top])
+            found_scores.append(scores[top])
+
+        return self._merge_top_k(found_ids, found_scores, k)
+
+    @staticmethod
+    def _filter_rows(part: _Segment, candidates: Optional[np.ndarray],
+                     documents: Optional[np.ndarray]) -> Optional[np.ndarray]:
+        """แถวที่ผ่านตัวกรองและยังใช้งานได้ (None = ไม่มีตัวกรอง)"""
+        if candidates is None and documents is None:
+            return None
+        if documents is not None:
+            rows = part.document_rows(documents)
+            if candidates is not None:
+                rows = rows[np.isin(np.asarray(part.ids)[rows], candidates)]
+        else:
+            rows = np.flatnonzero(np.isin(part.ids, candidates))
+        if part.valid is not None:
+            rows = rows[part.valid[rows]]
+        return rows
+
+    @staticmethod
+    def _masked_scores(part: _Segment, rows: Optional[np.ndarray],
+                       score) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """คำนวณคะแนนเฉพาะแถวที่ผ่านตัวกรอง ส่งคืน (scores, rows)
+        ถ้าตัวกรองครอบคลุมเกินครึ่ง segment จะคำนวณทุกแถวแล้วใส่ -inf แทน (ถูกกว่าการคัดลอกแถว) และ rows=None"""
+        if rows is not None and rows.size <= len(part.ids) // 2:
+            return score(rows), rows
+
+        scores = score(None)
+        if rows is not None:
+            mask = np.zeros(scores.shape[0], dtype=bool)
+            mask[rows] = True
+        else:
+            mask = part.valid
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+        return scores, None
+
+    def _search_quantized(self, parts: List[_Segment], quantizer, query: np.ndarray, k: int,
+                          candidates: Optional[np.ndarray] = None,
+                          documents: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """รอบแรกให้คะแนนด้วย codes แล้วจัดอันดับ rerank_candidates อันดับแรกใหม่ด้วย vectors เต็ม"""
+        n_candidates = max(k, config.embedding.rerank_candidates)
+        prepared = quantizer.prepare_query(query)
+        found_ids, found_scores = [], []
+        shortlist = []  # (ตำแหน่ง part, แถว, คะแนนประมาณ)
+
+        for position, part in enumerate(parts):
+            rows = self._filter_rows(part, candidates, documents)
+            if rows is not None and rows.size == 0:
+                continue
+
+            if part.codes is None:
+                # tail และ shard ที่ยังไม่มี codes มีขนาดเล็ก ใช้ exact ได้เลย
+                scores, rows = self._masked_scores(
+                    part, rows, lambda selected: (part.matrix if selected is None else part.matrix[selected]) @ query
+                )
+                ids = np.asarray(part.ids) if rows is None else np.asarray(part.ids)[rows]
+                top = np.argpartition(-scores, min(k, scores.shape[0]) - 1)[:k]
+                found_ids.append(ids[top])
+                found_scores.append(scores[top])
+                continue
+
+            approx, rows = self._masked_scores(
+                part, rows,
+                lambda selected: quantizer.score(part.codes if selected is None else part.codes[selected], prepared)
+            )
+            top = np.argpartition(-approx, min(n_candidates, approx.shape[0]) - 1)[:n_candidates]
+            top = top[np.isfinite(approx[top])]
+            shortlist.append((np.full(top.size, position), top if rows is None else rows[top], approx[top]))
+
+        if shortlist:
+            positions = np.concatenate([item[0] for item in shortlist])
+            rows = np.concatenate([item[1] for item in shortlist])
+            approx = np.concatenate([item[2] for item in shortlist])
+            if approx.shape[0] > n_candidates:
+                keep = np.argpartition(-approx, n_candidates - 1)[:n_candidates]
+                positions, rows = positions[keep], rows[keep]
+
+            for position in np.unique(positions):
+                part = parts[position]
+                # เรียงแถวเพื่อให้อ่าน shard แบบ memory-mapped ตามลำดับ
+                part_rows = np.sort(rows[positions == position])
+                found_ids.append(np.asarray(part.ids)[part_rows])
+                found_scores.append(np.asarray(part.matrix[part_rows]) @ query)
+
+        return self._merge_top_k(found_ids, found_scores, k)
+
+    @staticmethod
+    def _merge_top_k(found_ids: List[np.ndarray], found_scores: List[np.ndarray],
+                     k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """รวมผลจากแต่ละ segment แล้วเลือก k อันดับแรก"""
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+        if not found_ids:
+            return empty
+
+        ids = np.concatenate(found_ids)
+        scores = np.concatenate(found_scores)
+        keep = np.isfinite(scores)
+        ids, scores = ids[keep], scores[keep]
+
+        k = min(k, scores.shape[0])
+        if k == 0:
+            return empty
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return ids[top], scores[top]
+
+# สร้าง instance หลัก (ใช้ร่วมกันทั้ง process)
+vector_index = VectorIndex(
+    store=ShardedEmbeddingStore() if config.embedding.shard_storage else None
+)
+
+def create_vector_index(model: str) -> VectorIndex:
+    """ดัชนีใหม่ของโมเดลที่ระบุ (shard แยกโฟลเดอร์ตามโมเดล)"""
+    return VectorIndex(
+        store=ShardedEmbeddingStore(model) if config.embedding.shard_storage else None,
+        model=model
+    )
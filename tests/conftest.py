@@ -0,0 +1,51 @@
+"""
+fixtures ร่วมของชุดทดสอบ: ฐานข้อมูล sqlite ชั่วคราว และโฟลเดอร์ดัชนีชั่วคราว
+"""
+
+import pytest
+from sqlalchemy import create_engine
+
+from config import config
+from database.database import db_manager, get_db_session
+from database.models import Base, Document, DocumentChunk, User
+
+# โมเดล embeddings ของ chunks ที่สร้างในการทดสอบ
+MODEL = "test-model"
+
+@pytest.fixture
+def db(tmp_path):
+    """ฐานข้อมูล sqlite เปล่าที่ผูกกับ db_manager (ปิดเมื่อจบการทดสอบ)"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    Base.metadata.create_all(engine)
+    db_manager.bind(engine)
+    with get_db_session() as session:
+        session.add(User(id=1, username="tester", email="tester@example.com", full_name="Tester"))
+        session.commit()
+    yield engine
+    db_manager.close_all_sessions()
+
+@pytest.fixture(autouse=True)
+def embeddings_folder(tmp_path, monkeypatch):
+    """ดัชนีที่บันทึกลงดิสก์เขียนในโฟลเดอร์ชั่วคราว"""
+    folder = tmp_path / "embeddings"
+    monkeypatch.setattr(config.app, "embeddings_folder", str(folder))
+    return folder
+
+@pytest.fixture
+def make_document(db):
+    """สร้างเอกสารพร้อม chunks [(content, embedding)] ส่งคืน document id"""
+    def make(text: str = "เอกสารทดสอบ", chunks=(), **fields) -> int:
+        fields.setdefault("is_processed", True)
+        with get_db_session() as session:
+            document = Document(
+                filename="test.txt", original_filename="test.txt", file_path="test.txt", file_size=len(text or ""),
+                file_type="txt", mime_type="text/plain", uploaded_by=1, extracted_text=text, **fields
+            )
+            session.add(document)
+            session.flush()
+            for index, (content, embedding) in enumerate(chunks):
+                session.add(DocumentChunk(document_id=document.id, chunk_index=index, content=content,
+                                          embedding=embedding, embedding_model=MODEL))
+            session.commit()
+            return document.id
+    return make
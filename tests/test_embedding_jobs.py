@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from config import config
+from database.database import get_db_session
+from database.models import EmbeddingJob
+from services.embedding_jobs import EmbeddingJobQueue
+
+@pytest.fixture
+def queue(db, monkeypatch):
+    monkeypatch.setattr(config.embedding, "job_max_attempts", 2)
+    monkeypatch.setattr(config.embedding, "job_retry_delay", 60)
+    return EmbeddingJobQueue()
+
+def expire_lease(job_id: int):
+    with get_db_session() as session:
+        session.query(EmbeddingJob).filter(EmbeddingJob.id == job_id).update(
+            {EmbeddingJob.lease_expires_at: datetime.utcnow() - timedelta(seconds=1)}
+        )
+        session.commit()
+
+def test_enqueue_skips_duplicates_and_active_jobs(queue):
+    assert queue.enqueue([1, 1, 2]) == 2
+    assert queue.enqueue([1, 2]) == 0
+    assert queue.stats()["queued"] == 2
+
+def test_job_is_claimed_by_one_worker(queue):
+    queue.enqueue([1])
+
+    [job] = queue.claim("worker-a", limit=5)
+    assert (job.status, job.worker_id, job.attempts) == ("running", "worker-a", 1)
+    assert job.lease_expires_at > datetime.utcnow()
+    assert queue.claim("worker-b") == []
+
+def test_lease_belongs_to_claiming_worker(queue):
+    queue.enqueue([1])
+    [job] = queue.claim("worker-a")
+
+    assert queue.extend_lease(job.id, "worker-a")
+    assert not queue.extend_lease(job.id, "worker-b")
+    assert not queue.complete(job.id, "worker-b")
+    assert queue.complete(job.id, "worker-a")
+    assert queue.get_job(1).status == "completed"
+    assert not queue.extend_lease(job.id, "worker-a")
+
+def test_expired_lease_moves_job_to_another_worker(queue):
+    queue.enqueue([1])
+    [job] = queue.claim("worker-a")
+    expire_lease(job.id)
+
+    [reclaimed] = queue.claim("worker-b")
+    assert (reclaimed.id, reclaimed.worker_id, reclaimed.attempts) == (job.id, "worker-b", 2)
+    assert not queue.extend_lease(job.id, "worker-a")
+    assert not queue.complete(job.id, "worker-a")
+    assert queue.complete(job.id, "worker-b")
+
+def test_expired_lease_at_max_attempts_fails_job(queue):
+    queue.enqueue([1])
+    for worker in ("worker-a", "worker-b"):
+        [job] = queue.claim(worker)
+        expire_lease(job.id)
+
+    assert queue.claim("worker-c") == []
+    assert queue.get_job(1).status == "failed"
+
+def test_fail_requeues_with_delay_then_fails(queue):
+    queue.enqueue([1])
+    [job] = queue.claim("worker-a")
+
+    assert queue.fail(job.id, "worker-a", "timeout")
+    retried = queue.get_job(1)
+    assert (retried.status, retried.error, retried.worker_id) == ("queued", "timeout", "worker-a")
+    assert retried.available_at > datetime.utcnow() + timedelta(seconds=50)
+    assert queue.claim("worker-a") == []
+
+    with get_db_session() as session:
+        session.query(EmbeddingJob).filter(EmbeddingJob.id == job.id).update(
+            {EmbeddingJob.available_at: datetime.utcnow() - timedelta(seconds=1)}
+        )
+        session.commit()
+    [job] = queue.claim("worker-b")
+    assert queue.fail(job.id, "worker-b", "timeout again")
+    assert queue.get_job(1).status == "failed"
+    assert queue.claim("worker-b") == []
+
+def test_enqueue_restarts_finished_jobs(queue):
+    queue.enqueue([1])
+    [job] = queue.claim("worker-a")
+    queue.complete(job.id, "worker-a")
+
+    assert queue.enqueue([1]) == 1
+    restarted = queue.get_job(1)
+    assert (restarted.status, restarted.attempts, restarted.worker_id) == ("queued", 0, None)
+
+def test_enqueue_pending_skips_documents_without_text(queue, make_document):
+    with_text = make_document("มีข้อความ", processing_status="pending")
+    make_document("", processing_status="pending")
+    make_document(None, processing_status="pending")
+    make_document("เสร็จแล้ว", processing_status="completed")
+
+    assert queue.enqueue_pending() == 1
+    assert queue.get_job(with_text) is not None
+    assert queue.enqueue_pending() == 0
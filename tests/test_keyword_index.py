@@ -0,0 +1,88 @@
+import pytest
+
+from database.database import get_db_session
+from database.models import ChunkDeletion, DocumentChunk
+from services.keyword_index import KeywordIndex, KeywordTokenizer
+
+@pytest.fixture
+def index(tmp_path):
+    # bigram ไม่ขึ้นกับการติดตั้ง pythainlp ผลการตัดคำจึงเหมือนกันทุกเครื่อง
+    return KeywordIndex(folder=str(tmp_path), tokenizer=KeywordTokenizer("bigram"))
+
+def test_tokenizer_keeps_codes_and_numbers():
+    tokens = KeywordTokenizer("bigram")("แบบฟอร์ม NT-2024/15 ปี ๒๕๖๗")
+
+    assert {"nt-2024/15", "nt202415", "2024", "15", "2567"} <= set(tokens)
+    assert "แบ" in tokens
+
+def test_more_occurrences_rank_higher(index):
+    index.add([
+        (1, 1, "router modem router cable"),
+        (2, 1, "router modem cable switch"),
+        (3, 1, "modem cable switch fiber"),
+    ])
+
+    keys, scores = index.search("router", 10)
+    assert list(keys) == [1, 2]
+    assert scores[0] > scores[1] > 0
+
+def test_rare_term_outweighs_common_term(index):
+    index.add([(key, 1, "invoice payment") for key in range(1, 10)] + [(10, 1, "invoice refund")])
+
+    keys, _ = index.search("invoice refund", 3)
+    assert keys[0] == 10
+
+def test_shorter_row_ranks_higher_for_same_frequency(index):
+    index.add([
+        (1, 1, "contract " + "filler " * 30),
+        (2, 1, "contract filler"),
+    ])
+
+    keys, _ = index.search("contract", 2)
+    assert list(keys) == [2, 1]
+
+def test_code_query_matches_parts(index):
+    index.add([(1, 1, "คำร้อง NT-2024/15"), (2, 1, "สัญญา NT-2023/07")])
+
+    assert index.search("nt-2024/15", 5)[0][0] == 1
+    assert list(index.search("2023", 5)[0]) == [2]
+
+def test_document_filter_and_remove(index):
+    index.add([(1, 1, "ติดตั้งอินเทอร์เน็ต"), (2, 2, "ติดตั้งโทรศัพท์"), (3, 2, "ยกเลิกบริการ")])
+
+    assert list(index.search("ติดตั้ง", 5, document_ids=[2])[0]) == [2]
+    assert index.remove([2]) == 1
+    assert list(index.search("ติดตั้ง", 5)[0]) == [1]
+    assert index.size == 2
+
+def test_scores_survive_merge(index):
+    rows = [(key, 1, f"term{key % 7} shared word{key}") for key in range(1, 200)]
+    index.add(rows[:100])
+    index.add(rows[100:])
+    index.remove([5, 6])
+    before = index.search("term3 shared", 20)
+
+    index._merge()
+    after = index.search("term3 shared", 20)
+    assert list(after[0]) == list(before[0])
+    assert after[1] == pytest.approx(before[1])
+
+def test_build_and_refresh_from_database(make_document, tmp_path):
+    document_id = make_document(chunks=[("ภาษีเงินได้ ภ.ง.ด.91", None), ("สัญญาเช่าวงจร", None)])
+    index = KeywordIndex(folder=str(tmp_path), tokenizer=KeywordTokenizer("bigram"))
+    assert index.build_from_database() == 2
+
+    with get_db_session() as session:
+        session.add(DocumentChunk(document_id=document_id, chunk_index=2, content="ใบแจ้งหนี้ INV-555"))
+        session.query(DocumentChunk).filter(DocumentChunk.id == 1).delete()
+        session.add(ChunkDeletion(chunk_id=1, document_id=document_id))
+        session.commit()
+
+    assert index.refresh(force=True) == (1, 1)
+    assert list(index.search("inv-555", 5)[0]) == [3]
+    assert index.search("ภงด91", 5)[0].size == 0
+
+    assert index.save(force=True)
+    reloaded = KeywordIndex(folder=str(tmp_path), tokenizer=KeywordTokenizer("bigram"))
+    assert reloaded.load()
+    assert list(reloaded.search("inv-555", 5)[0]) == [3]
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from services.near_duplicates import SIMHASH_BITS, group, nearest, simhash
+
+def signed(value: int) -> int:
+    """uint64 -> int64 แบบเดียวกับคอลัมน์ BIGINT"""
+    return value - (1 << SIMHASH_BITS) if value >= 1 << (SIMHASH_BITS - 1) else value
+
+def flip(signature: int, bits) -> int:
+    value = signature & ((1 << SIMHASH_BITS) - 1)
+    for bit in bits:
+        value ^= 1 << bit
+    return signed(value)
+
+@pytest.fixture
+def base():
+    rng = np.random.default_rng(0)
+    return [signed(int(value)) for value in rng.integers(0, 2 ** 63, size=20, dtype=np.uint64) * 2 + 1]
+
+def test_exact_match(base):
+    ids = np.arange(100, 120)
+    assert list(nearest(base[:5], ids, np.asarray(base), 3)) == [100, 101, 102, 103, 104]
+
+def test_one_flip_per_band_is_found(base):
+    # distance 3 -> 4 ช่วง ช่วงละ 16 บิต: เปลี่ยนสามช่วง ช่วงที่สี่ยังเหมือนเดิม
+    query = flip(base[7], [0, 16, 32])
+    assert nearest([query], np.arange(20), np.asarray(base), 3)[0] == 7
+
+def test_all_flips_in_one_band_are_found(base):
+    query = flip(base[7], [60, 61, 62])
+    assert nearest([query], np.arange(20), np.asarray(base), 3)[0] == 7
+
+def test_more_than_distance_bits_is_not_a_match(base):
+    query = flip(base[7], [0, 1, 2, 3])
+    assert nearest([query], np.arange(20), np.asarray(base[7:8]), 3)[0] == -1
+
+def test_closest_candidate_wins(base):
+    candidates = np.asarray([flip(base[0], [1, 2, 3]), flip(base[0], [5]), flip(base[0], [9, 40])])
+    assert nearest([base[0]], np.asarray([11, 12, 13]), candidates, 3)[0] == 12
+
+def test_sign_bit_is_compared(base):
+    query = flip(base[3], [63])
+    assert query < 0 < base[3] or base[3] < 0 < query
+    assert nearest([query], np.arange(20), np.asarray(base), 1)[0] == 3
+
+def test_zero_distance_requires_identical_signature(base):
+    assert nearest([flip(base[2], [10])], np.arange(20), np.asarray(base), 0)[0] == -1
+    assert nearest([base[2]], np.arange(20), np.asarray(base), 0)[0] == 2
+
+def test_empty_inputs(base):
+    assert list(nearest(base[:2], np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), 3)) == [-1, -1]
+    assert nearest([], np.arange(20), np.asarray(base), 3).size == 0
+
+def test_simhash_of_similar_text_is_close():
+    text = "รายงานผลการดำเนินงานประจำเดือน มกราคม ของศูนย์บริการลูกค้า ภาคเหนือ ฉบับที่ 1 " * 5
+    same = simhash(text)
+    near = simhash(text.replace("ฉบับที่ 1", "ฉบับที่ 2", 1))
+    other = simhash("สัญญาเช่าวงจรเชื่อมต่ออินเทอร์เน็ตความเร็วสูงสำหรับองค์กร")
+
+    def distance(a, b):
+        return bin((a ^ b) & ((1 << SIMHASH_BITS) - 1)).count("1")
+    assert simhash(text) == same
+    assert distance(same, near) < distance(same, other)
+
+def test_group_normalizes_whitespace():
+    assert list(group(["a  b", "c", "a b", " c "])) == [0, 1, 0, 1]
@@ -0,0 +1,86 @@
+import random
+
+import pytest
+
+from services.text_chunker import THAI_COMBINING, THAI_LEADING, TextChunker, iter_segments
+
+WORDS = ["การ", "ประชุม", "ลูกค้า", "บริการ", "ไฟฟ้า", "สัญญา", "เอกสาร", "ที่", "และ", "เป็น", "ผู้", "ใช้", "งาน", "ระบบ"]
+
+def thai_pages(count: int) -> str:
+    rng = random.Random(0)
+    def paragraph():
+        return " ".join("".join(rng.choice(WORDS) for _ in range(rng.randint(8, 30))) for _ in range(rng.randint(2, 5)))
+    return "\n\n".join(
+        f"--- หน้า {page} ---\n" + "\n\n".join(paragraph() for _ in range(rng.randint(2, 4)))
+        for page in range(1, count + 1)
+    )
+
+def test_chunks_fit_size_and_match_source_offsets():
+    text = thai_pages(30)
+    chunks = list(TextChunker(200, 20).chunks(iter_segments(text)))
+
+    assert chunks
+    assert [chunk.index for chunk in chunks] == list(range(len(chunks)))
+    for chunk in chunks:
+        assert 0 < len(chunk.text) <= 200
+        assert text[chunk.start_char:chunk.end_char] == chunk.text
+
+def test_chunks_cover_all_text():
+    text = " ".join(f"Sentence number {i} ends here." for i in range(400))
+    covered = bytearray(len(text))
+    for chunk in TextChunker(120, 15).chunks(iter_segments(text)):
+        covered[chunk.start_char:chunk.end_char] = b"\1" * (chunk.end_char - chunk.start_char)
+
+    assert all(covered[i] or text[i].isspace() for i in range(len(text)))
+
+def test_consecutive_chunks_overlap_at_word_boundary():
+    text = " ".join(f"word{i}" for i in range(2000))
+    chunks = list(TextChunker(100, 20).chunks(iter_segments(text)))
+
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert previous.end_char - 20 <= chunk.start_char < previous.end_char
+        assert text[chunk.start_char - 1] == " "
+
+def test_english_cuts_at_sentence_end():
+    text = " ".join("The quick brown fox jumps over the lazy dog." for _ in range(200))
+    chunks = TextChunker(200, 0).chunk_text(text)
+
+    assert all(chunk.endswith(".") for chunk in chunks)
+
+def test_chunks_do_not_cross_pages_and_carry_page_number():
+    text = thai_pages(20)
+    markers = [(text.index(f"--- หน้า {page} ---"), page) for page in range(1, 21)]
+
+    for chunk in TextChunker(300, 30).chunks(iter_segments(text)):
+        assert "--- หน้า" not in chunk.text[1:]
+        expected = max(page for position, page in markers if position <= chunk.start_char)
+        assert chunk.page_number == expected
+
+def test_thai_without_spaces_keeps_vowels_with_consonants():
+    rng = random.Random(1)
+    text = "".join(rng.choice(WORDS) for _ in range(3000))
+    chunks = TextChunker(100, 10).chunk_text(text)
+
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert chunk[0] not in THAI_COMBINING
+        assert chunk[-1] not in THAI_LEADING
+
+def test_segment_size_does_not_change_chunks():
+    text = thai_pages(15)
+    chunker = TextChunker(250, 25)
+    whole = [(chunk.text, chunk.start_char) for chunk in chunker.chunks([text])]
+
+    assert [(chunk.text, chunk.start_char) for chunk in chunker.chunks(iter_segments(text, 7))] == whole
+    assert [(chunk.text, chunk.start_char) for chunk in chunker.chunks(iter_segments(text, 4096))] == whole
+
+def test_short_and_blank_text():
+    chunker = TextChunker(100, 10)
+
+    assert chunker.chunk_text("  short  ") == ["short"]
+    assert chunker.chunk_text("") == []
+    assert chunker.chunk_text(" \n\n ") == []
+
+def test_overlap_must_be_smaller_than_chunk_size():
+    with pytest.raises(ValueError):
+        TextChunker(100, 100)
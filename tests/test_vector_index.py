@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from database.database import get_db_session
+from database.models import ChunkDeletion, DocumentChunk
+from services.vector_index import VectorIndex
+
+from conftest import MODEL
+
+DIM = 16
+
+@pytest.fixture
+def vectors():
+    return np.random.default_rng(0).normal(size=(50, DIM)).astype(np.float32)
+
+def test_search_returns_nearest_first(vectors):
+    index = VectorIndex(model=MODEL)
+    assert index.add(np.arange(1, 51), vectors) == 50
+
+    ids, scores = index.search(vectors[9], 5)
+    assert ids[0] == 10
+    assert scores[0] == pytest.approx(1.0, abs=1e-5)
+    assert list(scores) == sorted(scores, reverse=True)
+    assert index.size == 50
+
+def test_add_rejects_other_dimension(vectors):
+    index = VectorIndex(model=MODEL)
+    index.add([1], vectors[:1])
+
+    assert index.add([2], np.ones((1, DIM + 1))) == 0
+    assert index.size == 1
+
+def test_removed_ids_are_not_returned(vectors):
+    index = VectorIndex(model=MODEL)
+    index.add(np.arange(1, 51), vectors)
+
+    assert index.remove([10, 11, 999]) == 2
+    ids, _ = index.search(vectors[9], 50)
+    assert 10 not in ids and 11 not in ids
+    assert index.size == 48
+    assert index.remove([10]) == 0
+
+def test_search_filters(vectors):
+    index = VectorIndex(model=MODEL)
+    index.add(np.arange(1, 51), vectors, documents=np.repeat([1, 2], 25))
+
+    ids, _ = index.search(vectors[0], 10, candidate_ids=[3, 4, 5])
+    assert set(ids) == {3, 4, 5}
+    ids, _ = index.search(vectors[0], 50, document_ids=[2])
+    assert set(ids) == set(range(26, 51))
+
+def test_refresh_applies_new_chunks_and_deletions(make_document, vectors):
+    document_id = make_document(chunks=[(f"chunk {i}", vectors[i].tolist()) for i in range(10)])
+    index = VectorIndex(model=MODEL)
+    assert index.build_from_database() == 10
+
+    with get_db_session() as session:
+        new_chunk = DocumentChunk(document_id=document_id, chunk_index=10, content="new",
+                                  embedding=vectors[20].tolist(), embedding_model=MODEL)
+        session.add(new_chunk)
+        session.query(DocumentChunk).filter(DocumentChunk.id == 1).delete()
+        session.add(ChunkDeletion(chunk_id=1, document_id=document_id))
+        session.commit()
+        new_id = new_chunk.id
+
+    added, added_vectors, removed = index.refresh(force=True)
+    assert list(added) == [new_id]
+    assert added_vectors.shape == (1, DIM)
+    assert list(removed) == [1]
+    assert index.size == 10
+
+    ids, _ = index.search(vectors[20], 1)
+    assert ids[0] == new_id
+    ids, _ = index.search(vectors[0], 10)
+    assert 1 not in ids
+
+    # ไม่มีการเปลี่ยนแปลง: refresh ซ้ำไม่เพิ่มแถวซ้ำ
+    added, _, removed = index.refresh(force=True)
+    assert added.size == 0 and removed.size == 0
+    assert index.size == 10
+
+def test_refresh_before_build_does_nothing(db):
+    added, _, removed = VectorIndex(model=MODEL).refresh(force=True)
+    assert added.size == 0 and removed.size == 0
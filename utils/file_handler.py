@@ -21,10 +21,19 @@ from pptx import Presentation
 
 from config import config
 from database.database import get_db_session
-from database.models import Document
+from database.models import ChatContext, Document, EmbeddingJob
+from services.embedding_jobs import embedding_job_queue
+from services.embedding_service import embedding_service
 
 logger = logging.getLogger(__name__)
 
+# อ่านไฟล์ทีละ 1MB ตอนคำนวณ hash (ไฟล์หลายร้อย MB ใช้ system call น้อยกว่าอ่านทีละ 4KB มาก)
+HASH_READ_SIZE = 1024 * 1024
+
+def content_hash(data: bytes) -> str:
+    """blake2b 256 บิตของเนื้อไฟล์ (เร็วกว่า MD5 บน CPU 64 บิต)"""
+    return hashlib.blake2b(data, digest_size=32).hexdigest()
+
 class FileHandler:
     """คลาสจัดการไฟล์"""
     
@@ -35,12 +44,24 @@ class FileHandler:
     def save_uploaded_file(self, uploaded_file, category: str = None, 
                           tags: List[str] = None, is_public: bool = False,
                           user_id: int = 1) -> Optional[Dict[str, Any]]:
-        """บันทึกไฟล์ที่อัพโหลดและข้อมูลลงฐานข้อมูล"""
+        """บันทึกไฟล์ที่อัพโหลดและข้อมูลลงฐานข้อมูล (ไฟล์ที่ซ้ำกับเอกสารเดิมอ้างอิงเอกสารเดิมแทน)"""
         
+        file_path = None
         try:
+            data = uploaded_file.getvalue()
+            file_hash = content_hash(data)
+            file_extension = Path(uploaded_file.name).suffix.lower()
+            mime_type = mimetypes.guess_type(uploaded_file.name)[0] or 'application/octet-stream'
+            category = category or "เอกสารทั่วไป"
+            
+            if config.app.dedup_uploads:
+                duplicate = self._save_duplicate(uploaded_file, file_hash, len(data), file_extension,
+                                                 mime_type, category, tags, is_public, user_id)
+                if duplicate:
+                    return duplicate
+            
             # สร้างชื่อไฟล์ใหม่
             file_uuid = str(uuid.uuid4())
-            file_extension = Path(uploaded_file.name).suffix.lower()
             new_filename = f"{file_uuid}{file_extension}"
             
             # เส้นทางไฟล์
@@ -48,11 +69,10 @@ class FileHandler:
             
             # บันทึกไฟล์
             with open(file_path, "wb") as f:
-                f.write(uploaded_file.getvalue())
+                f.write(data)
             
             # ดึงข้อมูลไฟล์
             file_size = file_path.stat().st_size
-            mime_type = mimetypes.guess_type(uploaded_file.name)[0] or 'application/octet-stream'
             
             # สกัดข้อความ
             extracted_text = self.extract_text_from_file(file_path, file_extension)
@@ -66,11 +86,12 @@ class FileHandler:
                     file_size=file_size,
                     file_type=file_extension[1:],  # ลบจุดออก
                     mime_type=mime_type,
-                    category=category or "เอกสารทั่วไป",
+                    content_hash=file_hash,
+                    category=category,
                     tags=tags,
                     extracted_text=extracted_text,
                     is_processed=bool(extracted_text),
-                    processing_status="completed" if extracted_text else "pending",
+                    processing_status="pending",  # รอ worker สร้าง embeddings (services/embedding_worker.py)
                     uploaded_by=user_id,
                     is_public=is_public
                 )
@@ -81,27 +102,186 @@ class FileHandler:
                 
                 logger.info(f"บันทึกไฟล์ {uploaded_file.name} สำเร็จ (ID: {document.id})")
                 
+                # ส่งเข้าคิว embeddings แล้วกลับทันที (ถ้าเพิ่มไม่สำเร็จ worker จะดึงเอกสาร pending เข้าคิวเอง)
+                if extracted_text:
+                    self._enqueue(document.id)
+                
                 return {
                     "success": True,
                     "document_id": document.id,
                     "filename": new_filename,
                     "original_filename": uploaded_file.name,
                     "file_size": file_size,
-                    "extracted_text": bool(extracted_text)
+                    "extracted_text": bool(extracted_text),
+                    "queued": bool(extracted_text),
+                    "duplicate_of": None
                 }
                 
         except Exception as e:
             logger.error(f"เกิดข้อผิดพลาดในการบันทึกไฟล์ {uploaded_file.name}: {e}")
             
-            # ลบไฟล์ถ้าบันทึกไม่สำเร็จ
+            # ลบไฟล์ถ้าบันทึกไม่สำเร็จ (เฉพาะไฟล์ที่เขียนในรอบนี้ ไม่ใช่ไฟล์ของเอกสารต้นฉบับ)
             try:
-                if file_path.exists():
+                if file_path is not None and file_path.exists():
                     file_path.unlink()
             except:
                 pass
                 
             return None
     
+    @staticmethod
+    def _enqueue(document_id: int):
+        try:
+            embedding_job_queue.enqueue([document_id])
+        except Exception as e:
+            logger.warning(f"ไม่สามารถเพิ่มเอกสาร {document_id} เข้าคิว embeddings: {e}")
+    
+    @staticmethod
+    def _find_original(session, file_hash: str, file_size: int) -> Optional[Document]:
+        """เอกสารต้นฉบับที่เนื้อไฟล์ตรงกันและไฟล์ยังอยู่ (เทียบเฉพาะเอกสารที่มี hash แล้ว
+        เอกสารที่อัพโหลดก่อนมี content_hash ให้รัน backfill_content_hashes ครั้งเดียว)"""
+        candidates = session.query(Document).filter(
+            Document.content_hash == file_hash,
+            Document.file_size == file_size,
+            Document.source_document_id.is_(None)
+        ).order_by(Document.id).all()
+        return next((doc for doc in candidates if Path(doc.file_path).exists()), None)
+    
+    def _save_duplicate(self, uploaded_file, file_hash: str, file_size: int, file_extension: str,
+                        mime_type: str, category: str, tags: Optional[List[str]], is_public: bool,
+                        user_id: int) -> Optional[Dict[str, Any]]:
+        """สร้างเอกสารที่อ้างอิงไฟล์และข้อความของเอกสารต้นฉบับ (ไม่เขียนไฟล์และไม่สกัดข้อความซ้ำ)
+        
+        ถ้าเจ้าของ/การเผยแพร่/หมวดหมู่ตรงกับต้นฉบับ ใช้ chunks ของต้นฉบับเลยโดยไม่สร้าง embeddings
+        ไม่เช่นนั้นสร้าง chunks ของตัวเอง (ตัวกรองการค้นหาต่างกัน) ซึ่งได้ vectors จากแคช embeddings
+        ส่งคืน None ถ้าไม่พบเอกสารที่ซ้ำ
+        """
+        with get_db_session() as session:
+            original = self._find_original(session, file_hash, file_size)
+            if original is None:
+                return None
+            
+            shares_chunks = (
+                original.uploaded_by == user_id
+                and bool(original.is_public) == bool(is_public)
+                and original.category == category
+            )
+            extracted_text = original.extracted_text
+            document = Document(
+                filename=original.filename,
+                original_filename=uploaded_file.name,
+                file_path=original.file_path,
+                file_size=original.file_size,
+                file_type=file_extension[1:],
+                mime_type=mime_type,
+                content_hash=file_hash,
+                source_document_id=original.id,
+                category=category,
+                tags=tags,
+                extracted_text=extracted_text,
+                is_processed=bool(extracted_text),
+                processing_status="completed" if shares_chunks else "pending",
+                processed_at=datetime.utcnow() if shares_chunks else None,
+                uploaded_by=user_id,
+                is_public=is_public
+            )
+            
+            session.add(document)
+            session.commit()
+            session.refresh(document)
+            
+            logger.info(f"ไฟล์ {uploaded_file.name} ซ้ำกับเอกสาร {original.id} "
+                        f"{'ใช้ chunks ร่วมกัน' if shares_chunks else 'ใช้ไฟล์และข้อความร่วมกัน'} (ID: {document.id})")
+            
+            queued = bool(extracted_text) and not shares_chunks
+            if queued:
+                self._enqueue(document.id)
+            
+            return {
+                "success": True,
+                "document_id": document.id,
+                "filename": original.filename,
+                "original_filename": uploaded_file.name,
+                "file_size": original.file_size,
+                "extracted_text": bool(extracted_text),
+                "queued": queued,
+                "duplicate_of": original.id
+            }
+    
+    def delete_document(self, document_id: int) -> bool:
+        """ลบเอกสาร: chunks/embeddings แถวในฐานข้อมูล และไฟล์
+        
+        เอกสารที่อัพโหลดซ้ำใช้ไฟล์ของเอกสารนี้ร่วมกัน: เอกสารที่อ้างอิงเก่าที่สุดกลายเป็นต้นฉบับแทน
+        (เอกสารที่อ้างอิงอื่นย้ายมาอ้างอิงเอกสารนั้น) และลบไฟล์เฉพาะเมื่อไม่มีเอกสารอื่นใช้แล้ว
+        """
+        try:
+            # เอกสารที่อ้างอิงและใช้ chunks ของเอกสารนี้ร่วมกันจะถูกส่งเข้าคิวสร้าง chunks ของตัวเอง
+            if not embedding_service.delete_document_embeddings(document_id):
+                return False
+            
+            with get_db_session() as session:
+                document = session.query(Document).filter(Document.id == document_id).first()
+                if not document:
+                    logger.error(f"ไม่พบเอกสาร ID: {document_id}")
+                    return False
+                
+                references = session.query(Document).filter(
+                    Document.source_document_id == document_id
+                ).order_by(Document.id).all()
+                if references:
+                    heir = references[0]
+                    heir.source_document_id = None
+                    heir.content_hash = heir.content_hash or document.content_hash
+                    for reference in references[1:]:
+                        reference.source_document_id = heir.id
+                    logger.info(f"ส่งต่อไฟล์ของเอกสาร {document_id} ให้เอกสาร {heir.id} "
+                                f"({len(references) - 1} เอกสารอ้างอิงเอกสาร {heir.id} แทน)")
+                
+                file_path = Path(document.file_path)
+                shared = session.query(Document.id).filter(
+                    Document.file_path == document.file_path,
+                    Document.id != document_id
+                ).first() is not None
+                
+                session.query(EmbeddingJob).filter(EmbeddingJob.document_id == document_id).delete(synchronize_session=False)
+                session.query(ChatContext).filter(ChatContext.document_id == document_id).delete(synchronize_session=False)
+                session.delete(document)
+                session.commit()
+            
+            if not shared and file_path.exists():
+                file_path.unlink()
+            
+            logger.info(f"ลบเอกสาร {document_id} เรียบร้อย{' (ไฟล์ยังใช้โดยเอกสารอื่น)' if shared else ''}")
+            return True
+            
+        except Exception as e:
+            logger.error(f"เกิดข้อผิดพลาดในการลบเอกสาร {document_id}: {e}")
+            return False
+    
+    def backfill_content_hashes(self, batch_size: int = 200) -> int:
+        """คำนวณ content_hash ของเอกสารเดิมที่ยังไม่มี (commit ทุก batch, รันซ้ำได้) ส่งคืนจำนวนที่คำนวณ
+        เอกสารที่ไม่พบไฟล์คงค่าว่างไว้ จึงไม่ถูกใช้เป็นต้นฉบับของไฟล์ที่อัพโหลดซ้ำ"""
+        hashed = 0
+        last_id = 0
+        while True:
+            with get_db_session() as session:
+                documents = session.query(Document).filter(
+                    Document.content_hash.is_(None),
+                    Document.source_document_id.is_(None),
+                    Document.id > last_id
+                ).order_by(Document.id).limit(batch_size).all()
+                if not documents:
+                    break
+                
+                for document in documents:
+                    if Path(document.file_path).exists():
+                        document.content_hash = self.calculate_file_hash(Path(document.file_path))
+                        hashed += document.content_hash is not None
+                session.commit()
+                last_id = documents[-1].id
+            logger.info(f"คำนวณ hash ของเอกสารเดิมแล้ว {hashed} เอกสาร (ถึง ID {last_id})")
+        return hashed
+    
     def extract_text_from_file(self, file_path: Path, file_extension: str) -> Optional[str]:
         """สกัดข้อความจากไฟล์ตามประเภท"""
         
@@ -285,13 +465,13 @@ class FileHandler:
             return {}
     
     def calculate_file_hash(self, file_path: Path) -> Optional[str]:
-        """คำนวณ hash ของไฟล์เพื่อตรวจสอบการซ้ำ"""
+        """คำนวณ hash ของไฟล์เพื่อตรวจสอบการซ้ำ (ค่าเดียวกับ content_hash ของเนื้อไฟล์)"""
         try:
-            hash_md5 = hashlib.md5()
+            hasher = hashlib.blake2b(digest_size=32)
             with open(file_path, "rb") as f:
-                for chunk in iter(lambda: f.read(4096), b""):
-                    hash_md5.update(chunk)
-            return hash_md5.hexdigest()
+                for chunk in iter(lambda: f.read(HASH_READ_SIZE), b""):
+                    hasher.update(chunk)
+            return hasher.hexdigest()
         except Exception as e:
             logger.error(f"ไม่สามารถคำนวณ hash ได้: {e}")
             return None
@@ -0,0 +1,72 @@
+"""
+ยูทิลิตี้สำหรับเข้ารหัส/ถอดรหัส embedding แบบ binary
+รูปแบบ: header (magic, มิติ, ชื่อโมเดล) ตามด้วย float32 แบบ little-endian
+"""
+
+import json
+import struct
+from typing import Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+# header: magic 4 ไบต์ (รวม version), มิติ (uint32), ความยาวชื่อโมเดล (uint16), สำรอง (uint16)
+MAGIC = b"JNE\x01"
+_HEADER = struct.Struct("<4sIHH")
+_FLOAT32_LE = np.dtype("<f4")
+
+class VectorCodecError(ValueError):
+    """ข้อผิดพลาดเมื่อข้อมูล embedding ไม่ถูกต้อง"""
+
+def _padded(length: int) -> int:
+    """ปัดความยาวให้ลงตัวที่ 4 ไบต์ เพื่อให้ข้อมูล float32 อยู่ในตำแหน่งที่ align"""
+    return (length + 3) & ~3
+
+def encode_embedding(vector: Sequence[float], model: str = "") -> bytes:
+    """แปลง embedding เป็น bytes (header + float32 little-endian)"""
+    data = np.asarray(vector, dtype=_FLOAT32_LE)
+    if data.ndim != 1:
+        raise VectorCodecError(f"embedding ต้องเป็น vector 1 มิติ (ได้ {data.ndim} มิติ)")
+
+    model_bytes = (model or "").encode("utf-8")
+    if len(model_bytes) > 0xFFFF:
+        raise VectorCodecError("ชื่อโมเดลยาวเกินไป")
+
+    header = _HEADER.pack(MAGIC, data.shape[0], len(model_bytes), 0)
+    padding = b"\x00" * (_padded(len(model_bytes)) - len(model_bytes))
+    return header + model_bytes + padding + data.tobytes()
+
+def decode_header(blob: bytes) -> Tuple[int, str, int]:
+    """อ่าน header ส่งคืน (มิติ, ชื่อโมเดล, ตำแหน่งเริ่มต้นของข้อมูล)"""
+    if len(blob) < _HEADER.size:
+        raise VectorCodecError("ข้อมูล embedding สั้นเกินกว่า header")
+
+    magic, dim, model_length, _ = _HEADER.unpack_from(blob, 0)
+    if magic != MAGIC:
+        raise VectorCodecError(f"ไม่รู้จักรูปแบบ embedding (magic={magic!r})")
+
+    model_start = _HEADER.size
+    model = bytes(blob[model_start:model_start + model_length]).decode("utf-8")
+    offset = model_start + _padded(model_length)
+
+    if len(blob) < offset + dim * _FLOAT32_LE.itemsize:
+        raise VectorCodecError("ข้อมูล embedding ไม่ครบตามมิติใน header")
+
+    return dim, model, offset
+
+def decode_embedding(blob: bytes, expected_model: Optional[str] = None) -> np.ndarray:
+    """แปลง bytes เป็น numpy array ด้วย np.frombuffer (ไม่คัดลอกข้อมูล, array เป็นแบบอ่านอย่างเดียว)"""
+    dim, model, offset = decode_header(blob)
+    if expected_model is not None and model != expected_model:
+        raise VectorCodecError(f"embedding มาจากโมเดล {model} ไม่ใช่ {expected_model}")
+    return np.frombuffer(blob, dtype=_FLOAT32_LE, count=dim, offset=offset)
+
+def load_embedding(blob: Optional[bytes],
+                   legacy: Union[str, Sequence[float], None] = None) -> Optional[np.ndarray]:
+    """อ่าน embedding จากคอลัมน์ binary หรือคอลัมน์ JSON เดิม (สำหรับแถวที่ยังไม่ได้ migrate)"""
+    if blob is not None:
+        return decode_embedding(blob)
+    if legacy is None:
+        return None
+    if isinstance(legacy, (str, bytes)):
+        legacy = json.loads(legacy)
+    return np.asarray(legacy, dtype=np.float32)